@@ -0,0 +1,58 @@
+"""Add subscription period
+
+Revision ID: 1a2b9f3c4d5e
+Revises: 3c76fb0d6937
+Create Date: 2026-10-18 10:12:31.402000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1a2b9f3c4d5e'
+down_revision = '3c76fb0d6937'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.sql import func
+
+
+subscription = table(
+    'subscription',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('period', Integer),
+)
+
+
+subscription_invoice = table(
+    'subscription_invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('subscription_guid', Unicode(64)),
+)
+
+
+def upgrade():
+    op.add_column(
+        'subscription',
+        Column('period', Integer, nullable=False, server_default='0'),
+    )
+    # backfill the period counter with count of yielded invoices
+    invoice_count = (
+        select([func.count(subscription_invoice.c.guid)])
+        .where(
+            subscription_invoice.c.subscription_guid == subscription.c.guid
+        )
+        .as_scalar()
+    )
+    op.execute(
+        subscription.update().values(dict(period=invoice_count))
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('subscription', 'period')
@@ -0,0 +1,48 @@
+"""Add attached funding instrument table
+
+Revision ID: 1e4f8a2b6c93
+Revises: 5b7e2c9d1f30
+Create Date: 2026-10-18 17:11:05.264000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1e4f8a2b6c93'
+down_revision = '5b7e2c9d1f30'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy import DateTime
+from sqlalchemy.schema import ForeignKey
+
+
+def upgrade():
+    op.create_table(
+        'attached_funding_instrument',
+        Column('guid', Unicode(64), primary_key=True),
+        Column(
+            'customer_guid',
+            Unicode(64),
+            ForeignKey(
+                'customer.guid',
+                ondelete='CASCADE', onupdate='CASCADE'
+            ),
+            nullable=False,
+        ),
+        Column('funding_instrument_uri', Unicode(128), nullable=False),
+        Column('created_at', DateTime),
+    )
+    op.create_index(
+        'ix_attached_funding_instrument_customer_guid_uri',
+        'attached_funding_instrument',
+        ['customer_guid', 'funding_instrument_uri'],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        'ix_attached_funding_instrument_customer_guid_uri',
+        table_name='attached_funding_instrument',
+    )
+    op.drop_table('attached_funding_instrument')
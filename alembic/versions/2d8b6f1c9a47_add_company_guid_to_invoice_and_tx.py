@@ -0,0 +1,156 @@
+"""Add company_guid to invoice and transaction
+
+Revision ID: 2d8b6f1c9a47
+Revises: 4f5a0c6e7b81
+Create Date: 2026-10-18 14:26:09.318000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d8b6f1c9a47'
+down_revision = '4f5a0c6e7b81'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.sql import func
+
+
+invoice = table(
+    'invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('company_guid', Unicode(64)),
+)
+
+
+customer_invoice = table(
+    'customer_invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('customer_guid', Unicode(64)),
+)
+
+
+subscription_invoice = table(
+    'subscription_invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('subscription_guid', Unicode(64)),
+)
+
+
+customer = table(
+    'customer',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('company_guid', Unicode(64)),
+)
+
+
+subscription = table(
+    'subscription',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('plan_guid', Unicode(64)),
+)
+
+
+plan = table(
+    'plan',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('company_guid', Unicode(64)),
+)
+
+
+transaction = table(
+    'transaction',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('invoice_guid', Unicode(64)),
+    Column('company_guid', Unicode(64)),
+)
+
+
+def upgrade():
+    op.add_column('invoice', Column('company_guid', Unicode(64)))
+    op.add_column('transaction', Column('company_guid', Unicode(64)))
+
+    # backfill company of invoices from their customers or plans
+    customer_company_guid = (
+        select([customer.c.company_guid])
+        .where(customer_invoice.c.guid == invoice.c.guid)
+        .where(customer.c.guid == customer_invoice.c.customer_guid)
+        .as_scalar()
+    )
+    plan_company_guid = (
+        select([plan.c.company_guid])
+        .where(subscription_invoice.c.guid == invoice.c.guid)
+        .where(subscription.c.guid == subscription_invoice.c.subscription_guid)
+        .where(plan.c.guid == subscription.c.plan_guid)
+        .as_scalar()
+    )
+    op.execute(
+        invoice.update().values(dict(
+            company_guid=func.coalesce(
+                customer_company_guid,
+                plan_company_guid,
+            ),
+        ))
+    )
+    # backfill company of transactions from their invoices
+    invoice_company_guid = (
+        select([invoice.c.company_guid])
+        .where(invoice.c.guid == transaction.c.invoice_guid)
+        .as_scalar()
+    )
+    op.execute(
+        transaction.update().values(dict(company_guid=invoice_company_guid))
+    )
+
+    op.create_index(
+        'ix_invoice_company_guid_created_at',
+        'invoice',
+        ['company_guid', 'created_at'],
+    )
+    op.create_index(
+        'ix_transaction_company_guid_created_at',
+        'transaction',
+        ['company_guid', 'created_at'],
+    )
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        for table_name in ['invoice', 'transaction']:
+            op.alter_column(
+                table_name,
+                'company_guid',
+                existing_type=Unicode(64),
+                nullable=False,
+            )
+            op.create_foreign_key(
+                'fk_{}_company_guid'.format(table_name),
+                table_name,
+                'company',
+                ['company_guid'],
+                ['guid'],
+                ondelete='CASCADE',
+                onupdate='CASCADE',
+            )
+
+
+def downgrade():
+    op.drop_index(
+        'ix_transaction_company_guid_created_at',
+        table_name='transaction',
+    )
+    op.drop_index(
+        'ix_invoice_company_guid_created_at',
+        table_name='invoice',
+    )
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        for table_name in ['invoice', 'transaction']:
+            op.drop_constraint(
+                'fk_{}_company_guid'.format(table_name),
+                table_name,
+                type_='foreignkey',
+            )
+            op.drop_column(table_name, 'company_guid')
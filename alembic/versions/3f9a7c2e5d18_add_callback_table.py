@@ -0,0 +1,47 @@
+"""Add callback table
+
+Revision ID: 3f9a7c2e5d18
+Revises: 6c1d9e3f7a52
+Create Date: 2026-10-18 18:47:20.531000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f9a7c2e5d18'
+down_revision = '6c1d9e3f7a52'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy import UnicodeText
+from sqlalchemy import DateTime
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import UniqueConstraint
+
+
+def upgrade():
+    op.create_table(
+        'callback',
+        Column('guid', Unicode(64), primary_key=True),
+        Column(
+            'company_guid',
+            Unicode(64),
+            ForeignKey(
+                'company.guid',
+                ondelete='CASCADE', onupdate='CASCADE'
+            ),
+            nullable=False,
+        ),
+        Column('processor_id', Unicode(128), nullable=False),
+        Column('payload', UnicodeText, nullable=False),
+        Column('error_message', UnicodeText),
+        Column('locked_by', Unicode(64)),
+        Column('locked_at', DateTime, index=True),
+        Column('processed_at', DateTime, index=True),
+        Column('created_at', DateTime, index=True),
+        UniqueConstraint('company_guid', 'processor_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('callback')
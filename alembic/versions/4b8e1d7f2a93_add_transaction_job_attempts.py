@@ -0,0 +1,35 @@
+"""Add transaction job attempts
+
+Revision ID: 4b8e1d7f2a93
+Revises: 8e5f1a3c9b27
+Create Date: 2026-10-18 21:12:05.318000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b8e1d7f2a93'
+down_revision = '8e5f1a3c9b27'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import UnicodeText
+
+
+def upgrade():
+    op.add_column(
+        'transaction_job',
+        Column('attempts', Integer, nullable=False, server_default='0'),
+    )
+    op.add_column(
+        'transaction_job',
+        Column('error_message', UnicodeText),
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('transaction_job', 'error_message')
+        op.drop_column('transaction_job', 'attempts')
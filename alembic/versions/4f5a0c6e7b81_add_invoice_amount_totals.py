@@ -0,0 +1,78 @@
+"""Add invoice amount totals
+
+Revision ID: 4f5a0c6e7b81
+Revises: 1a2b9f3c4d5e
+Create Date: 2026-10-18 11:03:47.125000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f5a0c6e7b81'
+down_revision = '1a2b9f3c4d5e'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.sql import func
+
+
+invoice = table(
+    'invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('amount', Integer),
+    Column('total_adjustment_amount', Integer),
+    Column('effective_amount', Integer),
+)
+
+
+adjustment = table(
+    'adjustment',
+    Column('adjustment_id', Integer, primary_key=True),
+    Column('invoice_guid', Unicode(64)),
+    Column('amount', Integer),
+)
+
+
+def upgrade():
+    op.add_column(
+        'invoice',
+        Column(
+            'total_adjustment_amount',
+            Integer,
+            nullable=False,
+            server_default='0',
+        ),
+    )
+    op.add_column(
+        'invoice',
+        Column('effective_amount', Integer, nullable=False, server_default='0'),
+    )
+    # backfill the totals from existing adjustments
+    total_adjustment_amount = (
+        select([func.coalesce(func.sum(adjustment.c.amount), 0)])
+        .where(adjustment.c.invoice_guid == invoice.c.guid)
+        .as_scalar()
+    )
+    op.execute(
+        invoice.update().values(dict(
+            total_adjustment_amount=total_adjustment_amount,
+        ))
+    )
+    op.execute(
+        invoice.update().values(dict(
+            effective_amount=(
+                invoice.c.amount + invoice.c.total_adjustment_amount
+            ),
+        ))
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('invoice', 'total_adjustment_amount')
+        op.drop_column('invoice', 'effective_amount')
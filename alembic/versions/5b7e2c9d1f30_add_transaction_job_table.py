@@ -0,0 +1,39 @@
+"""Add transaction job table
+
+Revision ID: 5b7e2c9d1f30
+Revises: 2d8b6f1c9a47
+Create Date: 2026-10-18 16:02:41.527000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c9d1f30'
+down_revision = '2d8b6f1c9a47'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy import DateTime
+from sqlalchemy.schema import ForeignKey
+
+
+def upgrade():
+    op.create_table(
+        'transaction_job',
+        Column(
+            'transaction_guid',
+            Unicode(64),
+            ForeignKey(
+                'transaction.guid',
+                ondelete='CASCADE', onupdate='CASCADE'
+            ),
+            primary_key=True,
+        ),
+        Column('locked_by', Unicode(64)),
+        Column('locked_at', DateTime, index=True),
+        Column('created_at', DateTime, index=True),
+    )
+
+
+def downgrade():
+    op.drop_table('transaction_job')
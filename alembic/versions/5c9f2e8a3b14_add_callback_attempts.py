@@ -0,0 +1,29 @@
+"""Add callback attempts
+
+Revision ID: 5c9f2e8a3b14
+Revises: 4b8e1d7f2a93
+Create Date: 2026-10-18 21:40:27.864000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c9f2e8a3b14'
+down_revision = '4b8e1d7f2a93'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+
+
+def upgrade():
+    op.add_column(
+        'callback',
+        Column('attempts', Integer, nullable=False, server_default='0'),
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('callback', 'attempts')
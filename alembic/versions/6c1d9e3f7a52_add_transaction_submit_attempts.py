@@ -0,0 +1,45 @@
+"""Add transaction submit attempts
+
+Revision ID: 6c1d9e3f7a52
+Revises: 1e4f8a2b6c93
+Create Date: 2026-10-18 18:02:47.153000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6c1d9e3f7a52'
+down_revision = '1e4f8a2b6c93'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy.sql import table
+
+
+transaction = table(
+    'transaction',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('submit_attempts', Integer),
+)
+
+
+def upgrade():
+    op.add_column(
+        'transaction',
+        Column('submit_attempts', Integer, nullable=False,
+               server_default='0'),
+    )
+    # we don't know whether existing transactions were submitted before,
+    # count them as submitted once, so that they will be checked against
+    # the processor before submitting
+    op.execute(
+        transaction.update().values(dict(submit_attempts=1))
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('transaction', 'submit_attempts')
@@ -0,0 +1,74 @@
+"""Add transaction last event
+
+Revision ID: 7d2e4b8a1c65
+Revises: 3f9a7c2e5d18
+Create Date: 2026-10-18 19:20:09.716000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4b8a1c65'
+down_revision = '3f9a7c2e5d18'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy import DateTime
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+
+
+transaction = table(
+    'transaction',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('last_event_at', DateTime),
+    Column('last_event_id', Unicode(128)),
+)
+
+
+transaction_event = table(
+    'transaction_event',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('transaction_guid', Unicode(64)),
+    Column('processor_id', Unicode(128)),
+    Column('occurred_at', DateTime),
+)
+
+
+def upgrade():
+    op.add_column(
+        'transaction',
+        Column('last_event_at', DateTime),
+    )
+    op.add_column(
+        'transaction',
+        Column('last_event_id', Unicode(128)),
+    )
+    # backfill with the latest event of each transaction
+    last_event = (
+        select([transaction_event.c.occurred_at,
+                transaction_event.c.processor_id])
+        .where(transaction_event.c.transaction_guid == transaction.c.guid)
+        .order_by(transaction_event.c.occurred_at.desc())
+        .limit(1)
+    )
+    op.execute(
+        transaction.update().values(dict(
+            last_event_at=(
+                last_event.with_only_columns([transaction_event.c.occurred_at])
+                .as_scalar()
+            ),
+            last_event_id=(
+                last_event.with_only_columns([transaction_event.c.processor_id])
+                .as_scalar()
+            ),
+        ))
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('transaction', 'last_event_id')
+        op.drop_column('transaction', 'last_event_at')
@@ -0,0 +1,80 @@
+"""Add transaction retry schedule
+
+Revision ID: 8e5f1a3c9b27
+Revises: 7d2e4b8a1c65
+Create Date: 2026-10-18 19:54:38.204000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8e5f1a3c9b27'
+down_revision = '7d2e4b8a1c65'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import DateTime
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.sql import func
+
+
+transaction = table(
+    'transaction',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('submit_status', Unicode(64)),
+    Column('failure_count', Integer),
+    Column('next_attempt_at', DateTime),
+    Column('created_at', DateTime),
+)
+
+
+transaction_failure = table(
+    'transaction_failure',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('transaction_guid', Unicode(64)),
+)
+
+
+def upgrade():
+    op.add_column(
+        'transaction',
+        Column('failure_count', Integer, nullable=False, server_default='0'),
+    )
+    op.add_column(
+        'transaction',
+        Column('next_attempt_at', DateTime),
+    )
+    op.create_index(
+        'ix_transaction_submit_status_next_attempt_at',
+        'transaction',
+        ['submit_status', 'next_attempt_at'],
+    )
+    # backfill the failure counter with count of failure records
+    failure_count = (
+        select([func.count(transaction_failure.c.guid)])
+        .where(transaction_failure.c.transaction_guid == transaction.c.guid)
+        .as_scalar()
+    )
+    op.execute(
+        transaction.update().values(dict(failure_count=failure_count))
+    )
+    # transactions waiting to be submitted are due right away
+    op.execute(
+        transaction.update()
+        .where(transaction.c.submit_status.in_([u'STAGED', u'RETRYING']))
+        .values(dict(next_attempt_at=transaction.c.created_at))
+    )
+
+
+def downgrade():
+    op.drop_index(
+        'ix_transaction_submit_status_next_attempt_at',
+        table_name='transaction',
+    )
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('transaction', 'next_attempt_at')
+        op.drop_column('transaction', 'failure_count')
@@ -3,16 +3,46 @@ import binascii
 
 from pyramid.security import Everyone
 from pyramid.security import Authenticated
+from pyramid.httpexceptions import HTTPForbidden
 
 
 class AuthenticationPolicy(object):
 
-    def authenticated_userid(self, request):
+    def authenticated_company_guid(self, request):
+        """Get guid of the authenticated company, it's memorized on the
+        request, as Pyramid may ask for principals several times
+
+        """
+        try:
+            return request.authenticated_company_guid
+        except AttributeError:
+            pass
+        company_guid = None
         api_key = self.unauthenticated_userid(request)
-        if api_key is None:
-            return None
-        company_model = request.model_factory.create_company_model()
-        company = company_model.get_by_api_key(api_key)
+        if api_key is not None:
+            company_model = request.model_factory.create_company_model()
+            company_guid = company_model.get_guid_by_api_key(api_key)
+        request.authenticated_company_guid = company_guid
+        return company_guid
+
+    def authenticated_userid(self, request):
+        try:
+            return request.authenticated_company
+        except AttributeError:
+            pass
+        company = None
+        company_guid = self.authenticated_company_guid(request)
+        if company_guid is not None:
+            company_model = request.model_factory.create_company_model()
+            company = company_model.get(company_guid)
+            # the guid might be cached before the company was deleted (by
+            # another process for instance)
+            if company is not None and company.deleted:
+                request.authenticated_company = None
+                raise HTTPForbidden(
+                    'Company {} is deleted'.format(company_guid)
+                )
+        request.authenticated_company = company
         return company
 
     def unauthenticated_userid(self, request):
@@ -27,10 +57,12 @@ class AuthenticationPolicy(object):
         if api_key is None:
             return effective_principals
 
-        company = self.authenticated_userid(request)
-        if company is not None:
+        # only the guid is needed here, so that we don't have to load the
+        # company when the guid is cached
+        company_guid = self.authenticated_company_guid(request)
+        if company_guid is not None:
             effective_principals.append(Authenticated)
-            effective_principals.append('company:{}'.format(company.guid))
+            effective_principals.append('company:{}'.format(company_guid))
         return effective_principals
 
     def remember(self, request, principal, **kw):
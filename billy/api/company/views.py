@@ -2,11 +2,13 @@ from __future__ import unicode_literals
 
 import transaction as db_transaction
 from pyramid.view import view_config
+from pyramid.settings import asbool
 from pyramid.security import NO_PERMISSION_REQUIRED
 from pyramid.security import Allow
 from pyramid.security import Everyone
 
 from billy.models.company import CompanyModel
+from billy.models.callback import DuplicateCallbackError
 from billy.api.utils import validate_form
 from billy.api.resources import BaseResource
 from billy.api.resources import URLMapResource
@@ -101,6 +103,9 @@ class CallbackView(BaseView):
     @view_config(request_method='POST')
     def post(self):
         company = self.context.company
+        settings = self.request.registry.settings
+        if asbool(settings.get('billy.callback.async', False)):
+            return self.queue(company)
         processor = self.request.model_factory.create_processor()
         processor.configure_api_key(company.processor_key)
         update_db = processor.callback(company, self.request.json)
@@ -109,3 +114,16 @@ class CallbackView(BaseView):
                 update_db(self.request.model_factory)
             return dict(code='ok')
         return dict(code='ignore')
+
+    def queue(self, company):
+        """Put the callback into the inbox and return right away, it will be
+        verified and applied by the callback worker
+
+        """
+        callback_model = self.request.model_factory.create_callback_model()
+        try:
+            with db_transaction.manager:
+                callback_model.create(company, self.request.json)
+        except DuplicateCallbackError:
+            return dict(code='duplicate')
+        return dict(code='queued')
@@ -2,10 +2,38 @@ from __future__ import unicode_literals
 
 from wtforms import Form
 from wtforms import TextField
+from wtforms import IntegerField
 from wtforms import validators
 
+from billy.api.utils import STATEMENT_REXP
+from billy.api.utils import MINIMUM_AMOUNT
+from billy.api.utils import ISO8601Field
+from billy.api.subscription.forms import NoPastValidator
+
 
 class CustomerCreateForm(Form):
     processor_uri = TextField('URI of customer in processor', [
         validators.Optional(),
     ])
+
+
+class SubscriptionImportForm(Form):
+    plan_guid = TextField('Plan GUID', [
+        validators.Required(),
+    ])
+    funding_instrument_uri = TextField('Funding instrument URI', [
+        validators.Optional(),
+    ])
+    amount = IntegerField('Amount', [
+        validators.Optional(),
+        validators.NumberRange(min=MINIMUM_AMOUNT)
+    ])
+    appears_on_statement_as = TextField('Appears on statement as', [
+        validators.Optional(),
+        validators.Regexp(STATEMENT_REXP),
+        validators.Length(max=18),
+    ])
+    started_at = ISO8601Field('Started at datetime', [
+        validators.Optional(),
+        NoPastValidator(),
+    ])
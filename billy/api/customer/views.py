@@ -1,22 +1,199 @@
 from __future__ import unicode_literals
 
 import transaction as db_transaction
+from webob.multidict import MultiDict
 from pyramid.view import view_config
 from pyramid.security import authenticated_userid
 from pyramid.httpexceptions import HTTPBadRequest
 
+from billy.errors import BillyError
 from billy.models.customer import CustomerModel
+from billy.models.customer import CustomerBulkCreateError
 from billy.models.invoice import InvoiceModel
 from billy.models.subscription import SubscriptionModel
 from billy.models.transaction import TransactionModel
 from billy.api.utils import validate_form
 from billy.api.utils import list_by_context
+from billy.api.utils import form_errors_to_message
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
 from billy.api.views import EntityView
 from billy.api.views import api_view_defaults
+from billy.renderers import RenderPrefetch
+from billy.utils.generic import map_concurrently
 from .forms import CustomerCreateForm
+from .forms import SubscriptionImportForm
+
+
+def parse_import_record(data):
+    """Validate a customer record (a dict decoded from JSON) to import and
+    return a tuple of processor URI and a list of keyword arguments for
+    `SubscriptionModel.create_many`, with `plan_guid` instead of `plan`.
+    ValueError will be raised if it is invalid
+
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Customer should be an object')
+    processor_uri = data.get('processor_uri')
+    if processor_uri is not None and not isinstance(processor_uri, basestring):
+        raise ValueError('Invalid processor_uri: {}'.format(repr(processor_uri)))
+    subscriptions = data.get('subscriptions') or []
+    if not isinstance(subscriptions, list):
+        raise ValueError('subscriptions should be a list')
+    result = []
+    for index, subscription in enumerate(subscriptions):
+        if not isinstance(subscription, dict):
+            raise ValueError('subscriptions should be a list of objects')
+        params = MultiDict(
+            (key, unicode(value)) for key, value in subscription.iteritems()
+            if value is not None
+        )
+        form = SubscriptionImportForm(params)
+        if not form.validate():
+            raise ValueError('subscriptions[{}]: {}'.format(
+                index, form_errors_to_message(form.errors),
+            ))
+        kwargs = dict(
+            plan_guid=form.data['plan_guid'],
+            amount=form.data.get('amount'),
+            started_at=form.data.get('started_at'),
+        )
+        for key in ['funding_instrument_uri', 'appears_on_statement_as']:
+            kwargs[key] = form.data.get(key) or None
+        result.append(kwargs)
+    return processor_uri or None, result
+
+
+def import_customers(model_factory, company, records, concurrency=1):
+    """Import customers and their subscriptions of a company from given
+    records (dicts decoded from JSON), all of them are validated before
+    creating, if any of them is invalid, none of them will be created and
+    CustomerBulkCreateError with errors of each invalid record will be raised.
+    A list of (customer, subscriptions) tuples will be returned. Invoices of
+    imported subscriptions are not yielded here, they will be yielded by the
+    transaction processing script later
+
+    :param concurrency: number of threads for calling the processor
+    """
+    customer_model = model_factory.create_customer_model()
+    plan_model = model_factory.create_plan_model()
+    subscription_model = model_factory.create_subscription_model()
+
+    errors = []
+    parsed = []
+    for index, record in enumerate(records):
+        try:
+            parsed.append((index, parse_import_record(record)))
+        except ValueError, e:
+            errors.append(dict(index=index, error_message=unicode(e)))
+
+    # check plans in batch
+    plans = plan_model.get_many(
+        kwargs['plan_guid']
+        for _, (_, subscriptions) in parsed
+        for kwargs in subscriptions
+    )
+    plans = dict((plan.guid, plan) for plan in plans)
+    # validate each funding instrument only once, concurrently
+    get_processor = model_factory.create_processor_getter(
+        company.processor_key,
+    )
+
+    def validate_funding_instrument(uri):
+        try:
+            get_processor().validate_funding_instrument(uri)
+        except BillyError, e:
+            return e.msg
+
+    funding_instrument_uris = list(set(
+        kwargs['funding_instrument_uri']
+        for _, (_, subscriptions) in parsed
+        for kwargs in subscriptions
+        if kwargs['funding_instrument_uri'] is not None
+    ))
+    funding_instrument_errors = dict(zip(
+        funding_instrument_uris,
+        map_concurrently(
+            validate_funding_instrument,
+            funding_instrument_uris,
+            concurrency,
+        ),
+    ))
+
+    valid_records = []
+    for index, (processor_uri, subscriptions) in parsed:
+        error_message = None
+        for sub_index, kwargs in enumerate(subscriptions):
+            plan_guid = kwargs.pop('plan_guid')
+            plan = plans.get(plan_guid)
+            if plan is None:
+                error_message = 'No such plan {}'.format(plan_guid)
+            elif plan.company_guid != company.guid:
+                error_message = 'Can only subscribe to your own plan'
+            elif plan.deleted:
+                error_message = 'Cannot subscript to a deleted plan'
+            else:
+                error_message = funding_instrument_errors.get(
+                    kwargs['funding_instrument_uri']
+                )
+            if error_message is not None:
+                error_message = 'subscriptions[{}]: {}'.format(
+                    sub_index, error_message,
+                )
+                break
+            kwargs['plan'] = plan
+        if error_message is not None:
+            errors.append(dict(index=index, error_message=error_message))
+            continue
+        valid_records.append((index, processor_uri, subscriptions))
+
+    processor_uris = [processor_uri for _, processor_uri, _ in valid_records]
+    if errors:
+        # only validate processor URIs for reporting errors, we don't want to
+        # create customers in processor when the import is going to fail
+        customer_errors = customer_model.validate_many(
+            company, processor_uris, concurrency,
+        )
+    else:
+        try:
+            customers = customer_model.create_many(
+                company=company,
+                processor_uris=processor_uris,
+                concurrency=concurrency,
+            )
+            customer_errors = []
+        except CustomerBulkCreateError, e:
+            customer_errors = e.errors
+    # map indexes of valid records back to the given records
+    errors.extend(
+        dict(
+            index=valid_records[error['index']][0],
+            error_message=error['error_message'],
+        )
+        for error in customer_errors
+    )
+    if errors:
+        errors.sort(key=lambda error: error['index'])
+        raise CustomerBulkCreateError(
+            '{} of {} customers are invalid'.format(len(errors), len(records)),
+            errors=errors,
+        )
+
+    subscriptions = []
+    for customer, (_, _, customer_subscriptions) in zip(
+        customers, valid_records,
+    ):
+        for kwargs in customer_subscriptions:
+            kwargs['customer'] = customer
+            subscriptions.append(kwargs)
+    subscriptions = iter(subscription_model.create_many(subscriptions))
+    return [
+        (customer, [next(subscriptions) for _ in customer_subscriptions])
+        for customer, (_, _, customer_subscriptions) in zip(
+            customers, valid_records,
+        )
+    ]
 
 
 class CustomerResource(EntityResource):
@@ -24,11 +201,16 @@ class CustomerResource(EntityResource):
     def company(self):
         return self.entity.company
 
+    @property
+    def company_guid(self):
+        return self.entity.company_guid
+
 
 class CustomerIndexResource(IndexResource):
     MODEL_CLS = CustomerModel
     ENTITY_NAME = 'customer'
     ENTITY_RESOURCE = CustomerResource
+    VIEW_NAMES = ('import',)
 
 
 @api_view_defaults(context=CustomerIndexResource)
@@ -58,6 +240,75 @@ class CustomerIndexView(IndexView):
             )
         return customer
 
+    @view_config(name='import', request_method='POST', permission='create')
+    def import_(self):
+        """Import customers and their subscriptions in bulk from a JSON array
+        in request body, all of them are validated before creating, if any
+        of them is invalid, none of them will be created, and errors of each
+        invalid customer will be returned
+
+        """
+        request = self.request
+        settings = request.registry.settings
+        max_size = int(settings.get('api.customer.import_max_size', 1000))
+        concurrency = int(settings.get('billy.import.concurrency', 8))
+        model = request.model_factory.create_customer_model()
+        subscription_model = request.model_factory.create_subscription_model()
+        company = authenticated_userid(request)
+
+        try:
+            data = request.json_body
+        except ValueError:
+            data = None
+        if not isinstance(data, list) or not data:
+            return HTTPBadRequest('Request body should be a JSON array of '
+                                  'customers')
+        if len(data) > max_size:
+            return HTTPBadRequest('Cannot import more than {} customers at '
+                                  'once'.format(max_size))
+
+        with db_transaction.manager:
+            records = import_customers(
+                request.model_factory,
+                company,
+                data,
+                concurrency=concurrency,
+            )
+            guids = [
+                (customer.guid, [
+                    subscription.guid for subscription in subscriptions
+                ])
+                for customer, subscriptions in records
+            ]
+        # load them back in batch for rendering
+        customers = dict(
+            (customer.guid, customer) for customer in model.get_many(
+                customer_guid for customer_guid, _ in guids
+            )
+        )
+        subscriptions = dict(
+            (subscription.guid, subscription)
+            for subscription in subscription_model.get_many(
+                subscription_guid
+                for _, subscription_guids in guids
+                for subscription_guid in subscription_guids
+            )
+        )
+        request.render_prefetch = RenderPrefetch.load(
+            model.session,
+            customers.values() + subscriptions.values(),
+        )
+        return dict(items=[
+            dict(
+                customer=customers[customer_guid],
+                subscriptions=[
+                    subscriptions[subscription_guid]
+                    for subscription_guid in subscription_guids
+                ],
+            )
+            for customer_guid, subscription_guids in guids
+        ])
+
 
 @api_view_defaults(context=CustomerResource)
 class CustomerView(EntityView):
@@ -5,9 +5,12 @@ from pyramid.renderers import render_to_response
 from pyramid.security import NO_PERMISSION_REQUIRED
 
 from billy.errors import BillyError
+from billy.errors import ProcessorUnavailableError
 from billy.models.subscription import SubscriptionCanceledError
 from billy.models.invoice import InvalidOperationError
 from billy.models.invoice import DuplicateExternalIDError
+from billy.models.invoice import InvoiceBulkCreateError
+from billy.models.customer import CustomerBulkCreateError
 from billy.models.processors.balanced_payments import InvalidURIFormat
 
 #: the default error status code
@@ -17,7 +20,10 @@ ERROR_STATUS_MAP = {
     SubscriptionCanceledError: 400,
     InvalidOperationError: 400,
     DuplicateExternalIDError: 409,
+    InvoiceBulkCreateError: 400,
+    CustomerBulkCreateError: 400,
     InvalidURIFormat: 400,
+    ProcessorUnavailableError: 503,
 }
 
 
@@ -25,12 +31,17 @@ def error_response(request, error, status):
     """Create an error response from given error
 
     """
+    value = dict(
+        error_class=error.__class__.__name__,
+        error_message=error.msg,
+    )
+    # errors of each item for bulk operations
+    errors = getattr(error, 'errors', None)
+    if errors is not None:
+        value['errors'] = errors
     response = render_to_response(
         renderer_name='json',
-        value=dict(
-            error_class=error.__class__.__name__,
-            error_message=error.msg,
-        ),
+        value=value,
         request=request,
     )
     response.status = status
@@ -37,6 +37,16 @@ class InvoiceCreateForm(Form):
     # TODO: items
 
 
+class InvoiceBulkCreateForm(InvoiceCreateForm):
+    """Form of an invoice in bulk creation, customers are checked in batch
+    instead of querying one by one
+
+    """
+    customer_guid = TextField('Customer GUID', [
+        validators.Required(),
+    ])
+
+
 class InvoiceUpdateForm(Form):
     funding_instrument_uri = TextField('Funding instrument URI', [
         validators.Required(),
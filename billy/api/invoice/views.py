@@ -1,25 +1,56 @@
 from __future__ import unicode_literals
 
 import transaction as db_transaction
+from webob.multidict import MultiDict
 from pyramid.view import view_config
 from pyramid.security import authenticated_userid
 from pyramid.httpexceptions import HTTPForbidden
 from pyramid.httpexceptions import HTTPBadRequest
 
+from billy.errors import BillyError
 from billy.models.invoice import InvoiceModel
+from billy.models.invoice import InvoiceBulkCreateError
 from billy.models.transaction import TransactionModel
 from billy.api.utils import validate_form
 from billy.api.utils import list_by_context
+from billy.api.utils import export_by_context
+from billy.api.utils import form_errors_to_message
+from billy.api.utils import submit_transactions
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
 from billy.api.views import EntityView
 from billy.api.views import api_view_defaults
+from billy.renderers import RenderPrefetch
 from .forms import InvoiceCreateForm
+from .forms import InvoiceBulkCreateForm
 from .forms import InvoiceUpdateForm
 from .forms import InvoiceRefundForm
 
 
+#: fields of invoice in exported CSV
+EXPORT_FIELDS = [
+    'guid',
+    'invoice_type',
+    'transaction_type',
+    'status',
+    'amount',
+    'effective_amount',
+    'total_adjustment_amount',
+    'title',
+    'appears_on_statement_as',
+    'funding_instrument_uri',
+    'customer_guid',
+    'external_id',
+    'subscription_guid',
+    'scheduled_at',
+    'items',
+    'adjustments',
+    'created_at',
+    'updated_at',
+]
+
+
 def parse_items(request, prefix, keywords):
     """This function parsed items from request in following form
 
@@ -60,16 +91,84 @@ def parse_items(request, prefix, keywords):
     return [items[key] for key in keys]
 
 
+def parse_bulk_invoice(data):
+    """Validate an invoice (a dict decoded from JSON) in bulk creation and
+    return keyword arguments for `InvoiceModel.create_many`, with
+    `customer_guid` instead of `customer`. ValueError will be raised if it
+    is invalid
+
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Invoice should be an object')
+    params = MultiDict(
+        (key, unicode(value)) for key, value in data.iteritems()
+        if key not in ('items', 'adjustments') and value is not None
+    )
+    form = InvoiceBulkCreateForm(params)
+    if not form.validate():
+        raise ValueError(form_errors_to_message(form.errors))
+    kwargs = dict(
+        customer_guid=form.data['customer_guid'],
+        amount=form.data['amount'],
+    )
+    for key in [
+        'funding_instrument_uri',
+        'title',
+        'external_id',
+        'appears_on_statement_as',
+    ]:
+        kwargs[key] = form.data.get(key) or None
+
+    def check_list(key, fields, optional_fields):
+        records = data.get(key) or []
+        if not isinstance(records, list):
+            raise ValueError('{} should be a list'.format(key))
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError('{} should be a list of objects'.format(key))
+            for field, field_type in fields + optional_fields:
+                value = record.get(field)
+                if value is None and (field, field_type) in optional_fields:
+                    continue
+                if not isinstance(value, field_type):
+                    raise ValueError('Invalid {} of {}: {}'.format(
+                        field, key, repr(value)
+                    ))
+        return records or None
+
+    kwargs['items'] = check_list(
+        'items',
+        fields=[('name', basestring), ('amount', (int, long))],
+        optional_fields=[
+            ('type', basestring),
+            ('quantity', (int, long)),
+            ('volume', (int, long)),
+            ('unit', basestring),
+        ],
+    )
+    kwargs['adjustments'] = check_list(
+        'adjustments',
+        fields=[('amount', (int, long))],
+        optional_fields=[('reason', basestring)],
+    )
+    return kwargs
+
+
 class InvoiceResource(EntityResource):
     @property
     def company(self):
         return self.entity.customer.company
 
+    @property
+    def company_guid(self):
+        return self.entity.company_guid
+
 
 class InvoiceIndexResource(IndexResource):
     MODEL_CLS = InvoiceModel
     ENTITY_NAME = 'invoice'
     ENTITY_RESOURCE = InvoiceResource
+    VIEW_NAMES = ('export', 'bulk')
 
 
 @api_view_defaults(context=InvoiceIndexResource)
@@ -81,6 +180,17 @@ class InvoiceIndexView(IndexView):
         company = authenticated_userid(request)
         return list_by_context(request, InvoiceModel, company)
 
+    @view_config(name='export', request_method='GET', permission='view')
+    def export(self):
+        request = self.request
+        company = authenticated_userid(request)
+        return export_by_context(
+            request,
+            InvoiceModel,
+            company,
+            fields=EXPORT_FIELDS,
+        )
+
     @view_config(request_method='POST', permission='create')
     def post(self):
         request = self.request
@@ -88,7 +198,6 @@ class InvoiceIndexView(IndexView):
         form = validate_form(InvoiceCreateForm, request)
         model = request.model_factory.create_invoice_model()
         customer_model = request.model_factory.create_customer_model()
-        tx_model = request.model_factory.create_transaction_model()
         company = authenticated_userid(request)
        
         customer_guid = form.data['customer_guid']
@@ -151,12 +260,102 @@ class InvoiceIndexView(IndexView):
             )
         # funding_instrument_uri is set, just process all transactions right away
         if funding_instrument_uri is not None:
-            transactions = list(invoice.transactions)
-            if transactions:
-                with db_transaction.manager:
-                    tx_model.process_transactions(transactions)
+            submit_transactions(request, invoice.transactions)
         return invoice
 
+    @view_config(name='bulk', request_method='POST', permission='create')
+    def bulk(self):
+        """Create invoices in bulk from a JSON array in request body, all
+        of them are validated before creating, if any of them is invalid,
+        none of them will be created, and errors of each invalid invoice
+        will be returned
+
+        """
+        request = self.request
+        settings = request.registry.settings
+        max_size = int(settings.get('api.invoice.bulk_max_size', 1000))
+        model = request.model_factory.create_invoice_model()
+        customer_model = request.model_factory.create_customer_model()
+        company = authenticated_userid(request)
+
+        try:
+            data = request.json_body
+        except ValueError:
+            data = None
+        if not isinstance(data, list) or not data:
+            return HTTPBadRequest('Request body should be a JSON array of '
+                                  'invoices')
+        if len(data) > max_size:
+            return HTTPBadRequest('Cannot create more than {} invoices at '
+                                  'once'.format(max_size))
+
+        errors = []
+        invoices = []
+        for index, item in enumerate(data):
+            try:
+                invoices.append((index, parse_bulk_invoice(item)))
+            except ValueError, e:
+                errors.append(dict(index=index, error_message=unicode(e)))
+
+        # check customers in batch
+        customers = customer_model.get_many(
+            kwargs['customer_guid'] for _, kwargs in invoices
+        )
+        customers = dict((customer.guid, customer) for customer in customers)
+        # validate each funding instrument only once
+        funding_instrument_errors = {}
+        funding_instrument_uris = set(
+            kwargs['funding_instrument_uri'] for _, kwargs in invoices
+            if kwargs['funding_instrument_uri'] is not None
+        )
+        if funding_instrument_uris:
+            processor = request.model_factory.create_processor()
+            processor.configure_api_key(company.processor_key)
+            for uri in funding_instrument_uris:
+                try:
+                    processor.validate_funding_instrument(uri)
+                except BillyError, e:
+                    funding_instrument_errors[uri] = e.msg
+
+        valid_invoices = []
+        for index, kwargs in invoices:
+            customer_guid = kwargs.pop('customer_guid')
+            customer = customers.get(customer_guid)
+            if customer is None:
+                error_message = 'No such customer {}'.format(customer_guid)
+            elif customer.company_guid != company.guid:
+                error_message = ('Can only create an invoice for your own '
+                                 'customer')
+            elif customer.deleted:
+                error_message = ('Cannot create an invoice for a deleted '
+                                 'customer')
+            else:
+                error_message = funding_instrument_errors.get(
+                    kwargs['funding_instrument_uri']
+                )
+            if error_message is not None:
+                errors.append(dict(index=index, error_message=error_message))
+                continue
+            kwargs['customer'] = customer
+            valid_invoices.append(kwargs)
+        if errors:
+            errors.sort(key=lambda error: error['index'])
+            raise InvoiceBulkCreateError(
+                '{} of {} invoices are invalid'.format(len(errors), len(data)),
+                errors=errors,
+            )
+
+        with db_transaction.manager:
+            invoices = model.create_many(valid_invoices)
+            guids = [invoice.guid for invoice in invoices]
+        # load them back in batch for rendering
+        invoices = dict(
+            (invoice.guid, invoice) for invoice in model.get_many(guids)
+        )
+        invoices = [invoices[guid] for guid in guids]
+        request.render_prefetch = RenderPrefetch.load(model.session, invoices)
+        return dict(items=invoices)
+
 
 @api_view_defaults(context=InvoiceResource)
 class InvoiceView(EntityView):
@@ -172,7 +371,6 @@ class InvoiceView(EntityView):
         invoice = self.context.entity
         form = validate_form(InvoiceUpdateForm, request)
         model = request.model_factory.create_invoice_model()
-        tx_model = request.model_factory.create_transaction_model()
 
         funding_instrument_uri = form.data.get('funding_instrument_uri')
        
@@ -183,9 +381,8 @@ class InvoiceView(EntityView):
             )
 
         # funding_instrument_uri is set, just process all transactions right away
-        if funding_instrument_uri and transactions:
-            with db_transaction.manager:
-                tx_model.process_transactions(transactions)
+        if funding_instrument_uri:
+            submit_transactions(request, transactions)
 
         return invoice
 
@@ -198,7 +395,6 @@ class InvoiceView(EntityView):
         invoice = self.context.entity
         form = validate_form(InvoiceRefundForm, request)
         invoice_model = request.model_factory.create_invoice_model()
-        tx_model = request.model_factory.create_transaction_model()
 
         amount = form.data['amount']
 
@@ -209,9 +405,7 @@ class InvoiceView(EntityView):
             )
 
         # funding_instrument_uri is set, just process all transactions right away
-        if transactions:
-            with db_transaction.manager:
-                tx_model.process_transactions(transactions)
+        submit_transactions(request, transactions)
         return invoice
 
     @view_config(name='cancel', request_method='POST')
@@ -25,6 +25,10 @@ class PlanResource(EntityResource):
     def company(self):
         return self.entity.company
 
+    @property
+    def company_guid(self):
+        return self.entity.company_guid
+
 
 class PlanIndexResource(IndexResource):
     MODEL_CLS = PlanModel
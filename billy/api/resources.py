@@ -31,6 +31,9 @@ class IndexResource(BaseResource):
     #: entity resource
     ENTITY_RESOURCE = None
 
+    #: names of views on the index, they should not be looked up as guid
+    VIEW_NAMES = ()
+
     def __init__(self, request, parent=None, name=None):
         super(IndexResource, self).__init__(request, parent, name)
         assert self.MODEL_CLS is not None
@@ -38,6 +41,9 @@ class IndexResource(BaseResource):
         assert self.ENTITY_RESOURCE is not None
 
     def __getitem__(self, key):
+        if key in self.VIEW_NAMES:
+            # let the traverser treat it as the view name
+            raise KeyError(key)
         model = self.MODEL_CLS(self.request.model_factory)
         entity = model.get(key)
         if entity is None:
@@ -51,7 +57,7 @@ class EntityResource(BaseResource):
         super(EntityResource, self).__init__(request, parent, name)
         self.entity = entity
         # make sure only the owner company can access the entity
-        company_principal = 'company:{}'.format(self.company.guid)
+        company_principal = 'company:{}'.format(self.company_guid)
         self.__acl__ = [
             #       principal, action
             (Allow, company_principal, 'view'),
@@ -65,6 +71,14 @@ class EntityResource(BaseResource):
     def company(self):
         raise NotImplemented()
 
+    @property
+    def company_guid(self):
+        """Guid of the owner company, override it to avoid loading the
+        company only for checking the permission
+
+        """
+        return self.company.guid
+
 
 class URLMapResource(BaseResource):
 
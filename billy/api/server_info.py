@@ -4,6 +4,8 @@ from pyramid.view import view_config
 from pyramid.security import NO_PERMISSION_REQUIRED
 
 from billy import version
+from billy.db.pool import get_pool_status
+from billy.utils.metrics import processor_latency
 
 
 @view_config(
@@ -21,10 +23,24 @@ def server_info(request):
     last_transaction_dt = None
     if last_transaction is not None:
         last_transaction_dt = last_transaction.created_at.isoformat()
+    settings = request.registry.settings
+    replica_pool = None
+    if settings.get('replica_engine') is not None:
+        replica_pool = get_pool_status(
+            settings,
+            engine=settings['replica_engine'],
+        )
+    processor_breaker = None
+    if settings.get('processor_breaker') is not None:
+        processor_breaker = settings['processor_breaker'].status()
     return dict(
         server='Billy - The recurring payment server',
         powered_by='BalancedPayments.com',
         version=version.VERSION,
         revision=version.REVISION,
         last_transaction_created_at=last_transaction_dt,
+        db_pool=get_pool_status(settings),
+        db_replica_pool=replica_pool,
+        processor_breaker=processor_breaker,
+        processor_latency=processor_latency.snapshot(),
     )
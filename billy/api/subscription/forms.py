@@ -1,11 +1,8 @@
 from __future__ import unicode_literals
 
-import pytz
-import iso8601
 from wtforms import Form
 from wtforms import TextField
 from wtforms import IntegerField
-from wtforms import Field
 from wtforms import validators
 
 from billy.db import tables
@@ -14,23 +11,7 @@ from billy.models.plan import PlanModel
 from billy.api.utils import RecordExistValidator
 from billy.api.utils import STATEMENT_REXP
 from billy.api.utils import MINIMUM_AMOUNT
-
-
-class ISO8601Field(Field):
-    """This filed validates and converts input ISO8601 into UTC naive
-    datetime
-
-    """
-
-    def process_formdata(self, valuelist):
-        if not valuelist:
-            return
-        try:
-            self.data = iso8601.parse_date(valuelist[0])
-        except iso8601.ParseError:
-            raise ValueError(self.gettext('Invalid ISO8601 datetime {}')
-                             .format(valuelist[0]))
-        self.data = self.data.astimezone(pytz.utc)
+from billy.api.utils import ISO8601Field
 
 
 class NoPastValidator(object):
@@ -11,6 +11,7 @@ from billy.models.invoice import InvoiceModel
 from billy.models.transaction import TransactionModel
 from billy.api.utils import validate_form
 from billy.api.utils import list_by_context
+from billy.api.utils import submit_transactions
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
@@ -24,6 +25,10 @@ class SubscriptionResource(EntityResource):
     def company(self):
         return self.entity.plan.company
 
+    @property
+    def company_guid(self):
+        return self.entity.plan.company_guid
+
 
 class SubscriptionIndexResource(IndexResource):
     MODEL_CLS = SubscriptionModel
@@ -61,7 +66,6 @@ class SubscriptionIndexView(IndexView):
         sub_model = request.model_factory.create_subscription_model()
         plan_model = request.model_factory.create_plan_model()
         customer_model = request.model_factory.create_customer_model()
-        tx_model = request.model_factory.create_transaction_model()
 
         customer = customer_model.get(customer_guid)
         if customer.company_guid != company.guid:
@@ -92,8 +96,7 @@ class SubscriptionIndexView(IndexView):
             invoices = subscription.invoices
         # this is not a deferred subscription, just process transactions right away
         if started_at is None:
-            with db_transaction.manager:
-                tx_model.process_transactions(invoices[0].transactions)
+            submit_transactions(request, invoices[0].transactions)
 
         return subscription
 
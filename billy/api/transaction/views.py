@@ -6,6 +6,7 @@ from pyramid.security import authenticated_userid
 from billy.models.invoice import InvoiceModel
 from billy.models.transaction import TransactionModel
 from billy.api.utils import list_by_context
+from billy.api.utils import export_by_context
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
@@ -13,6 +14,24 @@ from billy.api.views import EntityView
 from billy.api.views import api_view_defaults
 
 
+#: fields of transaction in exported CSV
+EXPORT_FIELDS = [
+    'guid',
+    'invoice_guid',
+    'transaction_type',
+    'submit_status',
+    'status',
+    'amount',
+    'funding_instrument_uri',
+    'processor_uri',
+    'appears_on_statement_as',
+    'failure_count',
+    'failures',
+    'created_at',
+    'updated_at',
+]
+
+
 class TransactionResource(EntityResource):
     @property
     def company(self):
@@ -23,11 +42,16 @@ class TransactionResource(EntityResource):
             company = self.entity.invoice.customer.company
         return company
 
+    @property
+    def company_guid(self):
+        return self.entity.company_guid
+
 
 class TransactionIndexResource(IndexResource):
     MODEL_CLS = TransactionModel
     ENTITY_NAME = 'transaction'
     ENTITY_RESOURCE = TransactionResource
+    VIEW_NAMES = ('export', )
 
 
 @api_view_defaults(context=TransactionIndexResource)
@@ -39,6 +63,17 @@ class TransactionIndexView(IndexView):
         company = authenticated_userid(request)
         return list_by_context(request, TransactionModel, company)
 
+    @view_config(name='export', request_method='GET', permission='view')
+    def export(self):
+        request = self.request
+        company = authenticated_userid(request)
+        return export_by_context(
+            request,
+            TransactionModel,
+            company,
+            fields=EXPORT_FIELDS,
+        )
+
 
 @api_view_defaults(context=TransactionResource)
 class TransactionView(EntityView):
@@ -1,8 +1,28 @@
 from __future__ import unicode_literals
+from __future__ import absolute_import
 import re
+import csv
+import base64
+import functools
+import itertools
+import StringIO
 
+import pytz
+import iso8601
+import transaction as db_transaction
+from wtforms import Form
+from wtforms import Field
+from wtforms import TextField
+from wtforms import validators
+from sqlalchemy.orm import sessionmaker
 from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.interfaces import IRendererFactory
 from pyramid.path import DottedNameResolver
+from pyramid.settings import asbool
+
+from billy.models.base import InvalidCursorError
+from billy.renderers import RenderPrefetch
+from billy.renderers import get_serializer
 
 # the minimum amount in a transaction
 MINIMUM_AMOUNT = 50
@@ -17,6 +37,16 @@ STATEMENT_REXP = (
 )
 
 
+def form_errors_to_message(errors):
+    """Convert WTForm errors into a readable one-line message
+
+    """
+    return '; '.join(
+        '{}: {}'.format(param_key, ' '.join(param_errors))
+        for param_key, param_errors in sorted(errors.iteritems())
+    )
+
+
 def form_errors_to_bad_request(errors):
     """Convert WTForm errors into readable bad request
 
@@ -72,6 +102,56 @@ class RecordExistValidator(object):
             raise ValueError(msg)
 
 
+class ISO8601Field(Field):
+    """This filed validates and converts input ISO8601 into UTC naive
+    datetime
+
+    """
+
+    def process_formdata(self, valuelist):
+        if not valuelist:
+            return
+        try:
+            self.data = iso8601.parse_date(valuelist[0])
+        except iso8601.ParseError:
+            raise ValueError(self.gettext('Invalid ISO8601 datetime {}')
+                             .format(valuelist[0]))
+        self.data = self.data.astimezone(pytz.utc)
+
+
+class ExportForm(Form):
+    created_after = ISO8601Field('Created after datetime', [
+        validators.Optional(),
+    ])
+    created_before = ISO8601Field('Created before datetime', [
+        validators.Optional(),
+    ])
+    format = TextField('Export format', [
+        validators.Optional(),
+        validators.AnyOf(['json', 'csv']),
+    ])
+
+
+def encode_cursor(guid):
+    """Encode guid of a record into an opaque pagination cursor
+
+    """
+    return base64.urlsafe_b64encode(guid.encode('utf8')).rstrip(b'=')
+
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor into guid of the record, HTTPBadRequest
+    will be raised if the cursor is malformed
+
+    """
+    padding = '=' * (-len(cursor) % 4)
+    try:
+        guid = base64.urlsafe_b64decode((cursor + padding).encode('ascii'))
+        return guid.decode('utf8')
+    except (TypeError, ValueError):
+        raise HTTPBadRequest('Invalid cursor {}'.format(cursor))
+
+
 def list_by_context(request, model_cls, context):
     """List records by a given context
 
@@ -84,25 +164,171 @@ def list_by_context(request, model_cls, context):
         kwargs['external_id'] = request.params['external_id']
     if 'processor_uri' in request.params:
         kwargs['processor_uri'] = request.params['processor_uri']
-    items = model.list_by_context(
-        context=context,
-        offset=offset,
-        limit=limit,
-        **kwargs
-    )
+    # cursors for keyset pagination
+    after = request.params.get('after')
+    before = request.params.get('before')
+    if after is not None and before is not None:
+        raise HTTPBadRequest('You can only set either after or before')
+    if after is not None:
+        kwargs['after'] = decode_cursor(after)
+    if before is not None:
+        kwargs['before'] = decode_cursor(before)
+    try:
+        items = list(model.list_by_context(
+            context=context,
+            offset=offset,
+            limit=limit,
+            **kwargs
+        ))
+    except InvalidCursorError:
+        raise HTTPBadRequest('Invalid cursor {}'.format(after or before))
+    # records before the cursor come in reversed order
+    if before is not None:
+        items.reverse()
+    # load related records of the page in batch for rendering
+    request.render_prefetch = RenderPrefetch.load(model.session, items)
     result = dict(
-        items=list(items),
+        items=items,
         offset=offset,
         limit=limit,
+        previous_cursor=encode_cursor(items[0].guid) if items else None,
+        next_cursor=encode_cursor(items[-1].guid) if items else None,
     )
     return result
 
 
+#: content types of export formats
+EXPORT_CONTENT_TYPES = dict(
+    json=b'application/x-ndjson',
+    csv=b'text/csv',
+)
+
+
+def export_by_context(request, model_cls, context, fields):
+    """Export records of given context created in the range of
+    `created_after` and `created_before` parameters as newline-delimited
+    JSON or CSV (by the `format` parameter). Records are streamed from a
+    server-side cursor in the response body chunk by chunk, so that memory
+    usage stays constant no matter how many records are exported
+
+    :param fields: fields of records as the columns in CSV format
+    """
+    form = validate_form(ExportForm, request)
+    model = model_cls(request.model_factory)
+    settings = request.registry.settings
+    chunk_size = int(settings.get('api.export.chunk_size', 1000))
+
+    query = model.list_for_export(
+        context,
+        created_after=form.data['created_after'],
+        created_before=form.data['created_before'],
+    )
+
+    export_format = form.data['format'] or 'json'
+    renderer = request.registry.getUtility(IRendererFactory, name='json')
+    # one record per line, the output should never be prettified
+    serializer = get_serializer(dict(settings, **{
+        'api.json.pretty_print': False,
+    }))
+
+    def to_csv_value(value):
+        if value is None:
+            return b''
+        if isinstance(value, (list, dict)):
+            value = serializer(value)
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        return value.encode('utf8')
+
+    def format_chunk(records):
+        if export_format == 'csv':
+            output = StringIO.StringIO()
+            writer = csv.writer(output)
+            for record in records:
+                writer.writerow([
+                    to_csv_value(record.get(field)) for field in fields
+                ])
+            return output.getvalue()
+        lines = [serializer(record) + '\n' for record in records]
+        return ''.join(lines).encode('utf8')
+
+    def app_iter():
+        if export_format == 'csv':
+            yield format_chunk([dict((field, field) for field in fields)])
+        # the transaction of request is already finished when the response
+        # body is iterated, so we query with our own session
+        session = sessionmaker(bind=request.session.bind)()
+        try:
+            records = (
+                query
+                .with_session(session)
+                .execution_options(stream_results=True)
+                .yield_per(chunk_size)
+            )
+            records = iter(records)
+            while True:
+                chunk = list(itertools.islice(records, chunk_size))
+                if not chunk:
+                    break
+                request.render_prefetch = RenderPrefetch.load(session, chunk)
+                yield format_chunk([
+                    renderer.to_plain(record, request) for record in chunk
+                ])
+                session.expunge_all()
+        finally:
+            request.render_prefetch = None
+            session.close()
+
+    response = request.response
+    response.content_type = EXPORT_CONTENT_TYPES[export_format]
+    response.charset = b'utf-8'
+    response.app_iter = app_iter()
+    return response
+
+
+def submit_transactions(request, transactions):
+    """Submit given staged transactions to the processor right away, or if
+    `billy.transaction.async` is enabled, put them into the job queue for
+    the background worker and set the response status to 202 Accepted, so
+    that the request won't be blocked by calls to the processor
+
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return
+    settings = request.registry.settings
+    tx_model = request.model_factory.create_transaction_model()
+    if asbool(settings.get('billy.transaction.async', False)):
+        with db_transaction.manager:
+            tx_model.enqueue(transactions)
+        request.response.status_int = 202
+        return
+    # commit the attempts before calling the processor, so that it won't
+    # have to check whether the transactions exist there already
+    with db_transaction.manager:
+        attempts = tx_model.mark_submit_attempts(
+            transaction.guid for transaction in transactions
+        )
+    with db_transaction.manager:
+        tx_model.process_transactions(transactions, attempts=attempts)
+
+
 def get_processor_factory(settings):
-    """Get processor factory from settings and return
+    """Get processor factory from settings and return, if the timeout
+    (`billy.processor.timeout`) or the circuit breaker is configured, they
+    will be passed to the factory as `timeout` and `circuit_breaker`
+    arguments
 
     """
     resolver = DottedNameResolver()
     processor_factory = settings['billy.processor_factory']
     processor_factory = resolver.maybe_resolve(processor_factory)
+    options = {}
+    timeout = settings.get('billy.processor.timeout')
+    if timeout:
+        options['timeout'] = float(timeout)
+    if settings.get('processor_breaker') is not None:
+        options['circuit_breaker'] = settings['processor_breaker']
+    if options:
+        processor_factory = functools.partial(processor_factory, **options)
     return processor_factory
@@ -0,0 +1,93 @@
+from __future__ import unicode_literals
+import os
+import logging
+
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.engine.url import make_url
+from pyramid.settings import asbool
+
+
+#: options of the pool which can be set by `billy.db.<option>` settings
+POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle']
+
+#: options only available for pools with a fixed size (QueuePool)
+SIZING_OPTIONS = ['pool_size', 'max_overflow', 'pool_timeout']
+
+
+def get_pool_options(settings, url=None):
+    """Get keyword arguments for creating the engine from `billy.db.*`
+    settings, sizing options are ignored for SQLite, as it uses pools
+    without sizing
+
+    :param url: the database URL, default to `sqlalchemy.url`
+    """
+    url = make_url(url or settings['sqlalchemy.url'])
+    options = {}
+    for key in POOL_OPTIONS:
+        value = settings.get('billy.db.' + key)
+        if value is None:
+            continue
+        if key in SIZING_OPTIONS and url.drivername.startswith('sqlite'):
+            continue
+        options[key] = int(value)
+    return options
+
+
+def setup_pool_events(engine, pre_ping=False, logger=None):
+    """Make connections in the pool of given engine fork-safe, connections
+    created by another process (inherited via fork) will be discarded and
+    replaced instead of sharing the socket with the parent. And if pre_ping
+    is True, connections will be pinged before checked out, stale ones will
+    be replaced by new ones
+
+    """
+    logger = logger or logging.getLogger(__name__)
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info.get('pid') != pid:
+            # we should not touch the connection of parent process, just
+            # leave it alone and ask the pool for a new one
+            connection_record.connection = None
+            connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                'Connection record belongs to pid {}, attempting to check '
+                'out in pid {}'.format(connection_record.info.get('pid'), pid)
+            )
+        if not pre_ping:
+            return
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception, e:
+            logger.warn('Stale database connection detected: %s', e)
+            raise exc.DisconnectionError(str(e))
+
+
+def get_pool_status(settings, engine=None):
+    """Get configuration and current status of the connection pool
+
+    :param engine: the engine, default to `engine` in settings
+    """
+    engine = engine or settings['engine']
+    pool = engine.pool
+    status = dict(
+        pool_class=type(pool).__name__,
+        pre_ping=asbool(settings.get('billy.db.pre_ping', False)),
+    )
+    status.update(get_pool_options(settings, url=engine.url))
+    # only QueuePool provides these numbers
+    for name in ['checkedin', 'checkedout', 'overflow']:
+        method = getattr(pool, name, None)
+        if method is not None:
+            status[name] = method()
+    return status
@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 
 from sqlalchemy import Column
+from sqlalchemy import Integer
 from sqlalchemy import Unicode
+from sqlalchemy import UnicodeText
 from sqlalchemy import Boolean
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from .base import DeclarativeBase
@@ -39,6 +43,49 @@ class Company(DeclarativeBase):
     customers = relationship('Customer', cascade='all, delete-orphan',
                              backref='company')
 
+
+class Callback(DeclarativeBase):
+    """A callback received from payment processing system, it is stored in
+    the inbox first and then verified and applied by the background worker
+
+    """
+    __tablename__ = 'callback'
+    # ensure one event will only be queued once for a company
+    __table_args__ = (UniqueConstraint('company_guid', 'processor_id'), )
+
+    guid = Column(Unicode(64), primary_key=True)
+    #: the guid of company which received this callback
+    company_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'company.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        nullable=False,
+    )
+    #: the id of event record in payment processing system
+    processor_id = Column(Unicode(128), nullable=False)
+    #: the callback payload in JSON
+    payload = Column(UnicodeText, nullable=False)
+    #: error message if the callback failed to be verified or applied
+    error_message = Column(UnicodeText)
+    #: the id of worker which is processing this callback
+    locked_by = Column(Unicode(64))
+    #: the datetime this callback was claimed by a worker, it can be claimed
+    #  again by others if the worker didn't finish it in time
+    locked_at = Column(UTCDateTime, index=True)
+    #: count of failed attempts to process this callback
+    attempts = Column(Integer, nullable=False, default=0)
+    #: the datetime this callback was processed, None means it is still
+    #  waiting in the inbox
+    processed_at = Column(UTCDateTime, index=True)
+    #: the created datetime of this callback
+    created_at = Column(UTCDateTime, default=now_func, index=True)
+
+    #: the company which received this callback
+    company = relationship('Company')
+
 __all__ = [
     Company.__name__,
+    Callback.__name__,
 ]
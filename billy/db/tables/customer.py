@@ -4,6 +4,7 @@ from sqlalchemy import Column
 from sqlalchemy import Unicode
 from sqlalchemy import Boolean
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.orm import relationship
 
 from .base import DeclarativeBase
@@ -43,6 +44,42 @@ class Customer(DeclarativeBase):
     #: invoices of this customer
     invoices = relationship('CustomerInvoice', cascade='all, delete-orphan',
                             backref='customer')
+    #: funding instruments attached to this customer in processor
+    attached_funding_instruments = relationship(
+        'AttachedFundingInstrument',
+        cascade='all, delete-orphan',
+        backref='customer',
+    )
+
+
+class AttachedFundingInstrument(DeclarativeBase):
+    """A record indicates the funding instrument was attached to the
+    customer in payment processing system, so that we don't need to prepare
+    the customer again before charging or paying out to it
+
+    """
+    __tablename__ = 'attached_funding_instrument'
+    __table_args__ = (
+        Index('ix_attached_funding_instrument_customer_guid_uri',
+              'customer_guid', 'funding_instrument_uri'),
+    )
+
+    guid = Column(Unicode(64), primary_key=True)
+    #: the guid of customer which the funding instrument was attached to
+    customer_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'customer.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        nullable=False,
+    )
+    #: the URI of attached funding instrument
+    funding_instrument_uri = Column(Unicode(128), nullable=False)
+    #: the created datetime of this record
+    created_at = Column(UTCDateTime, default=now_func)
+
 __all__ = [
     Customer.__name__,
+    AttachedFundingInstrument.__name__,
 ]
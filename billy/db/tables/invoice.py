@@ -4,9 +4,9 @@ from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import Unicode
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.orm import relationship
-from sqlalchemy.orm import object_session
 
 from .base import DeclarativeBase
 from .base import UTCDateTime
@@ -40,11 +40,27 @@ class Invoice(DeclarativeBase):
 
     """
     __tablename__ = 'invoice'
+    __table_args__ = (
+        # for listing invoices of a company in created order
+        Index('ix_invoice_company_guid_created_at', 'company_guid',
+              'created_at'),
+    )
     __mapper_args__ = {
         'polymorphic_on': 'invoice_type',
     }
 
     guid = Column(Unicode(64), primary_key=True)
+    #: the guid of company which owns this invoice, it's the company of
+    #  customer or plan of subscription, denormalized for listing invoices
+    #  of a company without joining
+    company_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'company.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        nullable=False,
+    )
     # type of invoice, could be 0=subscription, 1=customer
     invoice_type = Column(InvoiceType.db_type(), index=True, nullable=False)
     #: what kind of transaction it is, could be DEBIT or CREDIT
@@ -55,6 +71,10 @@ class Invoice(DeclarativeBase):
     funding_instrument_uri = Column(Unicode(128), index=True)
     #: the total amount of this invoice
     amount = Column(Integer, nullable=False)
+    #: sum of total adjustment amount of this invoice
+    total_adjustment_amount = Column(Integer, nullable=False, default=0)
+    #: effective amount of this invoice (amount + total_adjustment_amount)
+    effective_amount = Column(Integer, nullable=False)
     #: current status of this invoice, could be
     #   - STAGED
     #   - PROCESSING
@@ -96,26 +116,6 @@ class Invoice(DeclarativeBase):
         order_by='Adjustment.adjustment_id',
     )
 
-    @property
-    def total_adjustment_amount(self):
-        """Sum of total adjustment amount
-
-        """
-        from sqlalchemy import func
-        session = object_session(self)
-        return (
-            session.query(func.coalesce(func.sum(Adjustment.amount), 0))
-            .filter(Adjustment.invoice_guid == self.guid)
-            .scalar()
-        )
-
-    @property
-    def effective_amount(self):
-        """Effective amount of this invoice (amount + total_adjustment_amount)
-
-        """
-        return self.total_adjustment_amount + self.amount
-
 
 class SubscriptionInvoice(Invoice):
     """An invoice generated from subscription (recurring charge or payout)
@@ -53,6 +53,8 @@ class Subscription(DeclarativeBase):
     canceled = Column(Boolean, default=False, nullable=False)
     #: the next datetime to charge or pay out
     next_invoice_at = Column(UTCDateTime, nullable=False)
+    #: how many periods (invoices) have been yielded from this subscription
+    period = Column(Integer, nullable=False, default=0)
     #: the started datetime of this subscription
     started_at = Column(UTCDateTime, nullable=False)
     #: the canceled datetime of this subscription
@@ -86,7 +88,7 @@ class Subscription(DeclarativeBase):
         """How many invoice has been generated
 
         """
-        return self.invoices.count()
+        return self.period
 
 __all__ = [
     Subscription.__name__,
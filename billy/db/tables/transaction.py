@@ -5,6 +5,7 @@ from sqlalchemy import Integer
 from sqlalchemy import Unicode
 from sqlalchemy import UnicodeText
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
@@ -45,8 +46,27 @@ class Transaction(DeclarativeBase):
 
     """
     __tablename__ = 'transaction'
+    __table_args__ = (
+        # for listing transactions of a company in created order
+        Index('ix_transaction_company_guid_created_at', 'company_guid',
+              'created_at'),
+        # for listing transactions due to be submitted
+        Index('ix_transaction_submit_status_next_attempt_at',
+              'submit_status', 'next_attempt_at'),
+    )
 
     guid = Column(Unicode(64), primary_key=True)
+    #: the guid of company which owns this transaction, the same as the
+    #  invoice, denormalized for listing transactions of a company without
+    #  joining
+    company_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'company.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        nullable=False,
+    )
     #: the guid of invoice which owns this transaction
     invoice_guid = Column(
         Unicode(64),
@@ -82,6 +102,21 @@ class Transaction(DeclarativeBase):
     amount = Column(Integer, nullable=False)
     #: the funding instrument URI
     funding_instrument_uri = Column(Unicode(128), index=True)
+    #: number of times this transaction was submitted to the processor, it
+    #  is recorded before calling the processor, so that we know a
+    #  transaction never submitted before cannot exist in the processor
+    submit_attempts = Column(Integer, nullable=False, default=0)
+    #: count of failures, the same as number of failure records, stored so
+    #  that we don't need to count them for every attempt
+    failure_count = Column(Integer, nullable=False, default=0)
+    #: the datetime this transaction is due to be submitted, it is the
+    #  created time at first, and pushed back after failures
+    next_attempt_at = Column(UTCDateTime)
+    #: occurred datetime of the latest event of this transaction, only
+    #  events occurred after it can update the status
+    last_event_at = Column(UTCDateTime)
+    #: the id of the latest event in payment processing system
+    last_event_id = Column(Unicode(128))
     #: the created datetime of this transaction
     created_at = Column(UTCDateTime, default=now_func)
     #: the updated datetime of this transaction
@@ -116,13 +151,6 @@ class Transaction(DeclarativeBase):
         lazy='dynamic',  # so that we can query count on it
     )
 
-    @property
-    def failure_count(self):
-        """Count of failures
-
-        """
-        return self.failures.count()
-
     @property
     def company(self):
         """Owner company of this transaction
@@ -199,6 +227,36 @@ class TransactionFailure(DeclarativeBase):
     #: the created datetime of this failure
     created_at = Column(UTCDateTime, default=now_func)
 
+
+class TransactionJob(DeclarativeBase):
+    """A job in the queue of transactions to be submitted by the background
+    worker, it is removed once the transaction is processed
+
+    """
+    __tablename__ = 'transaction_job'
+
+    #: the guid of transaction to process
+    transaction_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'transaction.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        primary_key=True,
+    )
+    #: the id of worker which is processing this job
+    locked_by = Column(Unicode(64))
+    #: the datetime this job was claimed by a worker, the job can be claimed
+    #  again by others if the worker didn't finish it in time
+    locked_at = Column(UTCDateTime, index=True)
+    #: count of failed attempts to process this job, it won't be claimed
+    #  anymore once it reaches the maximum attempts
+    attempts = Column(Integer, nullable=False, default=0)
+    #: error message of the last failed attempt
+    error_message = Column(UnicodeText)
+    #: the created datetime of this job
+    created_at = Column(UTCDateTime, default=now_func, index=True)
+
 __all__ = [
     TransactionType.__name__,
     TransactionSubmitStatus.__name__,
@@ -206,4 +264,5 @@ __all__ = [
     Transaction.__name__,
     TransactionEvent.__name__,
     TransactionFailure.__name__,
+    TransactionJob.__name__,
 ]
@@ -8,3 +8,20 @@ class BillyError(RuntimeError):
     def __init__(self, msg):
         super(BillyError, self).__init__(msg)
         self.msg = msg
+
+
+class BillyBulkError(BillyError):
+    """Billy error of bulk operations, `errors` is a list of dict with the
+    index of invalid item and the error message
+
+    """
+    def __init__(self, msg, errors):
+        super(BillyBulkError, self).__init__(msg)
+        self.errors = errors
+
+
+class ProcessorUnavailableError(BillyError):
+    """This error indicates the payment processor is considered unavailable
+    (the circuit breaker is open), the call was not made
+
+    """
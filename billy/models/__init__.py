@@ -5,8 +5,14 @@ from sqlalchemy import engine_from_config
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from zope.sqlalchemy import ZopeTransactionExtension
+from pyramid.settings import asbool
   
 from billy.db import tables
+from billy.db.pool import get_pool_options
+from billy.db.pool import setup_pool_events
+from billy.utils.cache import TTLCache
+from billy.utils.circuit_breaker import CircuitBreaker
+from billy.utils.generic import set_guid_mode
 
 
 def setup_database(global_config, **settings):
@@ -15,7 +21,15 @@ def setup_database(global_config, **settings):
     """
     if 'engine' not in settings:
         settings['engine'] = (
-            engine_from_config(settings, 'sqlalchemy.')
+            engine_from_config(
+                settings,
+                'sqlalchemy.',
+                **get_pool_options(settings)
+            )
+        )
+        setup_pool_events(
+            settings['engine'],
+            pre_ping=asbool(settings.get('billy.db.pre_ping', False)),
         )
  
     if 'session' not in settings:
@@ -24,5 +38,57 @@ def setup_database(global_config, **settings):
             bind=settings['engine'],
         ))
 
+    # optional read replica, read-only requests will be routed to it
+    if 'replica_engine' not in settings:
+        settings['replica_engine'] = None
+        replica_url = settings.get('billy.db.replica.url')
+        if replica_url:
+            settings['replica_engine'] = engine_from_config(
+                settings,
+                'billy.db.replica.',
+                **get_pool_options(settings, url=replica_url)
+            )
+            setup_pool_events(
+                settings['replica_engine'],
+                pre_ping=asbool(settings.get('billy.db.pre_ping', False)),
+            )
+
+    if 'replica_session' not in settings:
+        settings['replica_session'] = None
+        if settings['replica_engine'] is not None:
+            settings['replica_session'] = scoped_session(sessionmaker(
+                extension=ZopeTransactionExtension(keep_session=True),
+                bind=settings['replica_engine'],
+            ))
+
+    # process-wide cache of API key to company guid, for authenticating API
+    # calls without querying database every time
+    if 'api_key_cache' not in settings:
+        ttl = int(settings.get('billy.company.api_key_cache_ttl', 60))
+        size = int(settings.get('billy.company.api_key_cache_size', 10000))
+        settings['api_key_cache'] = None
+        if ttl > 0 and size > 0:
+            settings['api_key_cache'] = TTLCache(ttl=ttl, max_size=size)
+
+    # process-wide circuit breaker of the processor, calls to it fail fast
+    # once it keeps failing
+    if 'processor_breaker' not in settings:
+        threshold = int(settings.get(
+            'billy.processor.breaker.failure_threshold', 0
+        ))
+        reset_timeout = float(settings.get(
+            'billy.processor.breaker.reset_timeout', 30
+        ))
+        settings['processor_breaker'] = None
+        if threshold > 0:
+            settings['processor_breaker'] = CircuitBreaker(
+                failure_threshold=threshold,
+                reset_timeout=reset_timeout,
+            )
+
+    # time-ordered GUIDs make new records inserted at the right-hand edge
+    # of primary key indexes
+    set_guid_mode(settings.get('billy.guid.mode', 'uuid1'))
+
     tables.set_now_func(datetime.datetime.utcnow)
     return settings
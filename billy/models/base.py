@@ -2,6 +2,18 @@ from __future__ import unicode_literals
 import logging
 from functools import wraps
 
+from sqlalchemy.sql.expression import and_
+from sqlalchemy.sql.expression import or_
+
+from billy.errors import BillyError
+
+
+class InvalidCursorError(BillyError):
+    """This error indicates the record to paginate from doesn't exist in the
+    records to paginate
+
+    """
+
 
 def decorate_offset_limit(func):
     """Make a querying function accept extra optional offset and limit
@@ -27,6 +39,60 @@ def decorate_offset_limit(func):
     return callee
 
 
+def paginate_by_keys(query, keys, after=None, before=None):
+    """Order query by given keys in descending order, and only return
+    records after or before the record of given guid in that order (keyset
+    pagination), so that a deep page costs the same as the first page
+
+    The last key should be the guid column, as a unique tie-breaker. Records
+    before the given one are returned in ascending order (the nearest one
+    first), so that a limit can be applied, callers should reverse them
+
+    :param query: the query to paginate
+    :param keys: columns to order by
+    :param after: guid of the record to return records after
+    :param before: guid of the record to return records before
+    """
+    if after is not None and before is not None:
+        raise ValueError('You can only set either after or before')
+    guid = after if after is not None else before
+    if guid is None:
+        return query.order_by(*[key.desc() for key in keys])
+
+    # look up keys of the record by primary key, in the same query, so that
+    # we won't paginate from a record of other company
+    values = query.with_entities(*keys).filter(keys[-1] == guid).first()
+    if values is None:
+        raise InvalidCursorError(
+            'No such record {} to paginate from'.format(guid)
+        )
+    conditions = []
+    for i, key in enumerate(keys):
+        condition = key < values[i] if after is not None else key > values[i]
+        conditions.append(and_(*(
+            [prev_key == value for prev_key, value in zip(keys, values[:i])] +
+            [condition]
+        )))
+    query = query.filter(or_(*conditions))
+    if after is not None:
+        return query.order_by(*[key.desc() for key in keys])
+    return query.order_by(*[key.asc() for key in keys])
+
+
+def query_in_batches(query, column, values, batch_size=500):
+    """Query records with `column IN values`, values are split into batches,
+    so that we won't exceed the limit of bound parameters in one statement
+    (SQLite allows 999 at most)
+
+    """
+    values = list(values)
+    results = []
+    for begin in range(0, len(values), batch_size):
+        batch = values[begin:begin + batch_size]
+        results.extend(query.filter(column.in_(batch)).all())
+    return results
+
+
 class BaseTableModel(object):
 
     #: the table for this model
@@ -54,3 +120,24 @@ class BaseTableModel(object):
                 self.TABLE.__name__.lower(), guid
             ))
         return query
+
+    def get_many(self, guids):
+        """Find records by guids and return them in a list, guids which
+        cannot be found are ignored
+
+        """
+        return query_in_batches(
+            self.session.query(self.TABLE),
+            self.TABLE.guid,
+            set(guids),
+        )
+
+    def expunge(self, records):
+        """Remove given records from the session, so that they can be garbage
+        collected once we are done with them, records which are already
+        removed (by cascading) will be ignored
+
+        """
+        for record in records:
+            if record in self.session:
+                self.session.expunge(record)
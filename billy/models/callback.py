@@ -0,0 +1,158 @@
+from __future__ import unicode_literals
+import json
+import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import or_
+
+from billy.db import tables
+from billy.models.base import BaseTableModel
+from billy.errors import BillyError
+from billy.utils.generic import make_guid
+
+
+class InvalidCallbackError(BillyError):
+    """The callback payload cannot be queued
+
+    """
+
+
+class DuplicateCallbackError(BillyError):
+    """The callback was queued already
+
+    """
+
+
+class CallbackModel(BaseTableModel):
+
+    TABLE = tables.Callback
+
+    def create(self, company, payload):
+        """Put a callback payload received by given company into the inbox
+        and return it, DuplicateCallbackError will be raised if the event
+        was queued before. Nothing is verified against the processor here,
+        it will be done by the worker later
+
+        """
+        processor_id = payload.get('id') if isinstance(payload, dict) else None
+        if not isinstance(processor_id, basestring) or not processor_id:
+            raise InvalidCallbackError('Callback payload without event id')
+
+        Callback = tables.Callback
+        query = (
+            self.session.query(Callback.guid)
+            .filter(Callback.company_guid == company.guid)
+            .filter(Callback.processor_id == processor_id)
+        )
+        if query.first() is not None:
+            raise DuplicateCallbackError(
+                'Callback for event {} already exists'.format(processor_id)
+            )
+
+        callback = Callback(
+            guid='CB' + make_guid(),
+            company=company,
+            processor_id=processor_id,
+            payload=json.dumps(payload),
+            created_at=tables.now_func(),
+        )
+        self.session.add(callback)
+        # the same event might be queued by another request at the same time
+        try:
+            self.session.flush()
+        except IntegrityError:
+            raise DuplicateCallbackError(
+                'Callback for event {} already exists'.format(processor_id)
+            )
+        return callback
+
+    def claim(self, worker_id, limit, lease_seconds):
+        """Claim at most `limit` callbacks in the inbox for given worker in
+        created order and return their guids. Callbacks claimed by other
+        workers are skipped, unless they were claimed more than
+        `lease_seconds` ago (the worker might be dead)
+
+        """
+        Callback = tables.Callback
+        now = tables.now_func()
+        expired_at = now - datetime.timedelta(seconds=lease_seconds)
+        claimable = or_(
+            Callback.locked_at.is_(None),
+            Callback.locked_at < expired_at,
+        )
+        guids = [
+            guid for guid, in (
+                self.session.query(Callback.guid)
+                .filter(Callback.processed_at.is_(None))
+                .filter(claimable)
+                .order_by(Callback.created_at, Callback.guid)
+                .limit(limit)
+            )
+        ]
+        claimed = []
+        for guid in guids:
+            # only one of the workers racing for the same callback can
+            # update it
+            count = (
+                self.session.query(Callback)
+                .filter(Callback.guid == guid)
+                .filter(Callback.processed_at.is_(None))
+                .filter(claimable)
+                .update(
+                    dict(locked_by=worker_id, locked_at=now),
+                    synchronize_session=False,
+                )
+            )
+            if count:
+                claimed.append(guid)
+        return claimed
+
+    def process(self, guid):
+        """Verify the callback of given guid against the processor and apply
+        it, then mark it as processed
+
+        """
+        callback = self.get(guid, raise_error=True)
+        company = callback.company
+        processor = self.factory.create_processor()
+        processor.configure_api_key(company.processor_key)
+        update_db = processor.callback(company, json.loads(callback.payload))
+        if update_db is not None:
+            update_db(self.factory)
+        # clear the error of previous failed attempts
+        callback.error_message = None
+        callback.processed_at = tables.now_func()
+        self.session.flush()
+
+    def fail_attempt(self, guid, error_message):
+        """Record a failed attempt to process the callback of given guid,
+        return the number of failed attempts so far
+
+        """
+        Callback = tables.Callback
+        (
+            self.session.query(Callback)
+            .filter(Callback.guid == guid)
+            .update(
+                dict(
+                    attempts=Callback.attempts + 1,
+                    error_message=error_message,
+                ),
+                synchronize_session=False,
+            )
+        )
+        return (
+            self.session.query(Callback.attempts)
+            .filter(Callback.guid == guid)
+            .scalar()
+        )
+
+    def fail(self, guid, error_message):
+        """Mark the callback of given guid as processed with an error, so
+        that it won't be processed again
+
+        """
+        callback = self.get(guid, raise_error=True)
+        callback.error_message = error_message
+        callback.processed_at = tables.now_func()
+        self.session.flush()
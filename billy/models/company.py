@@ -1,4 +1,7 @@
 from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import transaction as db_transaction
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
@@ -24,6 +27,28 @@ class CompanyModel(BaseTableModel):
             raise KeyError('No such company with API key {}'.format(api_key))
         return query
 
+    @property
+    def api_key_cache(self):
+        return self.factory.settings.get('api_key_cache')
+
+    def get_guid_by_api_key(self, api_key):
+        """Get guid of company by its API key, None will be returned if there
+        is no such company. The result is cached in process (if the cache is
+        enabled), so that we don't need to query for every API call
+
+        """
+        cache = self.api_key_cache
+        if cache is not None:
+            guid = cache.get(api_key)
+            if guid is not None:
+                return guid
+        company = self.get_by_api_key(api_key)
+        if company is None:
+            return None
+        if cache is not None:
+            cache.set(api_key, company.guid)
+        return company.guid
+
     def get_by_callback_key(self, callback_key):
         query = (
             self.session.query(tables.Company)
@@ -62,6 +87,7 @@ class CompanyModel(BaseTableModel):
         """
         now = tables.now_func()
         company.updated_at = now
+        old_api_key = company.api_key
         for key in ['name', 'processor_key', 'api_key']:
             if key not in kwargs:
                 continue
@@ -70,6 +96,8 @@ class CompanyModel(BaseTableModel):
         if kwargs:
             raise TypeError('Unknown attributes {} to update'.format(tuple(kwargs.keys())))
         self.session.flush()
+        self._invalidate_api_key(old_api_key)
+        self._invalidate_api_key(company.api_key)
 
     def delete(self, company):
         """Delete a company
@@ -77,3 +105,18 @@ class CompanyModel(BaseTableModel):
         """
         company.deleted = True
         self.session.flush()
+        self._invalidate_api_key(company.api_key)
+
+    def _invalidate_api_key(self, api_key):
+        """Remove given API key from the cache after current transaction is
+        committed, otherwise, the old company might be cached again by other
+        requests before the change is committed
+
+        """
+        cache = self.api_key_cache
+        if cache is None:
+            return
+
+        def invalidate(success):
+            cache.delete(api_key)
+        db_transaction.get().addAfterCommitHook(invalidate)
@@ -3,7 +3,18 @@ from __future__ import unicode_literals
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import paginate_by_keys
+from billy.errors import BillyError
+from billy.errors import BillyBulkError
 from billy.utils.generic import make_guid
+from billy.utils.generic import map_concurrently
+
+
+class CustomerBulkCreateError(BillyBulkError):
+    """This error indicates some of the customers to create in bulk are
+    invalid, none of the customers will be created
+
+    """
 
 
 class CustomerModel(BaseTableModel):
@@ -14,7 +25,13 @@ class CustomerModel(BaseTableModel):
     NOT_SET = object()
 
     @decorate_offset_limit
-    def list_by_context(self, context, processor_uri=NOT_SET):
+    def list_by_context(
+        self,
+        context,
+        processor_uri=NOT_SET,
+        after=None,
+        before=None,
+    ):
         """List customer by a given context
 
         """
@@ -40,8 +57,12 @@ class CustomerModel(BaseTableModel):
 
         if processor_uri is not self.NOT_SET:
             query = query.filter(Customer.processor_uri == processor_uri)
-        query = query.order_by(Customer.created_at.desc())
-        return query
+        return paginate_by_keys(
+            query,
+            keys=[Customer.created_at, Customer.guid],
+            after=after,
+            before=before,
+        )
 
     def create(
         self,
@@ -74,6 +95,80 @@ class CustomerModel(BaseTableModel):
         self.session.flush()
         return customer
 
+    def validate_many(self, company, processor_uris, concurrency=1):
+        """Validate given processor URIs of customers (None is ignored) in
+        `concurrency` threads and return a list of errors, each one is a
+        dict with the index of invalid URI and the error message
+
+        """
+        get_processor = self.factory.create_processor_getter(
+            company.processor_key,
+        )
+
+        def validate(index):
+            try:
+                get_processor().validate_customer(processor_uris[index])
+            except BillyError, e:
+                return dict(index=index, error_message=e.msg)
+
+        errors = map_concurrently(
+            validate,
+            [
+                index for index, processor_uri in enumerate(processor_uris)
+                if processor_uri is not None
+            ],
+            concurrency,
+        )
+        return [error for error in errors if error is not None]
+
+    def create_many(self, company, processor_uris, concurrency=1):
+        """Create customers of a company in bulk and return them. Given
+        processor URIs are validated first, then customers without processor
+        URI (None) are created in processor, calls to the processor are made
+        in `concurrency` threads. All customers are inserted with one flush
+
+        :param processor_uris: a list of processor URI of customers to create
+        :param concurrency: number of threads for calling the processor
+        """
+        errors = self.validate_many(company, processor_uris, concurrency)
+        if errors:
+            raise CustomerBulkCreateError(
+                '{} of {} customers are invalid'.format(
+                    len(errors), len(processor_uris),
+                ),
+                errors=errors,
+            )
+
+        now = tables.now_func()
+        customers = [
+            tables.Customer(
+                guid='CU' + make_guid(),
+                company_guid=company.guid,
+                processor_uri=processor_uri,
+                created_at=now,
+                updated_at=now,
+            )
+            for processor_uri in processor_uris
+        ]
+        get_processor = self.factory.create_processor_getter(
+            company.processor_key,
+        )
+
+        def create(customer):
+            customer.processor_uri = get_processor().create_customer(customer)
+
+        map_concurrently(
+            create,
+            [
+                customer for customer in customers
+                if customer.processor_uri is None
+            ],
+            concurrency,
+        )
+        self.session.add_all(customers)
+        self.session.flush()
+        return customers
+
     def update(self, customer, **kwargs):
         """Update a customer
 
@@ -95,3 +190,42 @@ class CustomerModel(BaseTableModel):
         """
         customer.deleted = True
         self.session.flush()
+
+    def is_funding_instrument_attached(self, customer, funding_instrument_uri):
+        """Return whether given funding instrument was attached to the
+        customer in processor
+
+        """
+        return any(
+            record.funding_instrument_uri == funding_instrument_uri
+            for record in customer.attached_funding_instruments
+        )
+
+    def mark_funding_instrument_attached(
+        self,
+        customer,
+        funding_instrument_uri,
+    ):
+        """Record that given funding instrument was attached to the customer
+        in processor
+
+        """
+        customer.attached_funding_instruments.append(
+            tables.AttachedFundingInstrument(
+                guid='AF' + make_guid(),
+                funding_instrument_uri=funding_instrument_uri,
+                created_at=tables.now_func(),
+            )
+        )
+        self.session.flush()
+
+    def forget_funding_instrument(self, customer, funding_instrument_uri):
+        """Forget that given funding instrument was attached to the customer,
+        so that it will be attached again next time (it might be removed from
+        the customer in processor)
+
+        """
+        for record in list(customer.attached_funding_instruments):
+            if record.funding_instrument_uri == funding_instrument_uri:
+                customer.attached_funding_instruments.remove(record)
+        self.session.flush()
@@ -5,9 +5,12 @@ from sqlalchemy.sql.expression import func
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import paginate_by_keys
+from billy.models.base import query_in_batches
 from billy.models.plan import PlanModel
 from billy.models.transaction import TransactionModel
 from billy.errors import BillyError
+from billy.errors import BillyBulkError
 from billy.utils.generic import make_guid
 
 
@@ -26,6 +29,13 @@ class DuplicateExternalIDError(BillyError):
     """
 
 
+class InvoiceBulkCreateError(BillyBulkError):
+    """This error indicates some of the invoices to create in bulk are
+    invalid, none of the invoices will be created
+
+    """
+
+
 class InvoiceModel(BaseTableModel):
 
     TABLE = tables.Invoice
@@ -42,8 +52,26 @@ class InvoiceModel(BaseTableModel):
     # statuses of invoice
     statuses = tables.InvoiceStatus
 
+    def get_many(self, guids):
+        """Find invoices by guids and return them in a list, columns of
+        their sub-types are loaded together
+
+        """
+        Invoice = tables.Invoice
+        return query_in_batches(
+            self.session.query(Invoice).with_polymorphic('*'),
+            Invoice.guid,
+            set(guids),
+        )
+
     @decorate_offset_limit
-    def list_by_context(self, context, external_id=NOT_SET):
+    def list_by_context(
+        self,
+        context,
+        external_id=NOT_SET,
+        after=None,
+        before=None,
+    ):
         """Get invoices of a given context
 
         """
@@ -59,14 +87,6 @@ class InvoiceModel(BaseTableModel):
         subscription_invoice_query = self.session.query(SubscriptionInvoice)
         # joined customer invoice query
         customer_invoice_query = self.session.query(CustomerInvoice)
-        # joined customer query
-        customer_query = (
-            customer_invoice_query
-            .join(
-                Customer,
-                Customer.guid == CustomerInvoice.customer_guid,
-            )
-        )
         # joined subscription query
         subscription_query = (
             subscription_invoice_query
@@ -75,15 +95,7 @@ class InvoiceModel(BaseTableModel):
                 Subscription.guid == SubscriptionInvoice.subscription_guid,
             )
         )
-        # joined plan query
-        plan_query = (
-            subscription_query
-            .join(
-                Plan,
-                Plan.guid == Subscription.plan_guid,
-            )
-        )
-
+        keys = [Invoice.created_at, Invoice.guid]
         if isinstance(context, Customer):
             query = (
                 customer_invoice_query
@@ -93,29 +105,29 @@ class InvoiceModel(BaseTableModel):
             query = (
                 subscription_invoice_query
                 .filter(SubscriptionInvoice.subscription == context)
-                .order_by(SubscriptionInvoice.scheduled_at.desc())
             )
+            keys = [
+                SubscriptionInvoice.scheduled_at,
+                SubscriptionInvoice.created_at,
+                SubscriptionInvoice.guid,
+            ]
         elif isinstance(context, Plan):
             query = (
                 subscription_query
                 .filter(Subscription.plan == context)
-                .order_by(SubscriptionInvoice.scheduled_at.desc())
             )
+            keys = [
+                SubscriptionInvoice.scheduled_at,
+                SubscriptionInvoice.created_at,
+                SubscriptionInvoice.guid,
+            ]
         elif isinstance(context, Company):
-            q1 = (
-                plan_query
-                .filter(Plan.company == context)
-                .from_self(Invoice.guid)
-            )
-            q2 = (
-                customer_query
-                .filter(Customer.company == context)
-                .from_self(Invoice.guid)
-            )
-            guid_query = q1.union(q2)
+            # load columns of the sub-types together, so that rendering
+            # invoices in the page won't load them one by one
             query = (
                 self.session.query(Invoice)
-                .filter(Invoice.guid.in_(guid_query))
+                .with_polymorphic('*')
+                .filter(Invoice.company_guid == context.guid)
             )
         else:
             raise ValueError('Unsupported context {}'.format(context))
@@ -130,8 +142,34 @@ class InvoiceModel(BaseTableModel):
                 .filter(CustomerInvoice.external_id == external_id)
             )
 
-        query = query.order_by(Invoice.created_at.desc())
-        return query
+        return paginate_by_keys(
+            query,
+            keys=keys,
+            after=after,
+            before=before,
+        )
+
+    def list_for_export(
+        self,
+        company,
+        created_after=None,
+        created_before=None,
+    ):
+        """List invoices of given company created in range
+        [created_after, created_before) in created order for exporting
+
+        """
+        Invoice = tables.Invoice
+        query = (
+            self.session.query(Invoice)
+            .with_polymorphic('*')
+            .filter(Invoice.company_guid == company.guid)
+        )
+        if created_after is not None:
+            query = query.filter(Invoice.created_at >= created_after)
+        if created_before is not None:
+            query = query.filter(Invoice.created_at < created_before)
+        return query.order_by(Invoice.created_at, Invoice.guid)
 
     def _create_transaction(self, invoice):
         """Create a charge/payout transaction from the given invoice and return
@@ -147,7 +185,7 @@ class InvoiceModel(BaseTableModel):
         )
         return transaction
 
-    def create(
+    def build(
         self,
         amount,
         funding_instrument_uri=None,
@@ -159,12 +197,13 @@ class InvoiceModel(BaseTableModel):
         external_id=None,
         appears_on_statement_as=None,
         scheduled_at=None,
+        now=None,
     ):
-        """Create a invoice and return its id
+        """Build an invoice with its items, adjustments and the transaction to
+        submit (if there is something to charge or payout) without flushing
+        them, return the built records, the invoice comes first
 
         """
-        from sqlalchemy.exc import IntegrityError
-
         if customer is not None and subscription is not None:
             raise ValueError('You can only set either customer or subscription')
 
@@ -173,6 +212,7 @@ class InvoiceModel(BaseTableModel):
             invoice_cls = tables.CustomerInvoice
             # we only support charge type for customer invoice now
             transaction_type = self.transaction_types.DEBIT
+            company_guid = customer.company_guid
             extra_kwargs = dict(
                 customer=customer,
                 external_id=external_id,
@@ -189,6 +229,7 @@ class InvoiceModel(BaseTableModel):
                 transaction_type = self.transaction_types.CREDIT
             else:
                 raise ValueError('Invalid plan_type {}'.format(plan_type))
+            company_guid = subscription.plan.company_guid
             extra_kwargs = dict(
                 subscription=subscription,
                 scheduled_at=scheduled_at,
@@ -199,13 +240,25 @@ class InvoiceModel(BaseTableModel):
         if amount < 0:
             raise ValueError('Negative amount {} is not allowed'.format(amount))
 
-        now = tables.now_func()
+        # the adjustment totals are stored on the invoice, so that we don't
+        # need to sum them up every time we read them
+        total_adjustment_amount = 0
+        if adjustments:
+            total_adjustment_amount = sum(
+                int(adjustment['amount']) for adjustment in adjustments
+            )
+
+        if now is None:
+            now = tables.now_func()
         invoice = invoice_cls(
             guid='IV' + make_guid(),
+            company_guid=company_guid,
             invoice_type=invoice_type,
             transaction_type=transaction_type,
             status=self.statuses.STAGED,
             amount=amount,
+            total_adjustment_amount=total_adjustment_amount,
+            effective_amount=amount + total_adjustment_amount,
             funding_instrument_uri=funding_instrument_uri,
             title=title,
             created_at=now,
@@ -213,8 +266,85 @@ class InvoiceModel(BaseTableModel):
             appears_on_statement_as=appears_on_statement_as,
             **extra_kwargs
         )
+        records = [invoice]
+
+        for item in items or []:
+            records.append(tables.Item(
+                invoice=invoice,
+                name=item['name'],
+                amount=item['amount'],
+                type=item.get('type'),
+                quantity=item.get('quantity'),
+                unit=item.get('unit'),
+                volume=item.get('volume'),
+            ))
+
+        # TODO: what about an invalid adjust? say, it makes the total of invoice
+        # a negative value? I think we should not allow user to create such
+        # invalid invoice
+        for adjustment in adjustments or []:
+            records.append(tables.Adjustment(
+                invoice=invoice,
+                amount=adjustment['amount'],
+                reason=adjustment.get('reason'),
+            ))
 
-        self.session.add(invoice)
+        # as if we set the funding_instrument_uri at very first, we want to charge it
+        # immediately, so we create a transaction right away, also set the
+        # status to PROCESSING
+        if funding_instrument_uri is not None and amount > 0:
+            invoice.status = self.statuses.PROCESSING
+            tx_model = self.factory.create_transaction_model()
+            records.append(tx_model.build(
+                invoice=invoice,
+                amount=invoice.effective_amount,
+                transaction_type=transaction_type,
+                funding_instrument_uri=funding_instrument_uri,
+                appears_on_statement_as=appears_on_statement_as,
+                now=now,
+            ))
+        # it is zero amount, nothing to charge, just switch to
+        # SETTLED status
+        elif amount == 0:
+            invoice.status = self.statuses.SETTLED
+        return records
+
+    def create(
+        self,
+        amount,
+        funding_instrument_uri=None,
+        customer=None,
+        subscription=None,
+        title=None,
+        items=None,
+        adjustments=None,
+        external_id=None,
+        appears_on_statement_as=None,
+        scheduled_at=None,
+    ):
+        """Create a invoice and return its id
+
+        """
+        from sqlalchemy.exc import IntegrityError
+
+        records = self.build(
+            amount=amount,
+            funding_instrument_uri=funding_instrument_uri,
+            customer=customer,
+            subscription=subscription,
+            title=title,
+            items=items,
+            adjustments=adjustments,
+            external_id=external_id,
+            appears_on_statement_as=appears_on_statement_as,
+            scheduled_at=scheduled_at,
+        )
+        invoice = records[0]
+        self.session.add_all(records)
+        # keep the yielded period counter of subscription in sync, it's
+        # increased in SQL, so that concurrent increments won't be lost
+        if subscription is not None:
+            subscription.period = tables.Subscription.period + 1
 
         # ensure (customer_guid, external_id) is unique
         try:
@@ -225,47 +355,87 @@ class InvoiceModel(BaseTableModel):
                 'Invoice {} with external_id {} already exists'
                 .format(customer.guid, external_id)
             )
+        return invoice
 
-        if items:
-            for item in items:
-                record = tables.Item(
-                    invoice=invoice,
-                    name=item['name'],
-                    amount=item['amount'],
-                    type=item.get('type'),
-                    quantity=item.get('quantity'),
-                    unit=item.get('unit'),
-                    volume=item.get('volume'),
-                )
-                self.session.add(record)
-            self.session.flush()
+    def create_many(self, invoices):
+        """Create customer invoices in bulk and return them, all records
+        (invoices, items, adjustments and transactions) are inserted with one
+        flush. Transactions of invoices with funding_instrument_uri are
+        created but not processed.
 
-        # TODO: what about an invalid adjust? say, it makes the total of invoice
-        # a negative value? I think we should not allow user to create such
-        # invalid invoice
-        if adjustments:
-            for adjustment in adjustments:
-                record = tables.Adjustment(
-                    invoice=invoice,
-                    amount=adjustment['amount'],
-                    reason=adjustment.get('reason'),
-                )
-                self.session.add(record)
-            self.session.flush()
+        :param invoices: a list of dict with the same keys as arguments of
+            `create` (customer invoice only)
+        """
+        CustomerInvoice = tables.CustomerInvoice
 
-        # as if we set the funding_instrument_uri at very first, we want to charge it
-        # immediately, so we create a transaction right away, also set the
-        # status to PROCESSING
-        if funding_instrument_uri is not None and invoice.amount > 0:
-            invoice.status = self.statuses.PROCESSING
-            self._create_transaction(invoice)
-        # it is zero amount, nothing to charge, just switch to
-        # SETTLED status
-        elif invoice.amount == 0:
-            invoice.status = self.statuses.SETTLED
+        # check all invoices before creating any of them
+        errors = []
+        pairs = {}
+        for index, kwargs in enumerate(invoices):
+            if kwargs['amount'] < 0:
+                errors.append(dict(
+                    index=index,
+                    error_message='Negative amount {} is not allowed'
+                                  .format(kwargs['amount']),
+                ))
+            external_id = kwargs.get('external_id')
+            if external_id is None:
+                continue
+            pair = (kwargs['customer'].guid, external_id)
+            if pair in pairs:
+                errors.append(dict(
+                    index=index,
+                    error_message='Duplicate external_id {} of invoice {}'
+                                  .format(external_id, pairs[pair]),
+                ))
+                continue
+            pairs[pair] = index
+        # ensure (customer_guid, external_id) is unique
+        if pairs:
+            query = (
+                self.session.query(
+                    CustomerInvoice.customer_guid,
+                    CustomerInvoice.external_id,
+                )
+                .filter(CustomerInvoice.customer_guid.in_(
+                    set(customer_guid for customer_guid, _ in pairs)
+                ))
+            )
+            existing = query_in_batches(
+                query,
+                CustomerInvoice.external_id,
+                set(external_id for _, external_id in pairs),
+            )
+            for pair in existing:
+                pair = tuple(pair)
+                if pair not in pairs:
+                    continue
+                errors.append(dict(
+                    index=pairs[pair],
+                    error_message='Invoice {} with external_id {} already '
+                                  'exists'.format(*pair),
+                ))
+        if errors:
+            errors.sort(key=lambda error: error['index'])
+            raise InvoiceBulkCreateError(
+                '{} of {} invoices are invalid'.format(
+                    len(set(error['index'] for error in errors)),
+                    len(invoices),
+                ),
+                errors=errors,
+            )
 
+        now = tables.now_func()
+        result = []
+        records = []
+        for kwargs in invoices:
+            built = self.build(now=now, **kwargs)
+            records.extend(built)
+            result.append(built[0])
+
+        self.session.add_all(records)
         self.session.flush()
-        return invoice
+        return result
 
     def update_funding_instrument_uri(self, invoice, funding_instrument_uri):
         """Update the funding_instrument_uri of an invoice, as it may yield
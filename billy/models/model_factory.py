@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
+import threading
 
 from billy.models.company import CompanyModel
+from billy.models.callback import CallbackModel
 from billy.models.customer import CustomerModel
 from billy.models.plan import PlanModel
 from billy.models.invoice import InvoiceModel
@@ -22,12 +24,37 @@ class ModelFactory(object):
         """
         return self.processor_factory()
 
+    def create_processor_getter(self, api_key):
+        """Create a function which returns a processor configured with given
+        API key for current thread. Processors are not assumed to be thread
+        safe, so every thread gets its own one, the API key is kept by the
+        processor and applied to its calls only, so that processors of
+        different companies can be used by threads at the same time
+
+        """
+        local = threading.local()
+
+        def get_processor():
+            processor = getattr(local, 'processor', None)
+            if processor is None:
+                processor = self.create_processor()
+                processor.configure_api_key(api_key)
+                local.processor = processor
+            return processor
+        return get_processor
+
     def create_company_model(self):
         """Create a company model
 
         """
         return CompanyModel(self)
 
+    def create_callback_model(self):
+        """Create a callback model
+
+        """
+        return CallbackModel(self)
+
     def create_customer_model(self):
         """Create a customer model
 
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import paginate_by_keys
 from billy.utils.generic import make_guid
 
 
@@ -15,7 +16,7 @@ class PlanModel(BaseTableModel):
     frequencies = tables.PlanFrequency
 
     @decorate_offset_limit
-    def list_by_context(self, context):
+    def list_by_context(self, context, after=None, before=None):
         """List plan by a given context
 
         """
@@ -28,8 +29,12 @@ class PlanModel(BaseTableModel):
         else:
             raise ValueError('Unsupported context {}'.format(context))
 
-        query = query.order_by(Plan.created_at.desc())
-        return query
+        return paginate_by_keys(
+            query,
+            keys=[Plan.created_at, Plan.guid],
+            after=after,
+            before=before,
+        )
 
     def create(
         self,
@@ -1,13 +1,19 @@
 from __future__ import unicode_literals
+import time
 import logging
 import functools
+import threading
 
+import requests
 import balanced
+from balanced._http_client import before_request_hooks
 
 from billy.models.transaction import TransactionModel
 from billy.models.processors.base import PaymentProcessor
 from billy.utils.generic import dumps_pretty_json
+from billy.utils.metrics import processor_latency
 from billy.errors import BillyError
+from billy.errors import ProcessorUnavailableError
 
 
 class InvalidURIFormat(BillyError):
@@ -43,13 +49,89 @@ def ensure_api_key_configured(func):
     """
     @functools.wraps(func)
     def callee(self, *args, **kwargs):
-        assert self._configured_api_key and balanced.is_configured(), (
+        assert self.api_key, (
             'API key need to be configured before calling any other methods'
         )
         return func(self, *args, **kwargs)
     return callee
 
 
+#: options of HTTP requests to Balanced made by current thread
+_request_options = threading.local()
+
+
+def apply_request_options(client, http_op, url, kwargs):
+    """Hook of Balanced HTTP client for applying the API key and timeout of
+    current call to the HTTP request
+
+    """
+    api_key = getattr(_request_options, 'api_key', None)
+    if api_key is not None:
+        kwargs['auth'] = (api_key, None)
+    timeout = getattr(_request_options, 'timeout', None)
+    if timeout is not None:
+        kwargs.setdefault('timeout', timeout)
+
+if apply_request_options not in before_request_hooks:
+    before_request_hooks.append(apply_request_options)
+
+
+def is_unavailable_error(error):
+    """Determine whether given error indicates Balanced is unavailable (timed
+    out, connection failed or server error), rather than an error of the
+    request itself, like a declined card
+
+    """
+    if isinstance(error, balanced.exc.HTTPError):
+        return getattr(error, 'status_code', 0) >= 500
+    return isinstance(error, requests.RequestException)
+
+
+def processor_call(func):
+    """This decorator makes calls to Balanced in the decorated method
+    guarded: the call is rejected with ProcessorUnavailableError when the
+    circuit breaker is open, HTTP requests are made with the API key and
+    timeout of the processor, and latency of the call is recorded by method
+    name
+
+    """
+    @functools.wraps(func)
+    def callee(self, *args, **kwargs):
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            raise ProcessorUnavailableError(
+                'Balanced is unavailable, {} is not called'
+                .format(func.__name__)
+            )
+        old_api_key = getattr(_request_options, 'api_key', None)
+        old_timeout = getattr(_request_options, 'timeout', None)
+        # the API key is applied to requests made by current thread only,
+        # rather than configured globally, as processors of different
+        # companies can be called by threads at the same time
+        _request_options.api_key = self.api_key
+        _request_options.timeout = self.timeout
+        begin = time.time()
+        try:
+            result = func(self, *args, **kwargs)
+        except Exception, e:
+            if breaker is not None:
+                if is_unavailable_error(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        finally:
+            _request_options.api_key = old_api_key
+            _request_options.timeout = old_timeout
+            if self.metrics is not None:
+                self.metrics.observe(func.__name__, time.time() - begin)
+    return callee
+
+
 class BalancedProcessor(PaymentProcessor):
 
     #: map balanced API statuses to transaction status
@@ -72,8 +154,21 @@ class BalancedProcessor(PaymentProcessor):
         event_cls=balanced.Event,
         callback_cls=balanced.Callback,
         logger=None,
+        timeout=None,
+        circuit_breaker=None,
+        metrics=processor_latency,
     ):
+        """Create a processor
+
+        :param timeout: seconds to wait for each HTTP request to Balanced
+        :param circuit_breaker: the CircuitBreaker shared by processors for
+            rejecting calls when Balanced is unavailable
+        :param metrics: the LatencyMetrics to record latency of calls to
+        """
         self.logger = logger or logging.getLogger(__name__)
+        self.timeout = timeout
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
         self.customer_cls = customer_cls
         self.debit_cls = debit_cls
         self.credit_cls = credit_cls
@@ -82,16 +177,16 @@ class BalancedProcessor(PaymentProcessor):
         self.card_cls = card_cls
         self.event_cls = event_cls
         self.callback_cls = callback_cls
-        self._configured_api_key = False
+        self.api_key = None
 
     def _to_cent(self, amount):
         return int(amount)
 
     def configure_api_key(self, api_key):
-        balanced.configure(api_key)
-        self._configured_api_key = True
+        self.api_key = api_key
 
     @ensure_api_key_configured
+    @processor_call
     def callback(self, company, payload):
         self.logger.info(
             'Handling callback company=%s, event_id=%s, event_type=%s',
@@ -106,6 +201,10 @@ class BalancedProcessor(PaymentProcessor):
             uri = '/v1/events/{}'.format(payload['id'])
             event = self.event_cls.find(uri)
         except balanced.exc.BalancedError, e:
+            # Balanced is unavailable, the event might be real, let the
+            # caller try again later
+            if is_unavailable_error(e):
+                raise
             raise InvalidCallbackPayload(
                 'Invalid callback payload '
                 'BalancedError: {}'.format(e)
@@ -151,6 +250,7 @@ class BalancedProcessor(PaymentProcessor):
         return update_db
 
     @ensure_api_key_configured
+    @processor_call
     def register_callback(self, company, url):
         self.logger.info(
             'Registering company %s callback to URL %s',
@@ -162,6 +262,7 @@ class BalancedProcessor(PaymentProcessor):
         callback.save()
 
     @ensure_api_key_configured
+    @processor_call
     def create_customer(self, customer):
         self.logger.debug('Creating Balanced customer for %s', customer.guid)
         record = self.customer_cls(**{
@@ -171,6 +272,7 @@ class BalancedProcessor(PaymentProcessor):
         return record.uri
 
     @ensure_api_key_configured
+    @processor_call
     def prepare_customer(self, customer, funding_instrument_uri=None):
         self.logger.debug('Preparing customer %s with funding_instrument_uri=%s',
                           customer.guid, funding_instrument_uri)
@@ -196,6 +298,7 @@ class BalancedProcessor(PaymentProcessor):
             raise ValueError('Invalid funding_instrument_uri {}'.format(funding_instrument_uri))
 
     @ensure_api_key_configured
+    @processor_call
     def validate_customer(self, processor_uri):
         if not processor_uri.startswith('/'):
             raise InvalidURIFormat(
@@ -214,6 +317,7 @@ class BalancedProcessor(PaymentProcessor):
         return True
 
     @ensure_api_key_configured
+    @processor_call
     def validate_funding_instrument(self, funding_instrument_uri):
         if not funding_instrument_uri.startswith('/'):
             raise InvalidURIFormat(
@@ -280,15 +384,21 @@ class BalancedProcessor(PaymentProcessor):
         customer = transaction.invoice.customer
 
         # do existing check before creation to make sure we won't duplicate
-        # transaction in Balanced service
-        record = self._get_resource_by_tx_guid(resource_cls, transaction.guid)
-        # We already have a record there in Balanced, this means we once did
-        # transaction, however, we failed to update database. No need to do
-        # it again, just return the URI
-        if record is not None:
-            self.logger.warn('Balanced transaction record for %s already '
-                             'exist', transaction.guid)
-            return self._resource_to_result(record)
+        # transaction in Balanced service, unless this is the first attempt
+        # to submit it (the attempt was recorded before calling us), then
+        # there is no way it exists in Balanced
+        if transaction.submit_attempts != 1:
+            record = self._get_resource_by_tx_guid(
+                resource_cls,
+                transaction.guid,
+            )
+            # We already have a record there in Balanced, this means we once
+            # did transaction, however, we failed to update database. No need
+            # to do it again, just return the URI
+            if record is not None:
+                self.logger.warn('Balanced transaction record for %s already '
+                                 'exist', transaction.guid)
+                return self._resource_to_result(record)
 
         # TODO: handle error here
         # get balanced customer record
@@ -320,6 +430,7 @@ class BalancedProcessor(PaymentProcessor):
         return self._resource_to_result(record)
 
     @ensure_api_key_configured
+    @processor_call
     def debit(self, transaction):
         extra_kwargs = {}
         if transaction.funding_instrument_uri is not None:
@@ -332,6 +443,7 @@ class BalancedProcessor(PaymentProcessor):
         )
 
     @ensure_api_key_configured
+    @processor_call
     def credit(self, transaction):
         extra_kwargs = {}
         if transaction.funding_instrument_uri is not None:
@@ -344,6 +456,7 @@ class BalancedProcessor(PaymentProcessor):
         )
 
     @ensure_api_key_configured
+    @processor_call
     def refund(self, transaction):
         return self._do_transaction(
             transaction=transaction,
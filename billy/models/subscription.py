@@ -1,10 +1,13 @@
 from __future__ import unicode_literals
 
 from sqlalchemy.sql.expression import not_
+from sqlalchemy.sql.expression import and_
+from sqlalchemy.sql.expression import or_
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import paginate_by_keys
 from billy.models.schedule import next_transaction_datetime
 from billy.errors import BillyError
 from billy.utils.generic import make_guid
@@ -22,7 +25,7 @@ class SubscriptionModel(BaseTableModel):
     TABLE = tables.Subscription
 
     @decorate_offset_limit
-    def list_by_context(self, context):
+    def list_by_context(self, context, after=None, before=None):
         """List subscriptions by a given context
 
         """
@@ -48,8 +51,12 @@ class SubscriptionModel(BaseTableModel):
         else:
             raise ValueError('Unsupported context {}'.format(context))
 
-        query = query.order_by(Subscription.created_at.desc())
-        return query
+        return paginate_by_keys(
+            query,
+            keys=[Subscription.created_at, Subscription.guid],
+            after=after,
+            before=before,
+        )
 
     def create(
         self,
@@ -81,6 +88,7 @@ class SubscriptionModel(BaseTableModel):
             appears_on_statement_as=appears_on_statement_as,
             started_at=started_at,
             next_invoice_at=started_at,
+            period=0,
             created_at=now,
             updated_at=now,
         )
@@ -89,6 +97,46 @@ class SubscriptionModel(BaseTableModel):
         self.yield_invoices([subscription])
         return subscription
 
+    def create_many(self, subscriptions):
+        """Create subscriptions in bulk and return them, all of them are
+        inserted with one flush. Unlike `create`, invoices are not yielded
+        right away, they will be yielded by `yield_invoices` (the
+        transaction processing script) later
+
+        :param subscriptions: a list of dict with the same keys as arguments
+            of `create`
+        """
+        now = tables.now_func()
+        records = []
+        for kwargs in subscriptions:
+            amount = kwargs.get('amount')
+            if amount is not None and amount <= 0:
+                raise ValueError(
+                    'Amount should be a non-zero postive integer'
+                )
+            started_at = kwargs.get('started_at')
+            if started_at is None:
+                started_at = now
+            elif started_at < now:
+                raise ValueError('Past started_at time is not allowed')
+            records.append(tables.Subscription(
+                guid='SU' + make_guid(),
+                customer=kwargs['customer'],
+                plan=kwargs['plan'],
+                amount=amount,
+                funding_instrument_uri=kwargs.get('funding_instrument_uri'),
+                external_id=kwargs.get('external_id'),
+                appears_on_statement_as=kwargs.get('appears_on_statement_as'),
+                started_at=started_at,
+                next_invoice_at=started_at,
+                period=0,
+                created_at=now,
+                updated_at=now,
+            ))
+        self.session.add_all(records)
+        self.session.flush()
+        return records
+
     def update(self, subscription, **kwargs):
         """Update a subscription
 
@@ -132,7 +180,6 @@ class SubscriptionModel(BaseTableModel):
         if now is None:
             now = tables.now_func()
 
-        invoice_model = self.factory.create_invoice_model()
         Subscription = tables.Subscription
 
         subscription_guids = []
@@ -140,64 +187,132 @@ class SubscriptionModel(BaseTableModel):
             subscription_guids = [
                 subscription.guid for subscription in subscriptions
             ]
-        invoices = []
 
-        # as we may have multiple new invoices for one subscription to
-        # yield now, for example, we didn't run this method for a long while,
-        # in this case, we need to make sure all transactions are yielded
-        while True:
-            # find subscriptions which should yield new invoices
-            query = (
-                self.session.query(Subscription)
-                .filter(Subscription.next_invoice_at <= now)
-                .filter(not_(Subscription.canceled))
-            )
-            if subscription_guids:
-                query = query.filter(Subscription.guid.in_(subscription_guids))
-            query = list(query)
+        query = self._due_query(now)
+        if subscription_guids:
+            query = query.filter(Subscription.guid.in_(subscription_guids))
+        invoices, _ = self._yield_from(query, now)
+        return invoices
+
+    def yield_invoices_in_chunks(self, chunk_size, now=None):
+        """Generate new scheduled invoices from all subscriptions chunk by
+        chunk, subscriptions are paged through in order of next_invoice_at
+        and guid, and every chunk is flushed and removed from the session
+        right after yielding, so that memory usage stays bounded no matter
+        how many subscriptions there are
+
+        :param chunk_size: number of subscriptions to yield in a chunk
+        :param now: the current date time to use, now_func() will be used by
+            default
+        :return: count of generated invoices
+        """
+        if now is None:
+            now = tables.now_func()
 
-            # okay, we have no more subscription to process, just break
-            if not query:
-                self.logger.info('No more subscriptions to process')
+        Subscription = tables.Subscription
+
+        count = 0
+        after = None
+        while True:
+            query = self._due_query(now)
+            if after is not None:
+                next_invoice_at, guid = after
+                query = query.filter(or_(
+                    Subscription.next_invoice_at > next_invoice_at,
+                    and_(
+                        Subscription.next_invoice_at == next_invoice_at,
+                        Subscription.guid > guid,
+                    ),
+                ))
+            subscriptions = query.limit(chunk_size).all()
+            if not subscriptions:
                 break
+            # remember the position before we advance next_invoice_at
+            last = subscriptions[-1]
+            after = (last.next_invoice_at, last.guid)
+            invoices, records = self._yield_from(subscriptions, now)
+            count += len(invoices)
+            self.expunge(subscriptions)
+            self.expunge(records)
+        return count
 
-            for subscription in query:
-                amount = subscription.effective_amount
-                # create the new transaction for this subscription
-                invoice = invoice_model.create(
-                    subscription=subscription,
+    def _due_query(self, now):
+        """Query subscriptions which should yield new invoices at given time,
+        in order of next_invoice_at and guid
+
+        """
+        Subscription = tables.Subscription
+        return (
+            self.session.query(Subscription)
+            .filter(Subscription.next_invoice_at <= now)
+            .filter(not_(Subscription.canceled))
+            .order_by(Subscription.next_invoice_at, Subscription.guid)
+        )
+
+    def _yield_from(self, subscriptions, now):
+        """Generate new scheduled invoices from given due subscriptions,
+        return generated invoices and all created records
+
+        """
+        invoice_model = self.factory.create_invoice_model()
+
+        invoices = []
+        records = []
+        for subscription in subscriptions:
+            plan = subscription.plan
+            # as we may have multiple new invoices for one subscription to
+            # yield now, for example, we didn't run this method for a long
+            # while, in this case, we work out all missed periods of the
+            # subscription in one pass rather than query it again and again
+            period = subscription.period
+            next_invoice_at = subscription.next_invoice_at
+            first_period = period
+            while next_invoice_at <= now:
+                built = invoice_model.build(
+                    amount=subscription.effective_amount,
                     funding_instrument_uri=subscription.funding_instrument_uri,
-                    amount=amount,
-                    scheduled_at=subscription.next_invoice_at,
-                    appears_on_statement_as=subscription.appears_on_statement_as,
-                )
-                self.logger.info(
-                    'Created subscription invoice for %s, guid=%s, '
-                    'plan_type=%s, funding_instrument_uri=%s, '
-                    'amount=%s, scheduled_at=%s, period=%s',
-                    subscription.guid,
-                    invoice.guid,
-                    subscription.plan.plan_type,
-                    invoice.funding_instrument_uri,
-                    invoice.amount,
-                    invoice.scheduled_at,
-                    subscription.invoice_count - 1,
+                    subscription=subscription,
+                    appears_on_statement_as=(
+                        subscription.appears_on_statement_as
+                    ),
+                    scheduled_at=next_invoice_at,
+                    now=now,
                 )
-                # advance the next invoice time
-                subscription.next_invoice_at = next_transaction_datetime(
+                records.extend(built)
+                invoices.append(built[0])
+                period += 1
+                next_invoice_at = next_transaction_datetime(
                     started_at=subscription.started_at,
-                    frequency=subscription.plan.frequency,
-                    period=subscription.invoice_count,
-                    interval=subscription.plan.interval,
+                    frequency=plan.frequency,
+                    period=period,
+                    interval=plan.interval,
                 )
-                self.logger.info(
-                    'Schedule next invoice of %s at %s (period=%s)',
-                    subscription.guid,
-                    subscription.next_invoice_at,
-                    subscription.invoice_count,
-                )
-                self.session.flush()
-                invoices.append(invoice)
+            self.logger.info(
+                'Created %s subscription invoices for %s, plan_type=%s, '
+                'funding_instrument_uri=%s, amount=%s, periods=%s to %s',
+                period - first_period,
+                subscription.guid,
+                plan.plan_type,
+                subscription.funding_instrument_uri,
+                subscription.effective_amount,
+                first_period,
+                period - 1,
+            )
+            # advance the next invoice time
+            subscription.next_invoice_at = next_invoice_at
+            subscription.period = period
+            self.logger.info(
+                'Schedule next invoice of %s at %s (period=%s)',
+                subscription.guid,
+                subscription.next_invoice_at,
+                period,
+            )
 
+        if not invoices:
+            self.logger.info('No more subscriptions to process')
+
+        # insert all yielded records at once, as all of them come with
+        # primary keys, they will be inserted in batch
+        self.session.add_all(records)
         self.session.flush()
-        return invoices
+        return invoices, records
@@ -1,11 +1,22 @@
 from __future__ import unicode_literals
+import random
+import datetime
 
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm import with_polymorphic
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import and_
+from sqlalchemy.sql.expression import or_
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import paginate_by_keys
+from billy.models.base import query_in_batches
 from billy.errors import BillyError
+from billy.errors import ProcessorUnavailableError
 from billy.utils.generic import make_guid
 
 
@@ -22,6 +33,14 @@ class TransactionModel(BaseTableModel):
 
     #: the default maximum retry count
     DEFAULT_MAXIMUM_RETRY = 10
+    #: the default seconds to wait before retrying a failed transaction, it
+    #  is doubled for every further failure, zero means retry right away
+    DEFAULT_RETRY_DELAY = 60
+    #: the default maximum seconds to wait before retrying
+    DEFAULT_MAXIMUM_RETRY_DELAY = 24 * 60 * 60
+    #: the default ratio of the delay to be randomized, so that transactions
+    #  failed at the same time won't be retried at the same time
+    DEFAULT_RETRY_JITTER = 0.1
 
     types = tables.TransactionType
 
@@ -37,6 +56,32 @@ class TransactionModel(BaseTableModel):
         ))
         return maximum_retry
 
+    def get_retry_delay(self, failure_count):
+        """Get seconds to wait before retrying a transaction which failed
+        given times, it grows exponentially up to
+        `billy.transaction.maximum_retry_delay` from
+        `billy.transaction.retry_delay`, and is randomized by
+        `billy.transaction.retry_jitter`
+
+        """
+        settings = self.factory.settings
+        delay = float(settings.get(
+            'billy.transaction.retry_delay',
+            self.DEFAULT_RETRY_DELAY,
+        ))
+        maximum_delay = float(settings.get(
+            'billy.transaction.maximum_retry_delay',
+            self.DEFAULT_MAXIMUM_RETRY_DELAY,
+        ))
+        jitter = float(settings.get(
+            'billy.transaction.retry_jitter',
+            self.DEFAULT_RETRY_JITTER,
+        ))
+        # avoid overflow with a huge failure count
+        exponent = min(max(failure_count - 1, 0), 32)
+        delay = min(delay * (2 ** exponent), maximum_delay)
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
     def get_last_transaction(self):
         """Get last transaction
 
@@ -49,7 +94,7 @@ class TransactionModel(BaseTableModel):
         return query.first()
 
     @decorate_offset_limit
-    def list_by_context(self, context):
+    def list_by_context(self, context, after=None, before=None):
         """List transactions by a given context
 
         """
@@ -88,22 +133,6 @@ class TransactionModel(BaseTableModel):
                 Subscription.guid == SubscriptionInvoice.subscription_guid,
             )
         )
-        # joined customer query
-        customer_query = (
-            customer_invoice_query
-            .join(
-                Customer,
-                Customer.guid == CustomerInvoice.customer_guid,
-            )
-        )
-        # joined plan query
-        plan_query = (
-            subscription_query
-            .join(
-                Plan,
-                Plan.guid == Subscription.plan_guid,
-            )
-        )
 
         if isinstance(context, Invoice):
             query = (
@@ -126,22 +155,42 @@ class TransactionModel(BaseTableModel):
                 .filter(Subscription.plan == context)
             )
         elif isinstance(context, Company):
-            q1 = (
-                plan_query
-                .filter(Plan.company == context)
-            )
-            q2 = (
-                customer_query
-                .filter(Customer.company == context)
+            query = (
+                basic_query
+                .filter(Transaction.company_guid == context.guid)
             )
-            query = q1.union(q2)
         else:
             raise ValueError('Unsupported context {}'.format(context))
 
-        query = query.order_by(Transaction.created_at.desc())
-        return query
+        return paginate_by_keys(
+            query,
+            keys=[Transaction.created_at, Transaction.guid],
+            after=after,
+            before=before,
+        )
 
-    def create(
+    def list_for_export(
+        self,
+        company,
+        created_after=None,
+        created_before=None,
+    ):
+        """List transactions of given company created in range
+        [created_after, created_before) in created order for exporting
+
+        """
+        Transaction = tables.Transaction
+        query = (
+            self.session.query(Transaction)
+            .filter(Transaction.company_guid == company.guid)
+        )
+        if created_after is not None:
+            query = query.filter(Transaction.created_at >= created_after)
+        if created_before is not None:
+            query = query.filter(Transaction.created_at < created_before)
+        return query.order_by(Transaction.created_at, Transaction.guid)
+
+    def build(
         self,
         invoice,
         amount,
@@ -149,8 +198,10 @@ class TransactionModel(BaseTableModel):
         funding_instrument_uri=None,
         reference_to=None,
         appears_on_statement_as=None,
+        now=None,
     ):
-        """Create a transaction and return
+        """Build a transaction of given invoice without flushing it and
+        return, so that transactions can be inserted in batch
 
         """
         if transaction_type is None:
@@ -173,19 +224,44 @@ class TransactionModel(BaseTableModel):
                     'Only charge/payout transaction can be refunded/reversed'
                 )
 
-        now = tables.now_func()
+        if now is None:
+            now = tables.now_func()
         transaction = tables.Transaction(
             guid='TX' + make_guid(),
+            company_guid=invoice.company_guid,
             transaction_type=transaction_type,
             amount=amount,
             funding_instrument_uri=funding_instrument_uri,
             appears_on_statement_as=appears_on_statement_as,
             submit_status=self.submit_statuses.STAGED,
             reference_to=reference_to,
+            next_attempt_at=now,
             created_at=now,
             updated_at=now,
             invoice=invoice,
         )
+        return transaction
+
+    def create(
+        self,
+        invoice,
+        amount,
+        transaction_type=None,
+        funding_instrument_uri=None,
+        reference_to=None,
+        appears_on_statement_as=None,
+    ):
+        """Create a transaction and return
+
+        """
+        transaction = self.build(
+            invoice=invoice,
+            amount=amount,
+            transaction_type=transaction_type,
+            funding_instrument_uri=funding_instrument_uri,
+            reference_to=reference_to,
+            appears_on_statement_as=appears_on_statement_as,
+        )
         self.session.add(transaction)
         self.session.flush()
         return transaction
@@ -204,9 +280,8 @@ class TransactionModel(BaseTableModel):
         """Add a status updating event of transaction from callback
 
         """
+        Transaction = tables.Transaction
         now = tables.now_func()
-        # the latest event of this transaction
-        last_event = transaction.events.first()
 
         event = tables.TransactionEvent(
             guid='TE' + make_guid(),
@@ -248,8 +323,27 @@ class TransactionModel(BaseTableModel):
         # attackers can send us an old `succeeded` event to make the invoice
         # settled.  This is why we need to ensure only the latest event can
         # affect status of invoice.
-        if last_event is not None and occurred_at <= last_event.occurred_at:
+        #
+        # The latest event is recorded in the transaction row, it is
+        # replaced only if this event occurred after it, with one statement,
+        # so that concurrent callbacks of the same transaction cannot both
+        # win
+        count = (
+            self.session.query(Transaction)
+            .filter(Transaction.guid == transaction.guid)
+            .filter(or_(
+                Transaction.last_event_at.is_(None),
+                Transaction.last_event_at < occurred_at,
+            ))
+            .update(
+                dict(last_event_at=occurred_at, last_event_id=processor_id),
+                synchronize_session=False,
+            )
+        )
+        if not count:
             return
+        set_committed_value(transaction, 'last_event_at', occurred_at)
+        set_committed_value(transaction, 'last_event_id', processor_id)
 
         old_status = transaction.status
         transaction.updated_at = now
@@ -263,11 +357,108 @@ class TransactionModel(BaseTableModel):
         )
         self.session.flush()
 
-    def process_one(self, transaction):
+    def prefetch(self, transactions):
+        """Load everything processing given transactions needs (invoices,
+        subscriptions, customers, companies, attached funding instruments
+        and referenced transactions)
+        with one query for each kind of record and attach them to the
+        transactions, instead of lazy loading them transaction by
+        transaction
+
+        """
+        Transaction = tables.Transaction
+        Invoice = tables.Invoice
+        SubscriptionInvoice = tables.SubscriptionInvoice
+        CustomerInvoice = tables.CustomerInvoice
+        Subscription = tables.Subscription
+        Customer = tables.Customer
+        Company = tables.Company
+        AttachedFundingInstrument = tables.AttachedFundingInstrument
+
+        def attach(records, key, foreign_key, table, column=None):
+            """Load referenced records of given records in one query, and
+            set them as committed value of the relationship, so that they
+            won't be lazy loaded (and garbage collected) later
+
+            """
+            if column is None:
+                column = table.guid
+            guids = set(
+                getattr(record, foreign_key) for record in records
+                if getattr(record, foreign_key) is not None
+            )
+            loaded = query_in_batches(
+                self.session.query(table),
+                column,
+                guids,
+            )
+            loaded_by_guid = dict((item.guid, item) for item in loaded)
+            for record in records:
+                guid = getattr(record, foreign_key)
+                if guid is not None:
+                    set_committed_value(record, key, loaded_by_guid.get(guid))
+            return loaded
+
+        transactions = list(transactions)
+        if not transactions:
+            return
+
+        attach(transactions, 'reference_to', 'reference_to_guid', Transaction)
+        # load columns of both invoice types in one query
+        invoice_entity = with_polymorphic(Invoice, '*')
+        invoices = attach(
+            transactions,
+            'invoice',
+            'invoice_guid',
+            invoice_entity,
+            column=invoice_entity.guid,
+        )
+        subscription_invoices = [
+            invoice for invoice in invoices
+            if isinstance(invoice, SubscriptionInvoice)
+        ]
+        customer_invoices = [
+            invoice for invoice in invoices
+            if isinstance(invoice, CustomerInvoice)
+        ]
+        subscriptions = attach(
+            subscription_invoices,
+            'subscription',
+            'subscription_guid',
+            Subscription,
+        )
+        customers = attach(
+            subscriptions + customer_invoices,
+            'customer',
+            'customer_guid',
+            Customer,
+        )
+        attach(customers, 'company', 'company_guid', Company)
+        # funding instruments attached to the customers
+        attached = dict((customer.guid, []) for customer in customers)
+        for record in query_in_batches(
+            self.session.query(AttachedFundingInstrument),
+            AttachedFundingInstrument.customer_guid,
+            set(attached),
+        ):
+            attached[record.customer_guid].append(record)
+        for customer in customers:
+            set_committed_value(
+                customer,
+                'attached_funding_instruments',
+                attached[customer.guid],
+            )
+
+    def process_one(self, transaction, attempt=None):
         """Process one transaction
 
+        :param transaction: the transaction to process
+        :param attempt: number of this submission attempt returned by
+            `mark_submit_attempts` in a committed database transaction, if
+            it is not given, the attempt will be recorded along with the
+            result, and the processor has to check whether the transaction
+            was created by previous attempts
         """
-        invoice_model = self.factory.create_invoice_model()
 
         # there is still chance we duplicate transaction, for example
         #
@@ -279,14 +470,50 @@ class TransactionModel(BaseTableModel):
         #
         # we need to lock transaction before we process it to avoid
         # situations like that
-        self.get(transaction.guid, with_lockmode='update')
+        self._lock(transaction)
 
         if transaction.submit_status == self.submit_statuses.DONE:
             raise ValueError('Cannot process a finished transaction {}'
                              .format(transaction.guid))
+        self._submit(transaction, attempt=attempt)
+
+    def _lock(self, transaction):
+        """Lock the row of given transaction and reload its columns, as it
+        might be processed by others since we loaded it. Querying with lock
+        doesn't refresh an object which is already in the session, and
+        refreshing all attributes would drop the prefetched relationships
+
+        """
+        column_keys = [
+            prop.key for prop in class_mapper(tables.Transaction).column_attrs
+        ]
+        self.session.refresh(
+            transaction,
+            attribute_names=column_keys,
+            lockmode='update',
+        )
+
+    def _submit(self, transaction, attempt=None):
+        """Submit a locked transaction to the processor and update its
+        status by the result
+
+        """
+        invoice_model = self.factory.create_invoice_model()
         self.logger.debug('Processing transaction %s', transaction.guid)
         now = tables.now_func()
 
+        # the attempt was not recorded before calling the processor, as it
+        # might be rolled back with the result, we cannot tell whether
+        # previous attempts reached the processor, make sure the processor
+        # won't see it as the first attempt. Otherwise, if others started
+        # submitting it since we recorded our attempt, the number is bigger
+        # than one already
+        if attempt is None:
+            transaction.submit_attempts = max(
+                transaction.submit_attempts + 1,
+                2,
+            )
+
         if transaction.invoice.invoice_type == invoice_model.types.SUBSCRIPTION:
             customer = transaction.invoice.subscription.customer
         else:
@@ -300,23 +527,52 @@ class TransactionModel(BaseTableModel):
             self.types.REFUND: processor.refund,
         }[transaction.transaction_type]
 
+        customer_model = self.factory.create_customer_model()
+        funding_instrument_uri = transaction.funding_instrument_uri
+        # the funding instrument was attached to the customer before, no
+        # need to prepare the customer again
+        attached = (
+            funding_instrument_uri is not None and
+            customer_model.is_funding_instrument_attached(
+                customer,
+                funding_instrument_uri,
+            )
+        )
+
         try:
             processor.configure_api_key(customer.company.processor_key)
-            self.logger.info(
-                'Preparing customer %s (processor_uri=%s)',
-                customer.guid,
-                customer.processor_uri,
-            )
-            # prepare customer (add bank account or credit card)
-            processor.prepare_customer(
-                customer=customer,
-                funding_instrument_uri=transaction.funding_instrument_uri,
-            )
+            if not attached:
+                self.logger.info(
+                    'Preparing customer %s (processor_uri=%s)',
+                    customer.guid,
+                    customer.processor_uri,
+                )
+                # prepare customer (add bank account or credit card)
+                processor.prepare_customer(
+                    customer=customer,
+                    funding_instrument_uri=funding_instrument_uri,
+                )
             # do charge/payout/refund
             result = method(transaction)
         except (SystemExit, KeyboardInterrupt):
             raise
+        except ProcessorUnavailableError, e:
+            # the processor was not called at all, so it doesn't count as a
+            # failure, just retry it later
+            self.logger.warn('Processor is unavailable, transaction %s will '
+                             'be retried later: %s', transaction.guid, e)
+            transaction.submit_status = self.submit_statuses.RETRYING
+            transaction.updated_at = now
+            self.session.flush()
+            return
         except Exception, e:
+            # the funding instrument might be removed from the customer,
+            # attach it again next time
+            if attached:
+                customer_model.forget_funding_instrument(
+                    customer,
+                    funding_instrument_uri,
+                )
             transaction.submit_status = self.submit_statuses.RETRYING
             failure_model = self.factory.create_transaction_failure_model()
             failure_model.create(
@@ -324,12 +580,18 @@ class TransactionModel(BaseTableModel):
                 error_message=unicode(e),
                 # TODO: error number and code?
             )
+            failure_count = transaction.failure_count
+            # back off, so that we won't keep hammering the processor
+            transaction.next_attempt_at = now + datetime.timedelta(
+                seconds=self.get_retry_delay(failure_count),
+            )
             self.logger.error('Failed to process transaction %s, '
-                              'failure_count=%s',
-                              transaction.guid, transaction.failure_count,
+                              'failure_count=%s, next_attempt_at=%s',
+                              transaction.guid, failure_count,
+                              transaction.next_attempt_at,
                               exc_info=True)
             # the failure times exceed the limitation
-            if transaction.failure_count > self.maximum_retry:
+            if failure_count > self.maximum_retry:
                 self.logger.error('Exceed maximum retry limitation %s, '
                                   'transaction %s failed', self.maximum_retry,
                                   transaction.guid)
@@ -345,10 +607,16 @@ class TransactionModel(BaseTableModel):
             self.session.flush()
             return
 
+        if funding_instrument_uri is not None and not attached:
+            customer_model.mark_funding_instrument_attached(
+                customer,
+                funding_instrument_uri,
+            )
         old_status = transaction.status
         transaction.processor_uri = result['processor_uri']
         transaction.status = result['status']
         transaction.submit_status = self.submit_statuses.DONE
+        transaction.next_attempt_at = None
         transaction.updated_at = tables.now_func()
         invoice_model.transaction_status_update(
             invoice=transaction.invoice,
@@ -362,23 +630,273 @@ class TransactionModel(BaseTableModel):
                          transaction.guid, transaction.submit_status,
                          result)
 
-    def process_transactions(self, transactions=None):
-        """Process all transactions
+    def _due(self, now):
+        """Get the criteria of transactions which are waiting to be submitted
+        (STAGED or RETRYING) and due to be submitted at given time
 
         """
         Transaction = tables.Transaction
-        query = (
-            self.session.query(Transaction)
-            .filter(Transaction.submit_status.in_([
+        return and_(
+            Transaction.submit_status.in_([
                 self.submit_statuses.STAGED,
-                self.submit_statuses.RETRYING]
+                self.submit_statuses.RETRYING,
+            ]),
+            Transaction.next_attempt_at <= now,
+        )
+
+    def list_pending_guids(self, after=None, limit=None):
+        """List guids of transactions which are waiting to be submitted
+        (STAGED or RETRYING) and due in created order, transactions waiting
+        to be retried later are not listed
+
+        :param after: only list transactions after the transaction of this
+            guid in the order, so that we can page through pending
+            transactions without OFFSET
+        :param limit: maximum number of guids to list
+        """
+        Transaction = tables.Transaction
+        query = (
+            self.session.query(Transaction.guid)
+            .filter(self._due(tables.now_func()))
+        )
+        if after is not None:
+            AfterTransaction = aliased(Transaction)
+            after_created_at = (
+                self.session.query(AfterTransaction.created_at)
+                .filter(AfterTransaction.guid == after)
+                .as_scalar()
+            )
+            query = query.filter(or_(
+                Transaction.created_at > after_created_at,
+                and_(
+                    Transaction.created_at == after_created_at,
+                    Transaction.guid > after,
+                ),
             ))
+        query = query.order_by(Transaction.created_at, Transaction.guid)
+        if limit is not None:
+            query = query.limit(limit)
+        return [guid for guid, in query]
+
+    def process_pending(self, guid, attempt=None):
+        """Lock the transaction of given guid and process it if it is still
+        waiting to be submitted (STAGED or RETRYING) and due, return the
+        processed transaction, or None if there is nothing to do with it (it
+        might be processed, canceled or rescheduled by others already)
+
+        :param attempt: number of this submission attempt returned by
+            `mark_submit_attempts`
+        """
+        transaction = self.get(guid)
+        if transaction is None:
+            return None
+        self._lock(transaction)
+        if transaction.submit_status not in [
+            self.submit_statuses.STAGED,
+            self.submit_statuses.RETRYING,
+        ]:
+            self.logger.info('Transaction %s is %s, skip', guid,
+                             transaction.submit_status)
+            return None
+        if transaction.next_attempt_at > tables.now_func():
+            self.logger.info('Transaction %s will be retried at %s, skip',
+                             guid, transaction.next_attempt_at)
+            return None
+        self._submit(transaction, attempt=attempt)
+        return transaction
+
+    def mark_submit_attempts(self, guids):
+        """Increase the submission attempt counters of transactions of given
+        guids which are still waiting to be submitted, and return a dict
+        maps their guid to number of the attempt. The result should be
+        committed before calling the processor and passed as the `attempt`
+        argument of `process_pending` or `process_one`, then transactions
+        on their first attempt can be submitted without checking whether
+        they exist in the processor already
+
+        """
+        Transaction = tables.Transaction
+        guids = list(guids)
+        pending = Transaction.submit_status.in_([
+            self.submit_statuses.STAGED,
+            self.submit_statuses.RETRYING,
+        ])
+        for begin in range(0, len(guids), 500):
+            (
+                self.session.query(Transaction)
+                .filter(Transaction.guid.in_(guids[begin:begin + 500]))
+                .filter(pending)
+                .update(
+                    dict(submit_attempts=Transaction.submit_attempts + 1),
+                    synchronize_session=False,
+                )
+            )
+        return dict(query_in_batches(
+            (
+                self.session.query(
+                    Transaction.guid,
+                    Transaction.submit_attempts,
+                )
+                .filter(pending)
+            ),
+            Transaction.guid,
+            guids,
+        ))
+
+    def enqueue(self, transactions):
+        """Put given transactions into the job queue, so that they will be
+        submitted by the background worker instead of in current thread,
+        transactions which are already in the queue are ignored
+
+        """
+        TransactionJob = tables.TransactionJob
+        guids = set(transaction.guid for transaction in transactions)
+        if not guids:
+            return
+        queued = set(guid for guid, in query_in_batches(
+            self.session.query(TransactionJob.transaction_guid),
+            TransactionJob.transaction_guid,
+            guids,
+        ))
+        now = tables.now_func()
+        self.session.add_all([
+            TransactionJob(transaction_guid=guid, created_at=now)
+            for guid in sorted(guids - queued)
+        ])
+        self.session.flush()
+
+    def claim_jobs(self, worker_id, limit, lease_seconds,
+                   maximum_attempts=None):
+        """Claim at most `limit` jobs in the queue for given worker in
+        created order and return guids of their transactions. Jobs claimed
+        by other workers are skipped, unless they were claimed more than
+        `lease_seconds` ago (the worker might be dead). Jobs failed
+        `maximum_attempts` times are given up and never claimed again
+
+        """
+        TransactionJob = tables.TransactionJob
+        now = tables.now_func()
+        expired_at = now - datetime.timedelta(seconds=lease_seconds)
+        claimable = or_(
+            TransactionJob.locked_at.is_(None),
+            TransactionJob.locked_at < expired_at,
+        )
+        if maximum_attempts is not None:
+            claimable = and_(
+                claimable,
+                TransactionJob.attempts < maximum_attempts,
+            )
+        guids = [
+            guid for guid, in (
+                self.session.query(TransactionJob.transaction_guid)
+                .filter(claimable)
+                .order_by(TransactionJob.created_at,
+                          TransactionJob.transaction_guid)
+                .limit(limit)
+            )
+        ]
+        claimed = []
+        for guid in guids:
+            # only one of the workers racing for the same job can update it
+            count = (
+                self.session.query(TransactionJob)
+                .filter(TransactionJob.transaction_guid == guid)
+                .filter(claimable)
+                .update(
+                    dict(locked_by=worker_id, locked_at=now),
+                    synchronize_session=False,
+                )
+            )
+            if count:
+                claimed.append(guid)
+        return claimed
+
+    def process_job(self, guid, attempt=None):
+        """Process the transaction of given claimed job and remove the job
+        from the queue, return the processed transaction, or None if there
+        is nothing to do with it
+
+        """
+        TransactionJob = tables.TransactionJob
+        transaction = self.process_pending(guid, attempt=attempt)
+        (
+            self.session.query(TransactionJob)
+            .filter(TransactionJob.transaction_guid == guid)
+            .delete(synchronize_session=False)
+        )
+        return transaction
+
+    def fail_job(self, guid, error_message):
+        """Record a failed attempt to process the job of given transaction
+        guid, return the number of failed attempts so far
+
+        """
+        TransactionJob = tables.TransactionJob
+        (
+            self.session.query(TransactionJob)
+            .filter(TransactionJob.transaction_guid == guid)
+            .update(
+                dict(
+                    attempts=TransactionJob.attempts + 1,
+                    error_message=error_message,
+                ),
+                synchronize_session=False,
+            )
+        )
+        return (
+            self.session.query(TransactionJob.attempts)
+            .filter(TransactionJob.transaction_guid == guid)
+            .scalar()
+        )
+
+    def process_pending_in_chunks(self, chunk_size):
+        """Process all transactions which are waiting to be submitted chunk
+        by chunk, transactions are paged through in created order, and every
+        chunk is removed from the session after processing, so that memory
+        usage stays bounded no matter how many transactions are waiting
+
+        :param chunk_size: number of transactions to process in a chunk
+        :return: count of processed transactions
+        """
+        count = 0
+        after = None
+        while True:
+            guids = self.list_pending_guids(after=after, limit=chunk_size)
+            if not guids:
+                break
+            transactions = dict(
+                (transaction.guid, transaction)
+                for transaction in self.get_many(guids)
+            )
+            self.prefetch(transactions.values())
+            for guid in guids:
+                # it might be processed by others since we listed it
+                processed = self.process_pending(guid)
+                if processed is not None:
+                    count += 1
+            after = guids[-1]
+            self.expunge(transactions.values())
+        return count
+
+    def process_transactions(self, transactions=None, attempts=None):
+        """Process all transactions which are due, or given transactions
+
+        :param attempts: a dict maps guid of transaction to number of its
+            submission attempt returned by `mark_submit_attempts`
+        """
+        Transaction = tables.Transaction
+        query = (
+            self.session.query(Transaction)
+            .filter(self._due(tables.now_func()))
         )
         if transactions is not None:
             query = transactions
 
-        processed_transactions = []
-        for transaction in query:
-            self.process_one(transaction)
-            processed_transactions.append(transaction)
-        return processed_transactions
+        transactions = list(query)
+        self.prefetch(transactions)
+        for transaction in transactions:
+            self.process_one(
+                transaction,
+                attempt=(attempts or {}).get(transaction.guid),
+            )
+        return transactions
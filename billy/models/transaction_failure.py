@@ -27,5 +27,6 @@ class TransactionFailureModel(BaseTableModel):
             error_number=error_number,
         )
         self.session.add(failure)
+        transaction.failure_count += 1
         self.session.flush()
         return failure
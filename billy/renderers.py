@@ -1,12 +1,130 @@
 from __future__ import unicode_literals
+import types
+import functools
 
+from zope.interface import providedBy
+from pyramid.interfaces import IJSONAdapter
+from pyramid.path import DottedNameResolver
 from pyramid.renderers import JSON
 from pyramid.settings import asbool
 
 from billy.db import tables
+from billy.models.base import query_in_batches
 from billy.models.invoice import InvoiceModel
 
 
+class RenderPrefetch(object):
+    """Related records of all records in a page (items and adjustments of
+    invoices, failures of transactions and plans of subscriptions), loaded
+    with one query for each kind of them, so that adapters don't need to
+    lazy load them row by row
+
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.adjustments = {}
+        self.failures = {}
+        self.plans = {}
+
+    @classmethod
+    def load(cls, session, records):
+        """Load related records of given records and return the prefetch
+
+        """
+        Item = tables.Item
+        Adjustment = tables.Adjustment
+        TransactionFailure = tables.TransactionFailure
+        Plan = tables.Plan
+
+        prefetch = cls()
+
+        def group_by(guids, query, column, key):
+            result = dict((guid, []) for guid in guids)
+            for record in query_in_batches(query, column, guids):
+                result[getattr(record, key)].append(record)
+            return result
+
+        invoice_guids = [
+            record.guid for record in records
+            if isinstance(record, tables.Invoice)
+        ]
+        transaction_guids = [
+            record.guid for record in records
+            if isinstance(record, tables.Transaction)
+        ]
+        plan_guids = set(
+            record.plan_guid for record in records
+            if isinstance(record, tables.Subscription)
+        )
+        if invoice_guids:
+            prefetch.items = group_by(
+                invoice_guids,
+                session.query(Item).order_by(Item.item_id),
+                Item.invoice_guid,
+                'invoice_guid',
+            )
+            prefetch.adjustments = group_by(
+                invoice_guids,
+                session.query(Adjustment).order_by(Adjustment.adjustment_id),
+                Adjustment.invoice_guid,
+                'invoice_guid',
+            )
+        if transaction_guids:
+            prefetch.failures = group_by(
+                transaction_guids,
+                (
+                    session.query(TransactionFailure)
+                    .order_by(TransactionFailure.created_at)
+                ),
+                TransactionFailure.transaction_guid,
+                'transaction_guid',
+            )
+        if plan_guids:
+            prefetch.plans = dict(
+                (plan.guid, plan) for plan in
+                query_in_batches(session.query(Plan), Plan.guid, plan_guids)
+            )
+        return prefetch
+
+    def items_of(self, invoice):
+        try:
+            return self.items[invoice.guid]
+        except KeyError:
+            return invoice.items
+
+    def adjustments_of(self, invoice):
+        try:
+            return self.adjustments[invoice.guid]
+        except KeyError:
+            return invoice.adjustments
+
+    def failures_of(self, transaction):
+        try:
+            return self.failures[transaction.guid]
+        except KeyError:
+            return list(transaction.failures)
+
+    def effective_amount_of(self, subscription):
+        if subscription.amount is not None:
+            return subscription.amount
+        try:
+            return self.plans[subscription.plan_guid].amount
+        except KeyError:
+            return subscription.effective_amount
+
+
+def get_prefetch(request):
+    """Get the page-level prefetch set to the request, an empty one (which
+    falls back to relationships) is returned if there is no one
+
+    """
+    prefetch = getattr(request, 'render_prefetch', None)
+    if prefetch is None:
+        prefetch = RenderPrefetch()
+    return prefetch
+
+
 def company_adapter(company, request):
     extra_args = {}
     settings = request.registry.settings
@@ -38,8 +156,9 @@ def customer_adapter(customer, request):
 
 
 def invoice_adapter(invoice, request):
+    prefetch = get_prefetch(request)
     items = []
-    for item in invoice.items:
+    for item in prefetch.items_of(invoice):
         items.append(dict(
             name=item.name,
             amount=item.amount,
@@ -49,7 +168,7 @@ def invoice_adapter(invoice, request):
             unit=item.unit,
         ))
     adjustments = []
-    for adjustment in invoice.adjustments:
+    for adjustment in prefetch.adjustments_of(invoice):
         adjustments.append(dict(
             amount=adjustment.amount,
             reason=adjustment.reason,
@@ -100,16 +219,17 @@ def plan_adapter(plan, request):
 
 
 def subscription_adapter(subscription, request):
+    prefetch = get_prefetch(request)
     canceled_at = None
     if subscription.canceled_at is not None:
         canceled_at = subscription.canceled_at.isoformat()
     return dict(
         guid=subscription.guid,
         amount=subscription.amount,
-        effective_amount=subscription.effective_amount,
+        effective_amount=prefetch.effective_amount_of(subscription),
         funding_instrument_uri=subscription.funding_instrument_uri,
         appears_on_statement_as=subscription.appears_on_statement_as,
-        invoice_count=subscription.invoice_count,
+        invoice_count=subscription.period,
         canceled=subscription.canceled,
         next_invoice_at=subscription.next_invoice_at.isoformat(),
         created_at=subscription.created_at.isoformat(),
@@ -122,9 +242,11 @@ def subscription_adapter(subscription, request):
 
 
 def transaction_adapter(transaction, request):
+    prefetch = get_prefetch(request)
+    failures = prefetch.failures_of(transaction)
     serialized_failures = [
         transaction_failure_adapter(f, request)
-        for f in transaction.failures
+        for f in failures
     ]
     return dict(
         guid=transaction.guid,
@@ -136,7 +258,7 @@ def transaction_adapter(transaction, request):
         funding_instrument_uri=transaction.funding_instrument_uri,
         processor_uri=transaction.processor_uri,
         appears_on_statement_as=transaction.appears_on_statement_as,
-        failure_count=transaction.failure_count,
+        failure_count=len(failures),
         failures=serialized_failures,
         created_at=transaction.created_at.isoformat(),
         updated_at=transaction.updated_at.isoformat(),
@@ -159,15 +281,114 @@ def enum_symbol(enum_value):
     return str(enum_value).lower()
 
 
-def includeme(config):
-    settings = config.registry.settings
-    kwargs = {}
-    cfg_key = 'api.json.pretty_print'
-    pretty_print = settings.get(cfg_key, True)
+def stdlib_json_backend(pretty_print):
+    """Serializer backend based on the standard json module
+
+    """
+    import json
     if pretty_print:
         kwargs = dict(sort_keys=True, indent=4, separators=(',', ': '))
+    else:
+        kwargs = dict(separators=(',', ':'))
+    return functools.partial(json.dumps, **kwargs)
+
 
-    json_renderer = JSON(**kwargs)
+def simplejson_backend(pretty_print):
+    """Serializer backend based on simplejson, which comes with C speedups
+
+    """
+    import simplejson
+    if pretty_print:
+        kwargs = dict(sort_keys=True, indent=4, separators=(',', ': '))
+    else:
+        kwargs = dict(separators=(',', ':'))
+    return functools.partial(simplejson.dumps, **kwargs)
+
+
+def ujson_backend(pretty_print):
+    """Serializer backend based on ujson
+
+    """
+    import ujson
+    kwargs = dict(escape_forward_slashes=False)
+    if pretty_print:
+        kwargs.update(sort_keys=True, indent=4)
+    return functools.partial(ujson.dumps, **kwargs)
+
+
+#: available serializer backends, the value of `api.json.serializer` can
+#  also be dotted name to a backend
+SERIALIZER_BACKENDS = dict(
+    json=stdlib_json_backend,
+    simplejson=simplejson_backend,
+    ujson=ujson_backend,
+)
+
+
+def get_serializer(settings):
+    """Get the JSON serializer from settings and return, it is a function
+    which accepts plain data (dict, list, string, numbers, etc) and returns
+    JSON string
+
+    """
+    pretty_print = asbool(settings.get('api.json.pretty_print', True))
+    backend = settings.get('api.json.serializer', 'json')
+    if backend in SERIALIZER_BACKENDS:
+        backend = SERIALIZER_BACKENDS[backend]
+    else:
+        backend = DottedNameResolver().maybe_resolve(backend)
+    return backend(pretty_print)
+
+
+class PlainJSON(JSON):
+    """JSON renderer converts rendered value into plain data with adapters
+    once before serializing, so that serializers without the `default`
+    callback (like ujson) can be used, and the serializer doesn't need to
+    call back into Python for every table entity
+
+    """
+
+    PLAIN_TYPES = (basestring, bool, int, long, float, types.NoneType)
+
+    def __call__(self, info):
+        def _render(value, system):
+            request = system.get('request')
+            if request is not None:
+                response = request.response
+                ct = response.content_type
+                if ct == response.default_content_type:
+                    response.content_type = 'application/json'
+            return self.serializer(self.to_plain(value, request))
+        return _render
+
+    def to_plain(self, value, request):
+        """Convert given value into plain data
+
+        """
+        if isinstance(value, self.PLAIN_TYPES):
+            return value
+        if isinstance(value, dict):
+            return dict(
+                (key, self.to_plain(item, request))
+                for key, item in value.iteritems()
+            )
+        if isinstance(value, (list, tuple)):
+            return [self.to_plain(item, request) for item in value]
+        if hasattr(value, '__json__'):
+            return self.to_plain(value.__json__(request), request)
+        adapter = self.components.adapters.lookup(
+            (providedBy(value), ),
+            IJSONAdapter,
+            default=None,
+        )
+        if adapter is None:
+            raise TypeError('{!r} is not JSON serializable'.format(value))
+        return self.to_plain(adapter(value, request), request)
+
+
+def includeme(config):
+    settings = config.registry.settings
+    json_renderer = PlainJSON(serializer=get_serializer(settings))
     json_renderer.add_adapter(tables.Company, company_adapter)
     json_renderer.add_adapter(tables.Customer, customer_adapter)
     json_renderer.add_adapter(tables.Invoice, invoice_adapter)
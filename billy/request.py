@@ -13,12 +13,22 @@ from billy.api.utils import get_processor_factory
 
 class APIRequest(Request):
    
+    #: methods of requests which only read from database
+    READ_ONLY_METHODS = ('GET', 'HEAD')
+
     @reify
     def session(self):
-        """Session object for database operations
+        """Session object for database operations, read-only requests use
+        the session of read replica if there is one
        
         """
         settings = self.registry.settings
+        replica_session = settings.get('replica_session')
+        if (
+            replica_session is not None and
+            self.method in self.READ_ONLY_METHODS
+        ):
+            return replica_session
         return settings['session']
 
     @reify
@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+import os
+import sys
+import time
+import socket
+import logging
+
+import transaction as db_transaction
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from billy.models import setup_database
+from billy.models.model_factory import ModelFactory
+from billy.api.utils import get_processor_factory
+from billy.errors import BillyError
+from billy.errors import ProcessorUnavailableError
+
+
+#: the default number of callbacks to claim at a time
+DEFAULT_BATCH_SIZE = 100
+#: the default seconds to wait before polling again when the inbox is empty
+DEFAULT_POLL_INTERVAL = 1
+#: the default seconds before a claimed but unfinished callback can be
+#  claimed by other workers
+DEFAULT_LEASE_SECONDS = 300
+#: the default number of failed attempts before a callback is given up
+DEFAULT_MAXIMUM_ATTEMPTS = 5
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri>\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def process_callbacks(
+    factory,
+    worker_id,
+    batch_size,
+    lease_seconds,
+    maximum_attempts=DEFAULT_MAXIMUM_ATTEMPTS,
+    logger=None,
+):
+    """Claim a batch of callbacks in the inbox, verify and apply them, every
+    callback is processed and committed in its own database transaction,
+    return the number of claimed callbacks. A callback failed
+    `maximum_attempts` times is marked as processed with its error
+
+    """
+    logger = logger or logging.getLogger(__name__)
+    callback_model = factory.create_callback_model()
+    with db_transaction.manager:
+        guids = callback_model.claim(
+            worker_id,
+            limit=batch_size,
+            lease_seconds=lease_seconds,
+        )
+    for guid in guids:
+        try:
+            with db_transaction.manager:
+                callback_model.process(guid)
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except ProcessorUnavailableError:
+            # the processor is down, the callback will be claimed again
+            # after the lease expired
+            logger.warn('Processor unavailable, callback %s is postponed',
+                        guid)
+        except BillyError, e:
+            # the callback is invalid (forged or duplicate event for
+            # instance), there is no point to process it again
+            logger.warn('Invalid callback %s: %s', guid, e)
+            with db_transaction.manager:
+                callback_model.fail(guid, unicode(e))
+        except Exception, e:
+            logger.error('Failed to process callback %s', guid,
+                         exc_info=True)
+            with db_transaction.manager:
+                attempts = callback_model.fail_attempt(guid, unicode(e))
+                if attempts >= maximum_attempts:
+                    logger.error('Give up callback %s after %s failed '
+                                 'attempts', guid, attempts)
+                    callback_model.fail(guid, unicode(e))
+            # otherwise the callback is still in the inbox, it will be
+            # claimed again after the lease expired
+    return len(guids)
+
+
+def main(argv=sys.argv, processor=None, once=False):
+    logger = logging.getLogger(__name__)
+
+    if len(argv) != 2:
+        usage(argv)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    settings = setup_database({}, **settings)
+    batch_size = int(settings.get('billy.callback_worker.batch_size',
+                                  DEFAULT_BATCH_SIZE))
+    poll_interval = float(settings.get(
+        'billy.callback_worker.poll_interval',
+        DEFAULT_POLL_INTERVAL,
+    ))
+    lease_seconds = int(settings.get(
+        'billy.callback_worker.lease_seconds',
+        DEFAULT_LEASE_SECONDS,
+    ))
+    maximum_attempts = int(settings.get(
+        'billy.callback_worker.maximum_attempts',
+        DEFAULT_MAXIMUM_ATTEMPTS,
+    ))
+    worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    session = settings['session']
+    try:
+        if processor is None:
+            processor_factory = get_processor_factory(settings)
+        else:
+            processor_factory = lambda: processor
+        factory = ModelFactory(
+            session=session,
+            processor_factory=processor_factory,
+            settings=settings,
+        )
+        logger.info('Callback worker %s started', worker_id)
+        while True:
+            count = process_callbacks(
+                factory,
+                worker_id,
+                batch_size=batch_size,
+                lease_seconds=lease_seconds,
+                maximum_attempts=maximum_attempts,
+                logger=logger,
+            )
+            # there might be more callbacks waiting, don't sleep
+            if count >= batch_size:
+                continue
+            # the inbox is drained
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        logger.info('Callback worker %s stopped', worker_id)
+    finally:
+        session.close()
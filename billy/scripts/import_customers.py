@@ -0,0 +1,152 @@
+from __future__ import unicode_literals
+import os
+import sys
+import json
+import logging
+
+import transaction as db_transaction
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from billy.models import setup_database
+from billy.models.model_factory import ModelFactory
+from billy.models.customer import CustomerBulkCreateError
+from billy.api.utils import get_processor_factory
+from billy.api.customer.views import import_customers
+
+
+#: the default number of customers to import in a chunk
+DEFAULT_CHUNK_SIZE = 1000
+#: the default number of threads for calling the processor
+DEFAULT_CONCURRENCY = 8
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <company_guid> <records_path>\n'
+          '(example: "%s development.ini CPXXX customers.json")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def read_chunks(lines, chunk_size, invalid_lines):
+    """Read customer records from given lines, one JSON object per line, and
+    yield them in chunks of (line_number, record) tuples, empty lines are
+    ignored, and line numbers of invalid JSON lines are appended to
+    `invalid_lines`
+
+    """
+    chunk = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            invalid_lines.append(line_number)
+            continue
+        chunk.append((line_number, record))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_chunk(factory, company_guid, chunk, concurrency, logger):
+    """Import a chunk of customer records in one database transaction, if
+    there are invalid records, they will be reported and dropped, then the
+    rest of them will be imported again. The number of invalid records is
+    returned
+
+    """
+    company_model = factory.create_company_model()
+    error_count = 0
+    # we only retry once, invalid records should all be reported in the
+    # first attempt
+    for _ in range(2):
+        if not chunk:
+            break
+        try:
+            with db_transaction.manager:
+                import_customers(
+                    factory,
+                    company_model.get(company_guid),
+                    [record for _, record in chunk],
+                    concurrency=concurrency,
+                )
+            break
+        except CustomerBulkCreateError, e:
+            invalid_indexes = set()
+            for error in e.errors:
+                line_number, _ = chunk[error['index']]
+                logger.error('Invalid customer at line %s: %s',
+                             line_number, error['error_message'])
+                invalid_indexes.add(error['index'])
+            error_count += len(invalid_indexes)
+            chunk = [
+                item for index, item in enumerate(chunk)
+                if index not in invalid_indexes
+            ]
+    else:
+        logger.error('Failed to import chunk, %s customers are skipped',
+                     len(chunk))
+        error_count += len(chunk)
+    return error_count
+
+
+def main(argv=sys.argv, processor=None):
+    logger = logging.getLogger(__name__)
+
+    if len(argv) != 4:
+        usage(argv)
+    config_uri, company_guid, records_path = argv[1:]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    settings = setup_database({}, **settings)
+    # number of customers to import and commit in a chunk
+    chunk_size = int(settings.get('billy.import.chunk_size',
+                                  DEFAULT_CHUNK_SIZE))
+    # number of threads for calling the processor
+    concurrency = int(settings.get('billy.import.concurrency',
+                                   DEFAULT_CONCURRENCY))
+
+    session = settings['session']
+    try:
+        if processor is None:
+            processor_factory = get_processor_factory(settings)
+        else:
+            processor_factory = lambda: processor
+        factory = ModelFactory(
+            session=session,
+            processor_factory=processor_factory,
+            settings=settings,
+        )
+        company = factory.create_company_model().get(company_guid)
+        if company is None or company.deleted:
+            logger.error('No such company %s', company_guid)
+            sys.exit(1)
+
+        error_count = 0
+        invalid_lines = []
+        with open(records_path, 'rt') as f:
+            for chunk in read_chunks(f, chunk_size, invalid_lines):
+                logger.info('Importing chunk of %s customers ...', len(chunk))
+                error_count += import_chunk(
+                    factory,
+                    company_guid,
+                    chunk,
+                    concurrency=concurrency,
+                    logger=logger,
+                )
+        for line_number in invalid_lines:
+            logger.error('Invalid JSON at line %s', line_number)
+        error_count += len(invalid_lines)
+        if error_count:
+            logger.error('Done with %s invalid customers skipped', error_count)
+            sys.exit(1)
+        logger.info('Done')
+    finally:
+        session.close()
@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 import os
 import sys
 import logging
+import threading
+import Queue
 
 import transaction as db_transaction
 from pyramid.paster import (
@@ -14,6 +16,10 @@ from billy.models.model_factory import ModelFactory
 from billy.api.utils import get_processor_factory
 
 
+#: the default chunk size for yielding invoices and processing transactions
+DEFAULT_CHUNK_SIZE = 1000
+
+
 def usage(argv):
     cmd = os.path.basename(argv[0])
     print('usage: %s <config_uri>\n'
@@ -21,6 +27,150 @@ def usage(argv):
     sys.exit(1)
 
 
+def process_concurrently(
+    factory,
+    guids,
+    concurrency,
+    attempts=None,
+    logger=None,
+):
+    """Process transactions of given guids with a pool of worker threads,
+    every transaction is processed and committed in its own database
+    transaction, so that a slow call to the processor only blocks one worker
+
+    :param factory: the model factory, its session should be a
+        scoped_session, so that each worker gets its own session
+    :param guids: guids of transactions to process
+    :param concurrency: number of worker threads
+    :param attempts: a dict maps guids to number of their submission
+        attempts returned by `mark_submit_attempts`
+    """
+    attempts = attempts or {}
+    logger = logger or logging.getLogger(__name__)
+    guid_queue = Queue.Queue()
+    for guid in guids:
+        guid_queue.put(guid)
+    # fatal errors (SystemExit and KeyboardInterrupt) raised in workers
+    fatal_errors = []
+
+    def worker():
+        tx_model = factory.create_transaction_model()
+        try:
+            while not fatal_errors:
+                try:
+                    guid = guid_queue.get_nowait()
+                except Queue.Empty:
+                    break
+                try:
+                    with db_transaction.manager:
+                        tx_model.process_pending(
+                            guid,
+                            attempt=attempts.get(guid),
+                        )
+                except (SystemExit, KeyboardInterrupt), e:
+                    fatal_errors.append(e)
+                except Exception:
+                    logger.error('Failed to process transaction %s', guid,
+                                 exc_info=True)
+        finally:
+            factory.session.remove()
+
+    workers = [
+        threading.Thread(target=worker, name='TransactionWorker-{}'.format(i))
+        for i in range(concurrency)
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if fatal_errors:
+        raise fatal_errors[0]
+
+
+def read_checkpoint(checkpoint_path):
+    """Read the guid of last processed transaction from checkpoint file,
+    None is returned if there is no checkpoint
+
+    """
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'rt') as f:
+        guid = f.read().strip()
+    return guid.decode('utf8') or None
+
+
+def write_checkpoint(checkpoint_path, guid):
+    """Write the guid of last processed transaction to checkpoint file
+
+    """
+    if checkpoint_path is None:
+        return
+    # write to a temporary file and rename it, so that we won't leave a
+    # broken checkpoint file if we crash in the middle of writing
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'wt') as f:
+        f.write(guid.encode('utf8'))
+    os.rename(temp_path, checkpoint_path)
+
+
+def process_in_chunks(
+    factory,
+    chunk_size,
+    concurrency=0,
+    checkpoint_path=None,
+    logger=None,
+):
+    """Process pending transactions chunk by chunk, the work set of each
+    chunk is listed in created order right after the last chunk, so that
+    memory usage and lock lifetime stay bounded no matter how many
+    transactions are waiting
+
+    :param factory: the model factory
+    :param chunk_size: number of transactions to process in a chunk
+    :param concurrency: number of worker threads, transactions will be
+        committed one by one by workers if it is greater than zero,
+        otherwise, transactions of a chunk are committed together
+    :param checkpoint_path: path to the checkpoint file, the guid of last
+        processed transaction will be written to it after every chunk, and
+        processing will be resumed from it
+    """
+    logger = logger or logging.getLogger(__name__)
+    tx_model = factory.create_transaction_model()
+
+    after = read_checkpoint(checkpoint_path)
+    if after is not None:
+        logger.info('Resume processing after transaction %s', after)
+    while True:
+        with db_transaction.manager:
+            guids = tx_model.list_pending_guids(after=after, limit=chunk_size)
+            # commit the attempts before calling the processor
+            attempts = tx_model.mark_submit_attempts(guids)
+        if not guids:
+            break
+        logger.info('Processing chunk of %s transactions ...', len(guids))
+        if concurrency > 0:
+            process_concurrently(
+                factory,
+                guids,
+                concurrency,
+                attempts=attempts,
+                logger=logger,
+            )
+        else:
+            with db_transaction.manager:
+                tx_model.prefetch(tx_model.get_many(guids))
+                for guid in guids:
+                    tx_model.process_pending(
+                        guid,
+                        attempt=attempts.get(guid),
+                    )
+        after = guids[-1]
+        write_checkpoint(checkpoint_path, after)
+    # we are done, the next run should start from the very beginning
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
 def main(argv=sys.argv, processor=None):
     logger = logging.getLogger(__name__)
 
@@ -30,6 +180,17 @@ def main(argv=sys.argv, processor=None):
     setup_logging(config_uri)
     settings = get_appsettings(config_uri)
     settings = setup_database({}, **settings)
+    # number of worker threads for processing transactions, zero means
+    # process them in current thread
+    concurrency = int(settings.get('billy.transaction.concurrency', 0))
+    # number of transactions to process and commit in a chunk, zero means
+    # process all of them within one database transaction
+    chunk_size = int(settings.get('billy.transaction.chunk_size', 0))
+    if concurrency > 0 and chunk_size <= 0:
+        chunk_size = DEFAULT_CHUNK_SIZE
+    # file to record the last processed transaction, so that we can resume
+    # from it after a crash
+    checkpoint_path = settings.get('billy.transaction.checkpoint_path')
 
     session = settings['session']
     try:
@@ -49,11 +210,22 @@ def main(argv=sys.argv, processor=None):
         # we won't double process them.
         with db_transaction.manager:
             logger.info('Yielding transaction ...')
-            subscription_model.yield_invoices()
+            subscription_model.yield_invoices_in_chunks(DEFAULT_CHUNK_SIZE)
 
-        with db_transaction.manager:
-            logger.info('Processing transaction ...')
-            tx_model.process_transactions()
+        if chunk_size > 0:
+            logger.info('Processing transaction in chunks of %s '
+                        '(concurrency=%s) ...', chunk_size, concurrency)
+            process_in_chunks(
+                factory,
+                chunk_size=chunk_size,
+                concurrency=concurrency,
+                checkpoint_path=checkpoint_path,
+                logger=logger,
+            )
+        else:
+            with db_transaction.manager:
+                logger.info('Processing transaction ...')
+                tx_model.process_pending_in_chunks(DEFAULT_CHUNK_SIZE)
         logger.info('Done')
     finally:
         session.close()
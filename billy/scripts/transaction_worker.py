@@ -0,0 +1,137 @@
+from __future__ import unicode_literals
+import os
+import sys
+import time
+import socket
+import logging
+
+import transaction as db_transaction
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from billy.models import setup_database
+from billy.models.model_factory import ModelFactory
+from billy.api.utils import get_processor_factory
+
+
+#: the default number of jobs to claim at a time
+DEFAULT_BATCH_SIZE = 100
+#: the default seconds to wait before polling again when the queue is empty
+DEFAULT_POLL_INTERVAL = 1
+#: the default seconds before a claimed but unfinished job can be claimed
+#  by other workers
+DEFAULT_LEASE_SECONDS = 300
+#: the default number of failed attempts before a job is given up
+DEFAULT_MAXIMUM_ATTEMPTS = 5
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri>\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def process_jobs(
+    factory,
+    worker_id,
+    batch_size,
+    lease_seconds,
+    maximum_attempts=DEFAULT_MAXIMUM_ATTEMPTS,
+    logger=None,
+):
+    """Claim a batch of jobs in the queue and process them, every
+    transaction is processed and committed in its own database transaction,
+    return the number of claimed jobs. A job failed `maximum_attempts` times
+    stays in the queue with its error but won't be claimed again
+
+    """
+    logger = logger or logging.getLogger(__name__)
+    tx_model = factory.create_transaction_model()
+    with db_transaction.manager:
+        guids = tx_model.claim_jobs(
+            worker_id,
+            limit=batch_size,
+            lease_seconds=lease_seconds,
+            maximum_attempts=maximum_attempts,
+        )
+        # commit the attempts before calling the processor
+        attempts = tx_model.mark_submit_attempts(guids)
+    for guid in guids:
+        try:
+            with db_transaction.manager:
+                tx_model.process_job(guid, attempt=attempts.get(guid))
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except Exception, e:
+            logger.error('Failed to process transaction %s', guid,
+                         exc_info=True)
+            with db_transaction.manager:
+                failed_attempts = tx_model.fail_job(guid, unicode(e))
+            if failed_attempts >= maximum_attempts:
+                logger.error('Give up the job of transaction %s after %s '
+                             'failed attempts', guid, failed_attempts)
+            # otherwise the job is still there, it will be claimed again
+            # after the lease expired
+    return len(guids)
+
+
+def main(argv=sys.argv, processor=None, once=False):
+    logger = logging.getLogger(__name__)
+
+    if len(argv) != 2:
+        usage(argv)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    settings = setup_database({}, **settings)
+    batch_size = int(settings.get('billy.transaction_worker.batch_size',
+                                  DEFAULT_BATCH_SIZE))
+    poll_interval = float(settings.get(
+        'billy.transaction_worker.poll_interval',
+        DEFAULT_POLL_INTERVAL,
+    ))
+    lease_seconds = int(settings.get(
+        'billy.transaction_worker.lease_seconds',
+        DEFAULT_LEASE_SECONDS,
+    ))
+    maximum_attempts = int(settings.get(
+        'billy.transaction_worker.maximum_attempts',
+        DEFAULT_MAXIMUM_ATTEMPTS,
+    ))
+    worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    session = settings['session']
+    try:
+        if processor is None:
+            processor_factory = get_processor_factory(settings)
+        else:
+            processor_factory = lambda: processor
+        factory = ModelFactory(
+            session=session,
+            processor_factory=processor_factory,
+            settings=settings,
+        )
+        logger.info('Transaction worker %s started', worker_id)
+        while True:
+            count = process_jobs(
+                factory,
+                worker_id,
+                batch_size=batch_size,
+                lease_seconds=lease_seconds,
+                maximum_attempts=maximum_attempts,
+                logger=logger,
+            )
+            # there might be more jobs waiting, don't sleep
+            if count >= batch_size:
+                continue
+            # the queue is drained
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        logger.info('Transaction worker %s stopped', worker_id)
+    finally:
+        session.close()
@@ -7,8 +7,13 @@ import shutil
 
 from alembic import command
 from alembic.config import Config
+from sqlalchemy import create_engine
+from sqlalchemy import MetaData
+from sqlalchemy import Table
 
+from billy.db import tables
 from billy.scripts import initializedb
+from billy.utils.generic import utc_now
 
 
 class TestAlembic(unittest.TestCase):
@@ -71,3 +76,133 @@ class TestAlembic(unittest.TestCase):
         command.stamp(self.alembic_cfg, 'head')
         command.downgrade(self.alembic_cfg, 'base')
         command.upgrade(self.alembic_cfg, 'head')
+
+    def create_tables(self, excluded_columns):
+        """Create tables of current schema without given columns (a list of
+        (table name, column name) pairs) as the schema before they were
+        added, and return the metadata
+
+        """
+        engine = create_engine(self.db_url)
+        metadata = MetaData(bind=engine)
+        for table in tables.DeclarativeBase.metadata.sorted_tables:
+            Table(table.name, metadata, *[
+                column.copy() for column in table.columns
+                if (table.name, column.name) not in excluded_columns
+            ])
+        metadata.create_all()
+        return metadata
+
+    def insert_company(self, metadata):
+        """Insert a company with guid CP_MOCK, a customer with guid CU_MOCK
+        and a plan with guid PL_MOCK of it
+
+        """
+        now = utc_now()
+        table = metadata.tables
+        table['company'].insert().execute(
+            guid='CP_MOCK',
+            api_key='MOCK_API_KEY',
+            processor_key='MOCK_PROCESSOR_KEY',
+            callback_key='MOCK_CALLBACK_KEY',
+            created_at=now,
+            updated_at=now,
+        )
+        table['customer'].insert().execute(
+            guid='CU_MOCK',
+            company_guid='CP_MOCK',
+            created_at=now,
+            updated_at=now,
+        )
+        table['plan'].insert().execute(
+            guid='PL_MOCK',
+            company_guid='CP_MOCK',
+            plan_type=tables.PlanType.DEBIT,
+            frequency=tables.PlanFrequency.DAILY,
+            amount=1000,
+            created_at=now,
+            updated_at=now,
+        )
+
+    def test_backfill_subscription_period(self):
+        metadata = self.create_tables([('subscription', 'period')])
+        self.insert_company(metadata)
+        now = utc_now()
+        table = metadata.tables
+        for subscription_guid, count in [('SU_A', 3), ('SU_B', 0)]:
+            table['subscription'].insert().execute(
+                guid=subscription_guid,
+                customer_guid='CU_MOCK',
+                plan_guid='PL_MOCK',
+                started_at=now,
+                next_invoice_at=now,
+                created_at=now,
+                updated_at=now,
+            )
+            for i in range(count):
+                invoice_guid = 'IV_{}_{}'.format(subscription_guid, i)
+                table['invoice'].insert().execute(
+                    guid=invoice_guid,
+                    company_guid='CP_MOCK',
+                    invoice_type=tables.InvoiceType.SUBSCRIPTION,
+                    transaction_type=tables.InvoiceTransactionType.DEBIT,
+                    status=tables.InvoiceStatus.STAGED,
+                    amount=1000,
+                    effective_amount=1000,
+                    created_at=now,
+                    updated_at=now,
+                )
+                table['subscription_invoice'].insert().execute(
+                    guid=invoice_guid,
+                    subscription_guid=subscription_guid,
+                    scheduled_at=now,
+                )
+        command.stamp(self.alembic_cfg, '3c76fb0d6937')
+        command.upgrade(self.alembic_cfg, '1a2b9f3c4d5e')
+
+        periods = metadata.bind.execute(
+            'SELECT guid, period FROM subscription ORDER BY guid'
+        ).fetchall()
+        self.assertEqual(
+            [tuple(row) for row in periods],
+            [('SU_A', 3), ('SU_B', 0)],
+        )
+
+    def test_backfill_invoice_amount_totals(self):
+        metadata = self.create_tables([
+            ('invoice', 'total_adjustment_amount'),
+            ('invoice', 'effective_amount'),
+        ])
+        self.insert_company(metadata)
+        now = utc_now()
+        table = metadata.tables
+        for invoice_guid, adjustment_amounts in [
+            ('IV_A', [-100, 20]),
+            ('IV_B', []),
+        ]:
+            table['invoice'].insert().execute(
+                guid=invoice_guid,
+                company_guid='CP_MOCK',
+                invoice_type=tables.InvoiceType.CUSTOMER,
+                transaction_type=tables.InvoiceTransactionType.DEBIT,
+                status=tables.InvoiceStatus.STAGED,
+                amount=1000,
+                created_at=now,
+                updated_at=now,
+            )
+            for amount in adjustment_amounts:
+                table['adjustment'].insert().execute(
+                    invoice_guid=invoice_guid,
+                    amount=amount,
+                )
+        command.stamp(self.alembic_cfg, '1a2b9f3c4d5e')
+        command.upgrade(self.alembic_cfg, '4f5a0c6e7b81')
+
+        totals = metadata.bind.execute(
+            'SELECT guid, total_adjustment_amount, effective_amount '
+            'FROM invoice ORDER BY guid'
+        ).fetchall()
+        self.assertEqual(
+            [tuple(row) for row in totals],
+            [('IV_A', -80, 920), ('IV_B', 0, 1000)],
+        )
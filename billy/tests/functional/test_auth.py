@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 import base64
 
+import transaction as db_transaction
+from sqlalchemy import event
 from webtest.app import TestRequest
 
 from billy.api.auth import get_remote_user
@@ -73,3 +75,111 @@ class TestAuth(ViewTestCase):
 
         self.assertEqual(response, 'RESPONSE')
         self.assertEqual(called, [True])
+
+    def test_company_lookup_is_cached(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            customer = self.customer_model.create(company=company)
+        api_key = str(company.api_key)
+        company_guid = company.guid
+        url = '/v1/customers/{}'.format(customer.guid)
+        # start with a clean session, like a new request
+        self.testapp.session.close()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'FROM company' in statement:
+                statements.append(statement)
+
+        engine = self.settings['engine']
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for _ in range(3):
+                self.testapp.get(
+                    url,
+                    extra_environ=dict(REMOTE_USER=api_key),
+                    status=200,
+                )
+        finally:
+            event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute,
+            )
+        # only the first request queries the company
+        self.assertEqual(len(statements), 1)
+
+        # the cache should be invalidated once API key is changed
+        with db_transaction.manager:
+            company = self.company_model.get(company_guid)
+            self.company_model.update(company, api_key='NEW_API_KEY')
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=api_key),
+            status=403,
+        )
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=b'NEW_API_KEY'),
+            status=200,
+        )
+
+        # and also when it's deleted
+        with db_transaction.manager:
+            company = self.company_model.get(company_guid)
+            self.company_model.delete(company)
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=b'NEW_API_KEY'),
+            status=403,
+        )
+
+    def test_company_lookup_cache_is_invalidated_after_commit(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+        api_key = company.api_key
+        company_guid = company.guid
+        cache = self.company_model.api_key_cache
+        self.assertEqual(
+            self.company_model.get_guid_by_api_key(api_key),
+            company_guid,
+        )
+
+        with db_transaction.manager:
+            company = self.company_model.get(company_guid)
+            self.company_model.delete(company)
+            # other requests should not cache the company again before
+            # the deletion is committed
+            self.assertEqual(cache.get(api_key), company_guid)
+        self.assertEqual(cache.get(api_key), None)
+
+    def test_deleted_company_with_cached_api_key(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+        api_key = str(company.api_key)
+        company_guid = company.guid
+        self.testapp.get(
+            '/v1/customers',
+            extra_environ=dict(REMOTE_USER=api_key),
+            status=200,
+        )
+        # deleted by another process, the cache of this process is not
+        # invalidated
+        with db_transaction.manager:
+            self.testapp.session.query(self.company_model.TABLE).filter_by(
+                guid=company_guid,
+            ).update(dict(deleted=True))
+        self.assertEqual(
+            self.company_model.api_key_cache.get(api_key),
+            company_guid,
+        )
+        self.testapp.post(
+            '/v1/customers',
+            extra_environ=dict(REMOTE_USER=api_key),
+            status=403,
+        )
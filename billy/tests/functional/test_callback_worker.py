@@ -0,0 +1,201 @@
+from __future__ import unicode_literals
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import textwrap
+import StringIO
+
+import mock
+import transaction as db_transaction
+from freezegun import freeze_time
+from pyramid.paster import get_appsettings
+
+from billy.db import tables
+from billy.models import setup_database
+from billy.models.model_factory import ModelFactory
+from billy.models.transaction import DuplicateEventError
+from billy.scripts import initializedb
+from billy.scripts import callback_worker
+from billy.scripts.callback_worker import main
+from billy.tests.fixtures.processor import DummyProcessor
+from billy.utils.generic import utc_now
+
+
+class TestCallbackWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_usage(self):
+        filename = '/path/to/callback_worker'
+
+        old_stdout = sys.stdout
+        usage_out = StringIO.StringIO()
+        sys.stdout = usage_out
+        try:
+            with self.assertRaises(SystemExit):
+                main([filename])
+        finally:
+            sys.stdout = old_stdout
+        expected = textwrap.dedent("""\
+        usage: callback_worker <config_uri>
+        (example: "callback_worker development.ini")
+        """)
+        self.assertMultiLineEqual(usage_out.getvalue(), expected)
+
+    def test_main(self):
+        dummy_processor = DummyProcessor()
+        dummy_processor.callback = mock.Mock()
+        applied = []
+
+        def mock_callback(company, payload):
+            if payload['id'] == 'EV_DUPLICATE':
+                raise DuplicateEventError('Duplicate!')
+            if payload['id'] == 'EV_BOOM':
+                raise RuntimeError('Boom!')
+
+            def update_db(model_factory):
+                applied.append(payload['id'])
+            return update_db
+
+        dummy_processor.callback.side_effect = mock_callback
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.callback_worker.batch_size = 2
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        callback_model = factory.create_callback_model()
+
+        event_ids = ['EV_1', 'EV_DUPLICATE', 'EV_BOOM', 'EV_2']
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            guids = [
+                callback_model.create(company, dict(id=event_id)).guid
+                for event_id in event_ids
+            ]
+
+        main([callback_worker.__file__, cfg_path],
+             processor=dummy_processor, once=True)
+
+        self.assertEqual(dummy_processor.callback.call_count, 4)
+        self.assertEqual(applied, ['EV_1', 'EV_2'])
+        callbacks = [callback_model.get(guid) for guid in guids]
+        self.assertEqual(
+            [callback.processed_at is not None for callback in callbacks],
+            [True, True, False, True],
+        )
+        self.assertEqual(
+            [callback.error_message for callback in callbacks],
+            [None, 'Duplicate!', 'Boom!', None],
+        )
+        self.assertEqual(
+            [callback.attempts for callback in callbacks],
+            [0, 0, 1, 0],
+        )
+        # the failed one is claimed, it will be processed again after the
+        # lease expired
+        self.assertNotEqual(callbacks[2].locked_at, None)
+        session.close()
+
+    def test_give_up_failing_callbacks(self):
+        dummy_processor = DummyProcessor()
+        dummy_processor.callback = mock.Mock()
+        calls = []
+        applied = []
+
+        def mock_callback(company, payload):
+            calls.append(payload['id'])
+            if payload['id'] == 'EV_BOOM' or calls.count('EV_FLAKY') == 1:
+                raise RuntimeError('Boom!')
+
+            def update_db(model_factory):
+                applied.append(payload['id'])
+            return update_db
+
+        dummy_processor.callback.side_effect = mock_callback
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        callback_model = factory.create_callback_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            guids = [
+                callback_model.create(company, dict(id=event_id)).guid
+                for event_id in ['EV_FLAKY', 'EV_BOOM']
+            ]
+
+        def process(minute):
+            with freeze_time('2013-08-16 00:{:02}:00'.format(minute)):
+                return callback_worker.process_callbacks(
+                    factory,
+                    'MOCK_WORKER',
+                    batch_size=10,
+                    lease_seconds=30,
+                    maximum_attempts=2,
+                )
+
+        # use a now function which can be frozen
+        old_now_func = tables.set_now_func(utc_now)
+        self.addCleanup(tables.set_now_func, old_now_func)
+
+        self.assertEqual(process(0), 2)
+        # still leased
+        self.assertEqual(process(0), 0)
+        flaky, boom = [callback_model.get(guid) for guid in guids]
+        self.assertEqual(flaky.attempts, 1)
+        self.assertEqual(flaky.error_message, 'Boom!')
+        self.assertEqual(flaky.processed_at, None)
+        # claimed again after the lease expired
+        self.assertEqual(process(1), 2)
+        # failed too many times, the callback is given up
+        self.assertEqual(process(2), 0)
+        self.assertEqual(calls, ['EV_FLAKY', 'EV_BOOM'] * 2)
+        self.assertEqual(applied, ['EV_FLAKY'])
+
+        flaky, boom = [callback_model.get(guid) for guid in guids]
+        self.assertNotEqual(flaky.processed_at, None)
+        self.assertEqual(flaky.attempts, 1)
+        self.assertEqual(flaky.error_message, None)
+        self.assertNotEqual(boom.processed_at, None)
+        self.assertEqual(boom.attempts, 2)
+        self.assertEqual(boom.error_message, 'Boom!')
+        session.close()
@@ -72,6 +72,46 @@ class TestCompanyViews(ViewTestCase):
     def test_callback_with_slash_ending(self, callback_method):
         self.test_callback(slash=True)
 
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.callback')
+    def test_callback_with_inbox(self, callback_method):
+        settings = self.testapp.app.registry.settings
+        settings['billy.callback.async'] = 'true'
+        res = self.testapp.post(
+            '/v1/companies',
+            dict(processor_key='MOCK_PROCESSOR_KEY'),
+        )
+        guid = res.json['guid']
+        company = self.company_model.get(guid)
+        url = '/v1/companies/{}/callbacks/{}/'.format(
+            guid, company.callback_key,
+        )
+
+        def post(payload, status=200):
+            return self.testapp.post(
+                url,
+                json.dumps(payload),
+                headers=[(b'content-type', b'application/json')],
+                status=status,
+            )
+
+        payload = dict(id='EV_MOCK_EVENT_ID', type='debit.updated')
+        res = post(payload)
+        self.assertEqual(res.json['code'], 'queued')
+        # the same event is dropped
+        res = post(payload)
+        self.assertEqual(res.json['code'], 'duplicate')
+        post(dict(type='debit.updated'), status=400)
+        # nothing is verified in the request
+        self.assertFalse(callback_method.called)
+
+        callback_model = self.model_factory.create_callback_model()
+        callbacks = self.testapp.session.query(callback_model.TABLE).all()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(callbacks[0].company, company)
+        self.assertEqual(callbacks[0].processor_id, 'EV_MOCK_EVENT_ID')
+        self.assertEqual(json.loads(callbacks[0].payload), payload)
+        self.assertEqual(callbacks[0].processed_at, None)
+
     def test_create_company_with_bad_parameters(self):
         self.testapp.post(
             '/v1/companies',
@@ -6,6 +6,7 @@ from freezegun import freeze_time
 
 from billy.tests.functional.helper import ViewTestCase
 from billy.errors import BillyError
+from billy.errors import ProcessorUnavailableError
 from billy.utils.generic import utc_now
 
 
@@ -88,6 +89,23 @@ class TestCustomerViews(ViewTestCase):
         self.assertEqual(res.json['error_class'], 'BillyError')
         self.assertEqual(res.json['error_message'], 'Boom!')
 
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.validate_customer')
+    def test_create_customer_with_processor_unavailable(
+        self,
+        validate_customer_method,
+    ):
+        validate_customer_method.side_effect = ProcessorUnavailableError(
+            'Boom!'
+        )
+        res = self.testapp.post(
+            '/v1/customers',
+            dict(processor_uri='MOCK_CUSTOMER_URI'),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=503,
+        )
+        self.assertEqual(res.json['error_class'], 'ProcessorUnavailableError')
+        self.assertEqual(res.json['error_message'], 'Boom!')
+
     def test_create_customer_with_bad_api_key(self):
         self.testapp.post(
             '/v1/customers',
@@ -446,3 +464,127 @@ class TestCustomerViews(ViewTestCase):
             extra_environ=dict(REMOTE_USER=self.api_key),
             status=403,
         )
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.validate_customer')
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.create_customer')
+    def test_import_customers(
+        self,
+        create_customer_method,
+        validate_customer_method,
+    ):
+        create_customer_method.return_value = 'MOCK_CREATED_URI'
+        with db_transaction.manager:
+            plan = self.plan_model.create(
+                company=self.company,
+                frequency=self.plan_model.frequencies.WEEKLY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+            )
+        data = [
+            dict(processor_uri='MOCK_CUSTOMER_URI'),
+            dict(subscriptions=[
+                dict(plan_guid=plan.guid),
+                dict(
+                    plan_guid=plan.guid,
+                    amount=500,
+                    funding_instrument_uri='/v1/cards/tester',
+                ),
+            ]),
+        ]
+        res = self.testapp.post_json(
+            '/v1/customers/import',
+            data,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        items = res.json['items']
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0]['customer']['processor_uri'],
+                         'MOCK_CUSTOMER_URI')
+        self.assertEqual(items[0]['subscriptions'], [])
+        self.assertEqual(items[1]['customer']['processor_uri'],
+                         'MOCK_CREATED_URI')
+        self.assertEqual(items[1]['customer']['company_guid'],
+                         self.company.guid)
+        subscriptions = items[1]['subscriptions']
+        self.assertEqual(len(subscriptions), 2)
+        self.assertEqual(subscriptions[0]['plan_guid'], plan.guid)
+        self.assertEqual(subscriptions[0]['customer_guid'],
+                         items[1]['customer']['guid'])
+        self.assertEqual(subscriptions[1]['amount'], 500)
+        self.assertEqual(subscriptions[1]['funding_instrument_uri'],
+                         '/v1/cards/tester')
+        # invoices are deferred to the transaction processing script
+        self.assertEqual(subscriptions[0]['invoice_count'], 0)
+        validate_customer_method.assert_called_once_with('MOCK_CUSTOMER_URI')
+        self.assertEqual(create_customer_method.call_count, 1)
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.validate_customer')
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.create_customer')
+    def test_import_customers_with_errors(
+        self,
+        create_customer_method,
+        validate_customer_method,
+    ):
+        def validate_customer(processor_uri):
+            if processor_uri == 'BAD_PROCESSOR':
+                raise BillyError('Boom!')
+            return True
+
+        validate_customer_method.side_effect = validate_customer
+        with db_transaction.manager:
+            plan = self.plan_model.create(
+                company=self.company,
+                frequency=self.plan_model.frequencies.WEEKLY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+            )
+            other_plan = self.plan_model.create(
+                company=self.company2,
+                frequency=self.plan_model.frequencies.WEEKLY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+            )
+        data = [
+            # valid one
+            dict(subscriptions=[dict(plan_guid=plan.guid)]),
+            dict(processor_uri='BAD_PROCESSOR'),
+            dict(subscriptions=[dict(plan_guid='NON_EXIST')]),
+            dict(subscriptions=[dict(plan_guid=other_plan.guid)]),
+            dict(subscriptions=[dict(plan_guid=plan.guid, amount=-1)]),
+            'not a customer',
+        ]
+        res = self.testapp.post_json(
+            '/v1/customers/import',
+            data,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+        self.assertEqual(res.json['error_class'], 'CustomerBulkCreateError')
+        self.assertEqual(
+            [error['index'] for error in res.json['errors']],
+            [1, 2, 3, 4, 5],
+        )
+        self.assertEqual(res.json['errors'][0]['error_message'], 'Boom!')
+        self.assertEqual(
+            res.json['errors'][1]['error_message'],
+            'subscriptions[0]: No such plan NON_EXIST',
+        )
+        # nothing should be created, even in processor
+        self.assertFalse(create_customer_method.called)
+        self.assertEqual(self.customer_model.list_by_context(
+            self.company,
+        ).count(), 0)
+
+        self.testapp.post_json(
+            '/v1/customers/import',
+            [],
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+        self.testapp.post_json(
+            '/v1/customers/import',
+            data[:1],
+            extra_environ=dict(REMOTE_USER=b'BAD_API_KEY'),
+            status=403,
+        )
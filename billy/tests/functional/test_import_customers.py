@@ -0,0 +1,130 @@
+from __future__ import unicode_literals
+import os
+import sys
+import json
+import unittest
+import tempfile
+import shutil
+import textwrap
+import StringIO
+
+import transaction as db_transaction
+from pyramid.paster import get_appsettings
+
+from billy.models import setup_database
+from billy.models.model_factory import ModelFactory
+from billy.scripts import initializedb
+from billy.scripts import import_customers
+from billy.scripts import process_transactions
+from billy.scripts.import_customers import main
+from billy.tests.fixtures.processor import DummyProcessor
+
+
+class TestImportCustomers(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_usage(self):
+        filename = '/path/to/import_customers'
+
+        old_stdout = sys.stdout
+        usage_out = StringIO.StringIO()
+        sys.stdout = usage_out
+        try:
+            with self.assertRaises(SystemExit):
+                main([filename])
+        finally:
+            sys.stdout = old_stdout
+        expected = textwrap.dedent("""\
+        usage: import_customers <config_uri> <company_guid> <records_path>
+        (example: "import_customers development.ini CPXXX customers.json")
+        """)
+        self.assertMultiLineEqual(usage_out.getvalue(), expected)
+
+    def test_main(self):
+        dummy_processor = DummyProcessor()
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.import.chunk_size = 2
+            billy.import.concurrency = 2
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        plan_model = factory.create_plan_model()
+        subscription_model = factory.create_subscription_model()
+        invoice_model = factory.create_invoice_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            plan = plan_model.create(
+                company=company,
+                plan_type=plan_model.types.DEBIT,
+                amount=10,
+                frequency=plan_model.frequencies.MONTHLY,
+            )
+            company_guid = company.guid
+            plan_guid = plan.guid
+
+        records_path = os.path.join(self.temp_dir, 'customers.json')
+        with open(records_path, 'wt') as f:
+            records = [
+                dict(processor_uri='/v1/customers/foo'),
+                dict(subscriptions=[dict(plan_guid=plan_guid)]),
+                # invalid ones
+                dict(subscriptions=[dict(plan_guid='NON_EXIST')]),
+                dict(processor_uri=1234),
+                dict(subscriptions=[
+                    dict(
+                        plan_guid=plan_guid,
+                        funding_instrument_uri='/v1/cards/tester',
+                    ),
+                ]),
+            ]
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.write('\n{bad json\n')
+
+        with self.assertRaises(SystemExit):
+            main([import_customers.__file__, cfg_path, company_guid,
+                  records_path], processor=dummy_processor)
+
+        company = company_model.get(company_guid)
+        customers = customer_model.list_by_context(company).all()
+        self.assertEqual(len(customers), 3)
+        self.assertEqual(
+            set(customer.processor_uri for customer in customers),
+            set(['/v1/customers/foo', 'MOCK_CUSTOMER_URI']),
+        )
+        subscriptions = subscription_model.list_by_context(company).all()
+        self.assertEqual(len(subscriptions), 2)
+        self.assertEqual(
+            sorted(subscription.funding_instrument_uri
+                   for subscription in subscriptions),
+            [None, '/v1/cards/tester'],
+        )
+        # invoices are yielded by the transaction processing script
+        self.assertEqual(invoice_model.list_by_context(company).count(), 0)
+        process_transactions.main([process_transactions.__file__, cfg_path],
+                                  processor=dummy_processor)
+        self.assertEqual(invoice_model.list_by_context(company).count(), 2)
+        session.close()
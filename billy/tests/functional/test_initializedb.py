@@ -81,17 +81,20 @@ class TestInitializedb(unittest.TestCase):
         tables = [row[0] for row in cursor.fetchall()]
         self.assertEqual(set(tables), set([
             'company',
+            'callback',
             'customer',
             'plan',
             'subscription',
             'transaction',
             'transaction_event',
             'transaction_failure',
+            'transaction_job',
             'customer_invoice',
             'subscription_invoice',
             'invoice',
             'item',
             'adjustment',
+            'attached_funding_instrument',
             'alembic_version',
         ]))
 
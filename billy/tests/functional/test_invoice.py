@@ -1,4 +1,7 @@
 from __future__ import unicode_literals
+import csv
+import json
+import StringIO
 
 import mock
 import transaction as db_transaction
@@ -6,6 +9,7 @@ from freezegun import freeze_time
 
 from billy.tests.functional.helper import ViewTestCase
 from billy.errors import BillyError
+from billy.models.invoice import InvalidOperationError
 from billy.utils.generic import utc_now
 
 
@@ -149,6 +153,159 @@ class TestInvoiceViews(ViewTestCase):
             status=409,
         )
 
+    def test_create_invoices_in_bulk(self):
+        with db_transaction.manager:
+            self.invoice_model.create(
+                customer=self.customer,
+                amount=100,
+                external_id='existing',
+            )
+        data = [
+            dict(
+                customer_guid=self.customer.guid,
+                amount=1000,
+                title='first',
+                external_id='first',
+                items=[
+                    dict(name='foo', amount=600),
+                    dict(name='bar', amount=400, unit='hours', quantity=2),
+                ],
+                adjustments=[dict(amount=-100, reason='coupon')],
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                amount=2000,
+                funding_instrument_uri='/v1/cards/tester',
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                amount=0,
+            ),
+        ]
+        res = self.testapp.post_json(
+            '/v1/invoices/bulk',
+            data,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        items = res.json['items']
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0]['title'], 'first')
+        self.assertEqual(items[0]['external_id'], 'first')
+        self.assertEqual(items[0]['effective_amount'], 900)
+        self.assertEqual(items[0]['total_adjustment_amount'], -100)
+        self.assertEqual(items[0]['status'], 'staged')
+        self.assertEqual(
+            [item['name'] for item in items[0]['items']],
+            ['foo', 'bar'],
+        )
+        self.assertEqual(items[0]['items'][1]['quantity'], 2)
+        self.assertEqual(items[0]['adjustments'][0]['reason'], 'coupon')
+        self.assertEqual(items[1]['status'], 'processing')
+        self.assertEqual(items[2]['status'], 'settled')
+
+        invoice = self.invoice_model.get(items[1]['guid'])
+        self.assertEqual(invoice.company_guid, self.company.guid)
+        self.assertEqual(len(invoice.transactions), 1)
+        transaction = invoice.transactions[0]
+        self.assertEqual(transaction.amount, 2000)
+        self.assertEqual(transaction.company_guid, self.company.guid)
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.STAGED)
+        self.assertEqual(transaction.funding_instrument_uri,
+                         '/v1/cards/tester')
+
+    def test_create_invoices_in_bulk_with_errors(self):
+        with db_transaction.manager:
+            self.invoice_model.create(
+                customer=self.customer,
+                amount=100,
+                external_id='existing',
+            )
+            deleted_customer = self.customer_model.create(
+                company=self.company,
+            )
+            self.customer_model.delete(deleted_customer)
+        data = [
+            # valid one
+            dict(customer_guid=self.customer.guid, amount=1000),
+            dict(customer_guid=self.customer.guid, amount=-1),
+            dict(customer_guid='NON_EXIST', amount=1000),
+            dict(customer_guid=self.customer2.guid, amount=1000),
+            dict(customer_guid=deleted_customer.guid, amount=1000),
+            dict(
+                customer_guid=self.customer.guid,
+                amount=1000,
+                items=[dict(name='foo')],
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                amount=1000,
+                external_id='existing',
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                amount=1000,
+                external_id='dup',
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                amount=1000,
+                external_id='dup',
+            ),
+        ]
+        res = self.testapp.post_json(
+            '/v1/invoices/bulk',
+            data[:6],
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+        self.assertEqual(res.json['error_class'], 'InvoiceBulkCreateError')
+        self.assertEqual(
+            [error['index'] for error in res.json['errors']],
+            [1, 2, 3, 4, 5],
+        )
+        # duplicate external_ids are found by model
+        res = self.testapp.post_json(
+            '/v1/invoices/bulk',
+            [data[0]] + data[6:],
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+        self.assertEqual(
+            [error['index'] for error in res.json['errors']],
+            [1, 3],
+        )
+        # nothing should be created
+        invoices = self.invoice_model.list_by_context(self.company)
+        self.assertEqual(invoices.count(), 1)
+
+    def test_create_invoices_in_bulk_with_bad_body(self):
+        for body in ['', 'not json', '{}', '[]']:
+            self.testapp.post(
+                '/v1/invoices/bulk',
+                body,
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                content_type=b'application/json',
+                status=400,
+            )
+        settings = self.testapp.app.registry.settings
+        settings['api.invoice.bulk_max_size'] = 1
+        self.testapp.post_json(
+            '/v1/invoices/bulk',
+            [dict(customer_guid=self.customer.guid, amount=1000)] * 2,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+
+    def test_create_invoices_in_bulk_with_bad_api_key(self):
+        self.testapp.post_json(
+            '/v1/invoices/bulk',
+            [dict(customer_guid=self.customer.guid, amount=1000)],
+            extra_environ=dict(REMOTE_USER=b'BAD_API_KEY'),
+            status=403,
+        )
+
     def test_create_invoice_with_items(self):
         items = [
             dict(name='foo', amount=1234),
@@ -209,6 +366,96 @@ class TestInvoiceViews(ViewTestCase):
                     del adjustment[key]
         self.assertEqual(adjustment_result, adjustments)
 
+    def test_invoice_amount_totals(self):
+        with db_transaction.manager:
+            invoice = self.invoice_model.create(
+                customer=self.customer,
+                amount=1000,
+            )
+            adjusted_invoice = self.invoice_model.create(
+                customer=self.customer,
+                amount=1000,
+                adjustments=[
+                    dict(amount=-100, reason='discount'),
+                    dict(amount=20),
+                ],
+            )
+        guid = invoice.guid
+        adjusted_guid = adjusted_invoice.guid
+
+        def assert_totals(guid, total_adjustment_amount, effective_amount):
+            invoice = self.invoice_model.get(guid)
+            self.assertEqual(invoice.total_adjustment_amount,
+                             total_adjustment_amount)
+            self.assertEqual(invoice.effective_amount, effective_amount)
+
+        assert_totals(guid, 0, 1000)
+        assert_totals(adjusted_guid, -80, 920)
+
+        # the effective amount is charged once the funding instrument is set
+        with db_transaction.manager:
+            invoice = self.invoice_model.get(adjusted_guid)
+            transaction, = self.invoice_model.update_funding_instrument_uri(
+                invoice,
+                '/v1/cards/tester',
+            )
+            self.assertEqual(transaction.amount, 920)
+            self.transaction_model.process_one(transaction)
+        invoice = self.invoice_model.get(adjusted_guid)
+        self.assertEqual(invoice.status, self.invoice_model.statuses.SETTLED)
+        assert_totals(adjusted_guid, -80, 920)
+
+        # and it's the limit of refunds
+        with db_transaction.manager:
+            invoice = self.invoice_model.get(adjusted_guid)
+            with self.assertRaises(InvalidOperationError):
+                self.invoice_model.refund(invoice, 921)
+            transaction, = self.invoice_model.refund(invoice, 920)
+            self.assertEqual(transaction.amount, 920)
+        assert_totals(adjusted_guid, -80, 920)
+
+    def test_build_invoice(self):
+        with db_transaction.manager:
+            records = self.invoice_model.build(
+                customer=self.customer,
+                amount=200,
+                funding_instrument_uri='/v1/cards/tester',
+                items=[dict(name='foo', amount=150)],
+                adjustments=[dict(amount=-50, reason='discount')],
+                appears_on_statement_as='hello baby',
+            )
+            invoice, item, adjustment, transaction = records
+            self.assertEqual(invoice.status,
+                             self.invoice_model.statuses.PROCESSING)
+            self.assertEqual(invoice.total_adjustment_amount, -50)
+            self.assertEqual(invoice.effective_amount, 150)
+            self.assertEqual(item.invoice, invoice)
+            self.assertEqual(adjustment.invoice, invoice)
+            self.assertEqual(transaction.invoice, invoice)
+            self.assertEqual(transaction.company_guid, self.company.guid)
+            self.assertEqual(transaction.amount, 150)
+            self.assertEqual(transaction.transaction_type,
+                             invoice.transaction_type)
+            self.assertEqual(transaction.funding_instrument_uri,
+                             '/v1/cards/tester')
+            self.assertEqual(transaction.appears_on_statement_as,
+                             'hello baby')
+            self.assertEqual(transaction.submit_status,
+                             self.transaction_model.submit_statuses.STAGED)
+
+            # nothing to charge
+            invoice, = self.invoice_model.build(
+                customer=self.customer,
+                amount=0,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            self.assertEqual(invoice.status,
+                             self.invoice_model.statuses.SETTLED)
+
+            with self.assertRaises(ValueError):
+                self.invoice_model.build(customer=self.customer, amount=-1)
+            db_transaction.abort()
+
     @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
     def test_create_invoice_with_funding_instrument_uri(self, debit_method):
         amount = 5566
@@ -258,6 +505,63 @@ class TestInvoiceViews(ViewTestCase):
                          self.transaction_model.statuses.SUCCEEDED)
         debit_method.assert_called_once_with(transaction)
 
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
+    def test_create_invoice_with_async_processing(self, debit_method):
+        settings = self.testapp.app.registry.settings
+        settings['billy.transaction.async'] = 'true'
+        debit_method.return_value = dict(
+            processor_uri='MOCK_DEBIT_URI',
+            status=self.transaction_model.statuses.SUCCEEDED,
+        )
+
+        res = self.testapp.post(
+            '/v1/invoices',
+            dict(
+                customer_guid=self.customer.guid,
+                amount=5566,
+                funding_instrument_uri='MOCK_CARD_URI',
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=202,
+        )
+        self.assertEqual(res.json['status'], 'processing')
+        self.assertFalse(debit_method.called)
+        invoice = self.invoice_model.get(res.json['guid'])
+        transaction = invoice.transactions[0]
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.STAGED)
+
+        # only one worker can claim the job before its lease expired
+        with db_transaction.manager:
+            guids = self.transaction_model.claim_jobs(
+                'worker1', limit=10, lease_seconds=60,
+            )
+        self.assertEqual(guids, [transaction.guid])
+        with db_transaction.manager:
+            guids = self.transaction_model.claim_jobs(
+                'worker2', limit=10, lease_seconds=60,
+            )
+        self.assertEqual(guids, [])
+        with freeze_time('2099-01-01'):
+            with db_transaction.manager:
+                guids = self.transaction_model.claim_jobs(
+                    'worker2', limit=10, lease_seconds=60,
+                )
+        self.assertEqual(guids, [transaction.guid])
+
+        with db_transaction.manager:
+            self.transaction_model.process_job(transaction.guid)
+        transaction = self.transaction_model.get(transaction.guid)
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.DONE)
+        debit_method.assert_called_once_with(transaction)
+        with freeze_time('2099-01-01'):
+            with db_transaction.manager:
+                guids = self.transaction_model.claim_jobs(
+                    'worker2', limit=10, lease_seconds=60,
+                )
+        self.assertEqual(guids, [])
+
     @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
     def test_create_invoice_with_funding_instrument_uri_with_zero_amount(self, debit_method):
         amount = 0
@@ -454,6 +758,46 @@ class TestInvoiceViews(ViewTestCase):
         result_guids = [item['guid'] for item in items]
         self.assertEqual(result_guids, guids)
 
+    def test_invoice_export(self):
+        # make some invoice for other company, to make sure they won't be
+        # included in the result
+        with db_transaction.manager:
+            self.invoice_model.create(
+                customer=self.customer2,
+                amount=9999,
+            )
+            guids = []
+            for i in range(4):
+                with freeze_time('2013-08-16 00:00:{:02}'.format(i + 1)):
+                    invoice = self.invoice_model.create(
+                        customer=self.customer,
+                        amount=(i + 1) * 1000,
+                        items=[dict(name='foo', amount=100)],
+                    )
+                    guids.append(invoice.guid)
+
+        res = self.testapp.get(
+            '/v1/invoices/export',
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        records = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual([record['guid'] for record in records], guids)
+        self.assertEqual(records[0]['customer_guid'], self.customer.guid)
+        self.assertEqual(records[0]['items'][0]['name'], 'foo')
+
+        res = self.testapp.get(
+            '/v1/invoices/export',
+            dict(format='csv', created_after='2013-08-16T00:00:03Z'),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        rows = list(csv.DictReader(StringIO.StringIO(res.body)))
+        self.assertEqual([row['guid'] for row in rows], guids[2:])
+        self.assertEqual(rows[0]['amount'], '3000')
+        self.assertEqual(rows[0]['subscription_guid'], '')
+        self.assertEqual(json.loads(rows[0]['items'])[0]['amount'], 100)
+
     def test_invoice_transaction_list(self):
         # create transaction in other company to make sure they will not be
         # included in the result
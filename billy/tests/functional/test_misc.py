@@ -1,11 +1,16 @@
 from __future__ import unicode_literals
+import unittest
 
 import mock
 import transaction as db_transaction
 from freezegun import freeze_time
 from sqlalchemy.exc import IntegrityError
+from pyramid.registry import Registry
 
 from billy.models import tables
+from billy.models import setup_database
+from billy.request import APIRequest
+from billy.api.utils import get_processor_factory
 from billy.tests.functional.helper import ViewTestCase
 
 
@@ -45,3 +50,69 @@ class TestDBSession(ViewTestCase):
             '/v1/customers',
             extra_environ=dict(REMOTE_USER=self.api_key),
         )
+
+
+class TestReplicaSession(unittest.TestCase):
+
+    def make_request(self, settings, method):
+        request = APIRequest.blank('/', method=method)
+        request.registry = Registry()
+        request.registry.settings = settings
+        return request
+
+    def test_setup_database_with_replica(self):
+        settings = setup_database({}, **{'sqlalchemy.url': 'sqlite://'})
+        self.assertEqual(settings['replica_engine'], None)
+        self.assertEqual(settings['replica_session'], None)
+
+        settings = setup_database({}, **{
+            'sqlalchemy.url': 'sqlite://',
+            'billy.db.replica.url': 'sqlite://',
+        })
+        self.assertIsNot(settings['replica_engine'], None)
+        self.assertIsNot(settings['replica_engine'], settings['engine'])
+        self.assertIs(settings['replica_session'].bind,
+                      settings['replica_engine'])
+
+    def test_read_only_requests_use_replica(self):
+        settings = dict(session='primary', replica_session='replica')
+        for method in ['GET', 'HEAD']:
+            request = self.make_request(settings, method)
+            self.assertEqual(request.session, 'replica')
+        for method in ['POST', 'PUT', 'DELETE']:
+            request = self.make_request(settings, method)
+            self.assertEqual(request.session, 'primary')
+
+    def test_without_replica(self):
+        settings = dict(session='primary', replica_session=None)
+        request = self.make_request(settings, 'GET')
+        self.assertEqual(request.session, 'primary')
+
+
+class TestProcessorFactory(unittest.TestCase):
+
+    def test_processor_factory_with_breaker_and_timeout(self):
+        settings = setup_database({}, **{
+            'sqlalchemy.url': 'sqlite://',
+            'billy.processor_factory': mock.Mock(),
+        })
+        self.assertEqual(settings['processor_breaker'], None)
+        factory = get_processor_factory(settings)
+        self.assertIs(factory, settings['billy.processor_factory'])
+
+        settings = setup_database({}, **{
+            'sqlalchemy.url': 'sqlite://',
+            'billy.processor_factory': mock.Mock(),
+            'billy.processor.timeout': '2.5',
+            'billy.processor.breaker.failure_threshold': '5',
+            'billy.processor.breaker.reset_timeout': '60',
+        })
+        breaker = settings['processor_breaker']
+        self.assertEqual(breaker.failure_threshold, 5)
+        self.assertEqual(breaker.reset_timeout, 60)
+        factory = get_processor_factory(settings)
+        factory()
+        settings['billy.processor_factory'].assert_called_once_with(
+            timeout=2.5,
+            circuit_breaker=breaker,
+        )
@@ -6,6 +6,7 @@ import tempfile
 import shutil
 import textwrap
 import StringIO
+import threading
 
 import mock
 import transaction as db_transaction
@@ -45,7 +46,7 @@ class TestProcessTransactions(unittest.TestCase):
         """)
         self.assertMultiLineEqual(usage_out.getvalue(), expected)
 
-    @mock.patch('billy.models.transaction.TransactionModel.process_transactions')
+    @mock.patch('billy.models.transaction.TransactionModel.process_pending_in_chunks')
     def test_main(self, process_transactions_method):
         cfg_path = os.path.join(self.temp_dir, 'config.ini')
         with open(cfg_path, 'wt') as f:
@@ -159,3 +160,160 @@ class TestProcessTransactions(unittest.TestCase):
         # So, there would only be two charges in processor. This is mainly
         # for making sure we won't duplicate charges/payouts
         self.assertEqual(len(debits), 2)
+
+    def test_main_with_concurrency(self):
+        dummy_processor = DummyProcessor()
+        dummy_processor.debit = mock.Mock()
+        lock = threading.Lock()
+        debits = []
+
+        def mock_charge(transaction):
+            uri = 'MOCK_DEBIT_URI_FOR_{}'.format(transaction.guid)
+            with lock:
+                debits.append(transaction.guid)
+            return dict(
+                processor_uri=uri,
+                status=TransactionModel.statuses.SUCCEEDED,
+            )
+
+        dummy_processor.debit.side_effect = mock_charge
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.transaction.concurrency = 4
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        plan_model = factory.create_plan_model()
+        subscription_model = factory.create_subscription_model()
+        tx_model = factory.create_transaction_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            plan = plan_model.create(
+                company=company,
+                plan_type=plan_model.types.DEBIT,
+                amount=10,
+                frequency=plan_model.frequencies.MONTHLY,
+            )
+            customer = customer_model.create(
+                company=company,
+            )
+            for _ in range(10):
+                subscription_model.create(
+                    customer=customer,
+                    plan=plan,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+            guids = tx_model.list_pending_guids()
+        session.remove()
+
+        process_transactions.main([process_transactions.__file__, cfg_path],
+                                  processor=dummy_processor)
+
+        self.assertEqual(len(guids), 10)
+        self.assertEqual(sorted(debits), sorted(guids))
+        with db_transaction.manager:
+            for guid in guids:
+                transaction = tx_model.get(guid)
+                self.assertEqual(transaction.submit_status,
+                                 TransactionModel.submit_statuses.DONE)
+            self.assertFalse(tx_model.list_pending_guids())
+
+    def test_main_with_chunk_and_checkpoint(self):
+        dummy_processor = DummyProcessor()
+        dummy_processor.debit = mock.Mock()
+        debits = []
+
+        def mock_charge(transaction):
+            if dummy_processor.debit.call_count == 3:
+                raise KeyboardInterrupt
+            debits.append(transaction.guid)
+            return dict(
+                processor_uri='MOCK_DEBIT_URI_FOR_{}'.format(transaction.guid),
+                status=TransactionModel.statuses.SUCCEEDED,
+            )
+
+        dummy_processor.debit.side_effect = mock_charge
+
+        checkpoint_path = os.path.join(self.temp_dir, 'checkpoint')
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.transaction.chunk_size = 2
+            billy.transaction.checkpoint_path = {}
+            """.format(checkpoint_path)))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        plan_model = factory.create_plan_model()
+        subscription_model = factory.create_subscription_model()
+        tx_model = factory.create_transaction_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            plan = plan_model.create(
+                company=company,
+                plan_type=plan_model.types.DEBIT,
+                amount=10,
+                frequency=plan_model.frequencies.MONTHLY,
+            )
+            customer = customer_model.create(
+                company=company,
+            )
+            for _ in range(5):
+                subscription_model.create(
+                    customer=customer,
+                    plan=plan,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+            guids = tx_model.list_pending_guids()
+
+        with self.assertRaises(KeyboardInterrupt):
+            process_transactions.main([process_transactions.__file__, cfg_path],
+                                      processor=dummy_processor)
+        # the first chunk was committed, and the checkpoint was recorded
+        self.assertEqual(debits, guids[:2])
+        with open(checkpoint_path, 'rt') as f:
+            self.assertEqual(f.read(), guids[1])
+        with db_transaction.manager:
+            self.assertEqual(tx_model.list_pending_guids(), guids[2:])
+            self.assertEqual(
+                tx_model.list_pending_guids(after=guids[2], limit=1),
+                guids[3:4],
+            )
+
+        process_transactions.main([process_transactions.__file__, cfg_path],
+                                  processor=dummy_processor)
+        self.assertEqual(debits, guids)
+        self.assertFalse(os.path.exists(checkpoint_path))
+        with db_transaction.manager:
+            self.assertFalse(tx_model.list_pending_guids())
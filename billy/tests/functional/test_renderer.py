@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
+import json
 
 import transaction as db_transaction
 from freezegun import freeze_time
+from sqlalchemy import event
 
+from billy.db import tables
 from billy.renderers import company_adapter
 from billy.renderers import customer_adapter
 from billy.renderers import plan_adapter
@@ -10,6 +13,9 @@ from billy.renderers import subscription_adapter
 from billy.renderers import invoice_adapter
 from billy.renderers import transaction_adapter
 from billy.renderers import transaction_failure_adapter
+from billy.renderers import RenderPrefetch
+from billy.renderers import PlainJSON
+from billy.renderers import get_serializer
 from billy.tests.functional.helper import ViewTestCase
 from billy.utils.generic import utc_now
 
@@ -342,3 +348,121 @@ class TestRenderer(ViewTestCase):
             created_at=transaction_failure.created_at.isoformat(),
         )
         self.assertEqual(json_data, expected)
+
+    def test_render_with_prefetch(self):
+        records = [
+            self.customer_invoice,
+            self.subscription_invoice,
+            self.transaction,
+            self.subscription,
+        ]
+        adapters = [
+            invoice_adapter,
+            invoice_adapter,
+            transaction_adapter,
+            subscription_adapter,
+        ]
+        expected = [
+            adapter(record, self.dummy_request)
+            for adapter, record in zip(adapters, records)
+        ]
+        guids = [record.guid for record in records]
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = self.settings['engine']
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            # start with a clean session, so that nothing is loaded yet
+            self.testapp.session.close()
+            invoices = (
+                self.testapp.session.query(tables.Invoice)
+                .with_polymorphic('*')
+                .filter(tables.Invoice.guid.in_(guids[:2]))
+            )
+            invoices = dict((invoice.guid, invoice) for invoice in invoices)
+            records = [
+                invoices[guids[0]],
+                invoices[guids[1]],
+                self.transaction_model.get(guids[2]),
+                self.subscription_model.get(guids[3]),
+            ]
+            self.dummy_request.render_prefetch = RenderPrefetch.load(
+                self.testapp.session,
+                records,
+            )
+            del statements[:]
+            result = [
+                adapter(record, self.dummy_request)
+                for adapter, record in zip(adapters, records)
+            ]
+        finally:
+            event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute,
+            )
+        self.assertEqual(result, expected)
+        self.assertEqual(statements, [])
+
+    def _render(self, settings, value):
+        renderer = PlainJSON(serializer=get_serializer(settings))
+        renderer.add_adapter(tables.Company, company_adapter)
+        renderer.add_adapter(tables.Transaction, transaction_adapter)
+        renderer.add_adapter(tables.TransactionFailure,
+                             transaction_failure_adapter)
+        render = renderer(None)
+        return render(value, dict(request=self.dummy_request))
+
+    def test_plain_json_renderer(self):
+        value = dict(
+            items=[self.company, self.transaction],
+            offset=0,
+        )
+        expected = dict(
+            items=[
+                company_adapter(self.company, self.dummy_request),
+                transaction_adapter(self.transaction, self.dummy_request),
+            ],
+            offset=0,
+        )
+        for pretty_print in [True, False]:
+            for serializer in ['json', 'simplejson']:
+                body = self._render(
+                    {
+                        'api.json.pretty_print': pretty_print,
+                        'api.json.serializer': serializer,
+                    },
+                    value,
+                )
+                self.assertEqual(json.loads(body), expected)
+
+    def test_compact_json(self):
+        value = dict(items=[self.company], offset=0)
+        pretty_body = self._render({'api.json.pretty_print': 'true'}, value)
+        compact_body = self._render({'api.json.pretty_print': 'false'}, value)
+        self.assertIn('\n', pretty_body)
+        self.assertNotIn('\n', compact_body)
+        self.assertNotIn(', ', compact_body)
+        self.assertLess(len(compact_body), len(pretty_body))
+        self.assertEqual(json.loads(compact_body), json.loads(pretty_body))
+
+    def test_serializer_by_dotted_name(self):
+        body = self._render(
+            {
+                'api.json.pretty_print': 'false',
+                'api.json.serializer': (
+                    'billy.renderers.simplejson_backend'
+                ),
+            },
+            dict(items=[self.company]),
+        )
+        self.assertEqual(
+            json.loads(body),
+            dict(items=[company_adapter(self.company, self.dummy_request)]),
+        )
+
+    def test_render_unknown_object(self):
+        with self.assertRaises(TypeError):
+            self._render({}, dict(items=[object()]))
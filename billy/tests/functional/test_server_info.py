@@ -14,6 +14,10 @@ class TestServerInfo(ViewTestCase):
     def test_server_info(self):
         res = self.testapp.get('/', status=200)
         self.assertIn('revision', res.json)
+        self.assertIn('pool_class', res.json['db_pool'])
+        self.assertEqual(res.json['db_pool']['pre_ping'], False)
+        self.assertEqual(res.json['processor_breaker'], None)
+        self.assertIsInstance(res.json['processor_latency'], dict)
 
     def test_server_info_with_transaction(self):
         with db_transaction.manager:
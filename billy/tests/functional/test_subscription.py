@@ -6,7 +6,9 @@ import transaction as db_transaction
 from freezegun import freeze_time
 
 from billy.tests.functional.helper import ViewTestCase
+from billy.api.utils import encode_cursor
 from billy.errors import BillyError
+from billy.errors import ProcessorUnavailableError
 from billy.utils.generic import utc_now
 from billy.utils.generic import utc_datetime
 
@@ -191,6 +193,27 @@ class TestSubscriptionViews(ViewTestCase):
         self.assertEqual(transaction.submit_status,
                          self.transaction_model.submit_statuses.RETRYING)
 
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
+    def test_create_subscription_with_unavailable_processor(self, debit_method):
+        debit_method.side_effect = ProcessorUnavailableError('Unavailable')
+
+        res = self.testapp.post(
+            '/v1/subscriptions',
+            dict(
+                customer_guid=self.customer.guid,
+                plan_guid=self.plan.guid,
+                funding_instrument_uri='/v1/cards/foobar',
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        subscription = self.subscription_model.get(res.json['guid'])
+        transaction = subscription.invoices[0].transactions[0]
+        # the processor was not called, so it is not a failure
+        self.assertEqual(transaction.failure_count, 0)
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.RETRYING)
+
     def test_create_subscription_without_funding_instrument(self):
         res = self.testapp.post(
             '/v1/subscriptions',
@@ -535,6 +558,151 @@ class TestSubscriptionViews(ViewTestCase):
         self.assertFalse(invoices)
         self.assertEqual(subscription.invoice_count, 1)
 
+    def test_yield_invoices_catch_up(self):
+        with db_transaction.manager:
+            plan = self.plan_model.create(
+                company=self.company,
+                frequency=self.plan_model.frequencies.DAILY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+            )
+            subscription = self.subscription_model.create(
+                customer=self.customer,
+                plan=plan,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            staged_subscription = self.subscription_model.create(
+                customer=self.customer,
+                plan=plan,
+            )
+        # 300 days passed, all missed periods should be yielded at once
+        with db_transaction.manager:
+            with freeze_time('2014-06-12'):
+                invoices = self.subscription_model.yield_invoices()
+        self.assertEqual(len(invoices), 300 * 2)
+        self.assertEqual(subscription.invoice_count, 301)
+        self.assertEqual(staged_subscription.invoice_count, 301)
+        self.assertEqual(subscription.period, subscription.invoices.count())
+        self.assertEqual(subscription.next_invoice_at,
+                         utc_datetime(2014, 6, 13))
+        self.assertEqual(staged_subscription.next_invoice_at,
+                         utc_datetime(2014, 6, 13))
+
+        invoices = subscription.invoices
+        expected_scheduled_at = [
+            utc_datetime(2013, 8, 16) + datetime.timedelta(days=i)
+            for i in reversed(range(301))
+        ]
+        invoice_scheduled_at = [invoice.scheduled_at for invoice in invoices]
+        self.assertEqual(invoice_scheduled_at, expected_scheduled_at)
+        for invoice in invoices[:-1]:
+            self.assertEqual(invoice.status,
+                             self.invoice_model.statuses.PROCESSING)
+            self.assertEqual(len(invoice.transactions), 1)
+            transaction = invoice.transactions[0]
+            self.assertEqual(transaction.amount, 1000)
+            self.assertEqual(transaction.funding_instrument_uri,
+                             '/v1/cards/tester')
+            self.assertEqual(transaction.submit_status,
+                             self.transaction_model.submit_statuses.STAGED)
+        for invoice in staged_subscription.invoices:
+            self.assertEqual(invoice.status,
+                             self.invoice_model.statuses.STAGED)
+            self.assertEqual(len(invoice.transactions), 0)
+
+        # nothing more to yield
+        with freeze_time('2014-06-12'):
+            invoices = self.subscription_model.yield_invoices()
+        self.assertFalse(invoices)
+
+    def test_yield_invoices_in_chunks(self):
+        with db_transaction.manager:
+            plan = self.plan_model.create(
+                company=self.company,
+                frequency=self.plan_model.frequencies.DAILY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+            )
+            guids = []
+            for _ in range(5):
+                subscription = self.subscription_model.create(
+                    customer=self.customer,
+                    plan=plan,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+                guids.append(subscription.guid)
+        with db_transaction.manager:
+            with freeze_time('2013-08-26'):
+                count = self.subscription_model.yield_invoices_in_chunks(2)
+        self.assertEqual(count, 5 * 10)
+        # yielded chunks should be removed from the session
+        self.assertNotIn(subscription, self.testapp.session)
+        for guid in guids:
+            subscription = self.subscription_model.get(guid)
+            self.assertEqual(subscription.period, 11)
+            self.assertEqual(subscription.invoices.count(), 11)
+            self.assertEqual(subscription.next_invoice_at,
+                             utc_datetime(2013, 8, 27))
+
+        # nothing more to yield
+        with db_transaction.manager:
+            with freeze_time('2013-08-26'):
+                count = self.subscription_model.yield_invoices_in_chunks(2)
+        self.assertEqual(count, 0)
+
+    def test_subscription_period(self):
+        with db_transaction.manager:
+            plan = self.plan_model.create(
+                company=self.company,
+                frequency=self.plan_model.frequencies.DAILY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+            )
+            subscription = self.subscription_model.create(
+                customer=self.customer,
+                plan=plan,
+            )
+        guid = subscription.guid
+
+        def assert_period(expected):
+            subscription = self.subscription_model.get(guid)
+            self.assertEqual(subscription.period, expected)
+            self.assertEqual(subscription.invoices.count(), expected)
+
+        assert_period(1)
+        for now, expected in [
+            ('2013-08-16', 1),
+            ('2013-08-18', 3),
+            ('2013-08-18', 3),
+            ('2013-08-21', 6),
+        ]:
+            with db_transaction.manager:
+                with freeze_time(now):
+                    self.subscription_model.yield_invoices()
+            assert_period(expected)
+
+        # the period is increased by another request after we loaded the
+        # subscription, the increment should not be lost
+        Subscription = self.subscription_model.TABLE
+        with db_transaction.manager:
+            subscription = self.subscription_model.get(guid)
+            self.assertEqual(subscription.period, 6)
+            (
+                self.testapp.session.query(Subscription)
+                .filter(Subscription.guid == guid)
+                .update(
+                    dict(period=Subscription.period + 1),
+                    synchronize_session=False,
+                )
+            )
+            self.invoice_model.create(
+                subscription=subscription,
+                amount=1000,
+                scheduled_at=utc_now(),
+            )
+        subscription = self.subscription_model.get(guid)
+        self.assertEqual(subscription.period, 8)
+
     def test_cancel_a_canceled_subscription(self):
         with db_transaction.manager:
             subscription = self.subscription_model.create(
@@ -617,6 +785,17 @@ class TestSubscriptionViews(ViewTestCase):
         result_guids = [item['guid'] for item in items]
         self.assertEqual(result_guids, expected_guids)
 
+        # page through with cursor, invoices are still ordered by
+        # scheduled_at
+        res = self.testapp.get(
+            '/v1/subscriptions/{}/invoices'.format(subscription.guid),
+            dict(limit=2, after=encode_cursor(expected_guids[1])),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        result_guids = [item['guid'] for item in res.json['items']]
+        self.assertEqual(result_guids, expected_guids[2:4])
+
     def test_subscription_transaction_list(self):
         with db_transaction.manager:
             subscription1 = self.subscription_model.create(
@@ -1,8 +1,16 @@
 from __future__ import unicode_literals
+import csv
+import json
+import datetime
+import StringIO
 
+import mock
+import pytz
 import transaction as db_transaction
 from freezegun import freeze_time
+from sqlalchemy import event
 
+from billy.api.utils import encode_cursor
 from billy.tests.functional.helper import ViewTestCase
 
 
@@ -84,6 +92,178 @@ class TestTransactionViews(ViewTestCase):
         result_guids = [item['guid'] for item in items]
         self.assertEqual(set(result_guids), set(guids[5:8]))
 
+    def test_transaction_list_by_company_with_cursor(self):
+        guids = [self.transaction.guid]
+        with db_transaction.manager:
+            for i in range(9):
+                # transactions created at the same time should be ordered by
+                # guid as well
+                with freeze_time('2013-08-16 00:00:{:02}'.format(i // 2 + 1)):
+                    transaction = self.transaction_model.create(
+                        invoice=self.invoice,
+                        transaction_type=self.transaction_model.types.DEBIT,
+                        amount=10 * i,
+                        funding_instrument_uri='/v1/cards/tester',
+                    )
+                    guids.append(transaction.guid)
+        expected_guids = [
+            tx.guid for tx in sorted(
+                (self.transaction_model.get(guid) for guid in guids),
+                key=lambda tx: (tx.created_at, tx.guid),
+                reverse=True,
+            )
+        ]
+
+        def list_transactions(params):
+            res = self.testapp.get(
+                '/v1/transactions',
+                params,
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+            return res.json
+
+        # page through with after cursor
+        result_guids = []
+        page = list_transactions(dict(limit=3))
+        while page['items']:
+            result_guids.extend(item['guid'] for item in page['items'])
+            page = list_transactions(dict(limit=3, after=page['next_cursor']))
+        self.assertEqual(page['next_cursor'], None)
+        self.assertEqual(result_guids, expected_guids)
+
+        # page back with before cursor
+        page = list_transactions(dict(limit=4, offset=6))
+        self.assertEqual(
+            [item['guid'] for item in page['items']],
+            expected_guids[6:],
+        )
+        page = list_transactions(dict(limit=4, before=page['previous_cursor']))
+        self.assertEqual(
+            [item['guid'] for item in page['items']],
+            expected_guids[2:6],
+        )
+
+    def test_transaction_list_with_bad_cursor(self):
+        with db_transaction.manager:
+            other_company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            other_customer = self.customer_model.create(
+                company=other_company,
+            )
+            other_invoice = self.invoice_model.create(
+                customer=other_customer,
+                amount=100,
+            )
+            other_transaction = self.transaction_model.create(
+                invoice=other_invoice,
+                amount=100,
+            )
+        # a transaction of other company cannot be the cursor
+        other_cursor = encode_cursor(other_transaction.guid)
+        for params in [
+            dict(after='BAD CURSOR'),
+            dict(after='MA'),
+            dict(after='MA', before='MA'),
+            dict(after=other_cursor),
+            dict(before=other_cursor),
+        ]:
+            self.testapp.get(
+                '/v1/transactions',
+                params,
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=400,
+            )
+
+    def test_transaction_export(self):
+        guids = [self.transaction.guid]
+        with db_transaction.manager:
+            for i in range(5):
+                with freeze_time('2013-08-16 00:00:{:02}'.format(i + 1)):
+                    transaction = self.transaction_model.create(
+                        invoice=self.invoice,
+                        transaction_type=self.transaction_model.types.DEBIT,
+                        amount=10 * i,
+                        funding_instrument_uri='/v1/cards/tester',
+                    )
+                    guids.append(transaction.guid)
+        # export in small chunks
+        settings = self.testapp.app.registry.settings
+        settings['api.export.chunk_size'] = 2
+
+        res = self.testapp.get(
+            '/v1/transactions/export',
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertEqual(res.content_type, 'application/x-ndjson')
+        lines = res.body.splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([record['guid'] for record in records], guids)
+        self.assertEqual(records[1]['amount'], 0)
+        self.assertEqual(records[1]['failures'], [])
+
+        res = self.testapp.get(
+            '/v1/transactions/export',
+            dict(
+                created_after='2013-08-16T00:00:02Z',
+                created_before='2013-08-16T00:00:05Z',
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        records = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual([record['guid'] for record in records], guids[2:5])
+
+    def test_transaction_export_csv(self):
+        res = self.testapp.get(
+            '/v1/transactions/export',
+            dict(format='csv'),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertEqual(res.content_type, 'text/csv')
+        rows = list(csv.DictReader(StringIO.StringIO(res.body)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['guid'], self.transaction.guid)
+        self.assertEqual(rows[0]['amount'], '10')
+        self.assertEqual(rows[0]['transaction_type'], 'debit')
+        self.assertEqual(rows[0]['status'], '')
+        self.assertEqual(rows[0]['failures'], '[]')
+
+    def test_transaction_export_with_bad_parameters(self):
+        for params in [
+            dict(format='xml'),
+            dict(created_after='BAD DATETIME'),
+        ]:
+            self.testapp.get(
+                '/v1/transactions/export',
+                params,
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=400,
+            )
+
+    def test_transaction_export_with_bad_api_key(self):
+        self.testapp.get(
+            '/v1/transactions/export',
+            extra_environ=dict(REMOTE_USER=b'BAD_API_KEY'),
+            status=403,
+        )
+
+    def test_transaction_company_guid(self):
+        with db_transaction.manager:
+            invoice = self.invoice_model.create(
+                customer=self.customer,
+                amount=100,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+        self.assertEqual(self.invoice.company_guid, self.company.guid)
+        self.assertEqual(self.transaction.company_guid, self.company.guid)
+        self.assertEqual(invoice.company_guid, self.company.guid)
+        self.assertEqual(invoice.transactions[0].company_guid,
+                         self.company.guid)
+
     def test_transaction_list_by_company_with_bad_api_key(self):
         self.testapp.get(
             '/v1/transactions',
@@ -167,3 +347,277 @@ class TestTransactionViews(ViewTestCase):
             extra_environ=dict(REMOTE_USER=self.api_key),
             status=403,
         )
+
+    def test_process_transactions_with_prefetch(self):
+        with db_transaction.manager:
+            for _ in range(10):
+                customer = self.customer_model.create(company=self.company)
+                self.invoice_model.create(
+                    customer=customer,
+                    amount=100,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+        self.testapp.session.expunge_all()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append(statement)
+
+        engine = self.settings['engine']
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            with db_transaction.manager:
+                transactions = self.transaction_model.process_transactions()
+        finally:
+            event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute,
+            )
+        self.assertEqual(len(transactions), 11)
+        # one query for listing transactions, five for prefetching invoices,
+        # subscriptions, customers, companies and attached funding
+        # instruments, and one for locking each transaction, no lazy loading
+        # or counting failures at all
+        self.assertEqual(len(statements), 1 + 5 + len(transactions))
+        for transaction in transactions:
+            transaction = self.transaction_model.get(transaction.guid)
+            self.assertEqual(transaction.submit_status,
+                             self.transaction_model.submit_statuses.DONE)
+            self.assertEqual(transaction.status,
+                             self.transaction_model.statuses.SUCCEEDED)
+
+    def _create_debit(self):
+        with db_transaction.manager:
+            transaction = self.transaction_model.create(
+                invoice=self.invoice,
+                transaction_type=self.transaction_model.types.DEBIT,
+                amount=10,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+        return transaction
+
+    def test_process_skip_prepare_customer_for_attached_card(self):
+        second_transaction = self._create_debit()
+        with mock.patch.object(
+            self.dummy_processor,
+            'prepare_customer',
+        ) as prepare_customer:
+            with db_transaction.manager:
+                transaction = self.transaction_model.get(self.transaction.guid)
+                self.transaction_model.process_one(transaction)
+            self.assertEqual(prepare_customer.call_count, 1)
+            with db_transaction.manager:
+                transaction = self.transaction_model.get(
+                    second_transaction.guid
+                )
+                self.transaction_model.process_one(transaction)
+            # the card was attached already
+            self.assertEqual(prepare_customer.call_count, 1)
+        customer = self.customer_model.get(self.customer.guid)
+        self.assertTrue(self.customer_model.is_funding_instrument_attached(
+            customer,
+            '/v1/cards/tester',
+        ))
+
+    def test_process_forget_attached_card_after_failure(self):
+        second_transaction = self._create_debit()
+        third_transaction = self._create_debit()
+        with db_transaction.manager:
+            transaction = self.transaction_model.get(self.transaction.guid)
+            self.transaction_model.process_one(transaction)
+
+        with mock.patch.object(
+            self.dummy_processor,
+            'debit',
+            side_effect=RuntimeError('Card removed'),
+        ):
+            with db_transaction.manager:
+                transaction = self.transaction_model.get(
+                    second_transaction.guid
+                )
+                self.transaction_model.process_one(transaction)
+        customer = self.customer_model.get(self.customer.guid)
+        self.assertFalse(self.customer_model.is_funding_instrument_attached(
+            customer,
+            '/v1/cards/tester',
+        ))
+
+        # the customer should be prepared again
+        with mock.patch.object(
+            self.dummy_processor,
+            'prepare_customer',
+        ) as prepare_customer:
+            with db_transaction.manager:
+                transaction = self.transaction_model.get(
+                    third_transaction.guid
+                )
+                self.transaction_model.process_one(transaction)
+            self.assertEqual(prepare_customer.call_count, 1)
+
+    def test_mark_submit_attempts(self):
+        second_transaction = self._create_debit()
+        with db_transaction.manager:
+            second_transaction = self.transaction_model.get(
+                second_transaction.guid
+            )
+            second_transaction.submit_status = (
+                self.transaction_model.submit_statuses.CANCELED
+            )
+        guids = [self.transaction.guid, second_transaction.guid]
+        with db_transaction.manager:
+            attempts = self.transaction_model.mark_submit_attempts(guids)
+        # only pending transactions are marked
+        self.assertEqual(attempts, {self.transaction.guid: 1})
+        with db_transaction.manager:
+            attempts = self.transaction_model.mark_submit_attempts(guids)
+        self.assertEqual(attempts, {self.transaction.guid: 2})
+        transaction = self.transaction_model.get(second_transaction.guid)
+        self.assertEqual(transaction.submit_attempts, 0)
+
+    def test_process_with_submit_attempt(self):
+        second_transaction = self._create_debit()
+        with db_transaction.manager:
+            attempts = self.transaction_model.mark_submit_attempts(
+                [self.transaction.guid]
+            )
+        with db_transaction.manager:
+            transaction = self.transaction_model.get(self.transaction.guid)
+            self.transaction_model.process_one(
+                transaction,
+                attempt=attempts[self.transaction.guid],
+            )
+        transaction = self.transaction_model.get(self.transaction.guid)
+        self.assertEqual(transaction.submit_attempts, 1)
+
+        # the attempt was not recorded in advance, it should never be seen
+        # as the first attempt
+        with db_transaction.manager:
+            transaction = self.transaction_model.get(second_transaction.guid)
+            self.transaction_model.process_one(transaction)
+        transaction = self.transaction_model.get(second_transaction.guid)
+        self.assertEqual(transaction.submit_attempts, 2)
+
+    def test_get_retry_delay(self):
+        settings = self.model_factory.settings
+        # failed transactions are not retried right away by default
+        settings['billy.transaction.retry_jitter'] = 0
+        self.assertEqual(self.transaction_model.get_retry_delay(1), 60)
+
+        settings['billy.transaction.retry_delay'] = 60
+        settings['billy.transaction.maximum_retry_delay'] = 300
+        settings['billy.transaction.retry_jitter'] = 0
+        delays = [
+            self.transaction_model.get_retry_delay(failure_count)
+            for failure_count in range(1, 6)
+        ]
+        self.assertEqual(delays, [60, 120, 240, 300, 300])
+
+        settings['billy.transaction.retry_jitter'] = 0.5
+        with mock.patch('random.uniform') as uniform:
+            uniform.return_value = 1.25
+            delay = self.transaction_model.get_retry_delay(2)
+        uniform.assert_called_once_with(0.5, 1.5)
+        self.assertEqual(delay, 150)
+
+    def test_process_with_retry_backoff(self):
+        settings = self.model_factory.settings
+        settings['billy.transaction.retry_delay'] = 60
+        settings['billy.transaction.retry_jitter'] = 0
+        # new transactions are due right away
+        transaction = self.transaction_model.get(self.transaction.guid)
+        self.assertEqual(transaction.next_attempt_at, transaction.created_at)
+        with mock.patch.object(
+            self.dummy_processor,
+            'debit',
+            side_effect=RuntimeError('Boom!'),
+        ):
+            with freeze_time('2013-08-16'):
+                with db_transaction.manager:
+                    self.transaction_model.process_transactions()
+            transaction = self.transaction_model.get(self.transaction.guid)
+            self.assertEqual(transaction.submit_status,
+                             self.transaction_model.submit_statuses.RETRYING)
+            self.assertEqual(transaction.failure_count, 1)
+            self.assertEqual(transaction.next_attempt_at,
+                             datetime.datetime(2013, 8, 16, 0, 1, tzinfo=pytz.utc))
+
+            # it's not due yet
+            with freeze_time('2013-08-16 00:00:59'):
+                self.assertEqual(
+                    self.transaction_model.list_pending_guids(), [],
+                )
+                with db_transaction.manager:
+                    self.assertEqual(
+                        self.transaction_model.process_transactions(), [],
+                    )
+                    self.assertEqual(
+                        self.transaction_model.process_pending(
+                            self.transaction.guid,
+                        ),
+                        None,
+                    )
+
+            # the delay is doubled after another failure
+            with freeze_time('2013-08-16 00:01:00'):
+                self.assertEqual(
+                    self.transaction_model.list_pending_guids(),
+                    [self.transaction.guid],
+                )
+                with db_transaction.manager:
+                    self.transaction_model.process_pending(
+                        self.transaction.guid,
+                    )
+            transaction = self.transaction_model.get(self.transaction.guid)
+            self.assertEqual(transaction.failure_count, 2)
+            self.assertEqual(transaction.next_attempt_at,
+                             datetime.datetime(2013, 8, 16, 0, 3, tzinfo=pytz.utc))
+
+        with freeze_time('2013-08-16 00:03:00'):
+            with db_transaction.manager:
+                self.transaction_model.process_pending(self.transaction.guid)
+        transaction = self.transaction_model.get(self.transaction.guid)
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.DONE)
+        self.assertEqual(transaction.next_attempt_at, None)
+
+    def test_process_pending_in_chunks(self):
+        guids = [self.transaction.guid]
+        with db_transaction.manager:
+            for i in range(4):
+                with freeze_time('2013-08-16 00:00:{:02}'.format(i + 1)):
+                    transaction = self.transaction_model.create(
+                        invoice=self.invoice,
+                        transaction_type=self.transaction_model.types.DEBIT,
+                        amount=10,
+                        funding_instrument_uri='/v1/cards/tester',
+                    )
+                guids.append(transaction.guid)
+
+        processed_guids = []
+
+        def debit(transaction):
+            processed_guids.append(transaction.guid)
+            # fail the second one, it should not be processed again in
+            # following chunks
+            if len(processed_guids) == 2:
+                raise RuntimeError('Boom!')
+            return dict(
+                processor_uri='MOCK_DEBIT_TX_URI',
+                status=self.transaction_model.statuses.SUCCEEDED,
+            )
+
+        with mock.patch.object(self.dummy_processor, 'debit', debit):
+            with db_transaction.manager:
+                count = self.transaction_model.process_pending_in_chunks(2)
+        self.assertEqual(count, 5)
+        self.assertEqual(processed_guids, guids)
+        # processed chunks should be removed from the session
+        self.assertNotIn(transaction, self.testapp.session)
+        for guid in guids:
+            transaction = self.transaction_model.get(guid)
+            if guid == guids[1]:
+                expected = self.transaction_model.submit_statuses.RETRYING
+            else:
+                expected = self.transaction_model.submit_statuses.DONE
+            self.assertEqual(transaction.submit_status, expected)
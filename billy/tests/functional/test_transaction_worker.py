@@ -0,0 +1,285 @@
+from __future__ import unicode_literals
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import textwrap
+import StringIO
+
+import mock
+import transaction as db_transaction
+from freezegun import freeze_time
+from pyramid.paster import get_appsettings
+
+from billy.db import tables
+from billy.utils.generic import utc_now
+from billy.models import setup_database
+from billy.models.transaction import TransactionModel
+from billy.models.model_factory import ModelFactory
+from billy.scripts import initializedb
+from billy.scripts import transaction_worker
+from billy.scripts.transaction_worker import main
+from billy.tests.fixtures.processor import DummyProcessor
+
+
+class TestTransactionWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_usage(self):
+        filename = '/path/to/transaction_worker'
+
+        old_stdout = sys.stdout
+        usage_out = StringIO.StringIO()
+        sys.stdout = usage_out
+        try:
+            with self.assertRaises(SystemExit):
+                main([filename])
+        finally:
+            sys.stdout = old_stdout
+        expected = textwrap.dedent("""\
+        usage: transaction_worker <config_uri>
+        (example: "transaction_worker development.ini")
+        """)
+        self.assertMultiLineEqual(usage_out.getvalue(), expected)
+
+    def test_main(self):
+        dummy_processor = DummyProcessor()
+        dummy_processor.debit = mock.Mock()
+        debits = []
+
+        def mock_charge(transaction):
+            if len(debits) == 1:
+                debits.append(None)
+                raise RuntimeError('Boom!')
+            debits.append(transaction.guid)
+            return dict(
+                processor_uri='MOCK_DEBIT_URI_FOR_{}'.format(transaction.guid),
+                status=TransactionModel.statuses.SUCCEEDED,
+            )
+
+        dummy_processor.debit.side_effect = mock_charge
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.transaction_worker.batch_size = 2
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        invoice_model = factory.create_invoice_model()
+        tx_model = factory.create_transaction_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            customer = customer_model.create(company=company)
+            transactions = []
+            for _ in range(3):
+                invoice = invoice_model.create(
+                    customer=customer,
+                    amount=100,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+                transactions.extend(invoice.transactions)
+            tx_model.enqueue(transactions)
+            # enqueue twice should be fine
+            tx_model.enqueue(transactions[:1])
+            guids = [transaction.guid for transaction in transactions]
+
+        main([transaction_worker.__file__, cfg_path],
+             processor=dummy_processor, once=True)
+
+        self.assertEqual(dummy_processor.debit.call_count, 3)
+        self.assertEqual(
+            session.query(tables.TransactionJob).count(),
+            0,
+        )
+        submit_statuses = [
+            tx_model.get(guid).submit_status for guid in guids
+        ]
+        self.assertEqual(submit_statuses, [
+            tx_model.submit_statuses.DONE,
+            tx_model.submit_statuses.RETRYING,
+            tx_model.submit_statuses.DONE,
+        ])
+        # attempts were recorded before calling the processor
+        submit_attempts = [
+            tx_model.get(guid).submit_attempts for guid in guids
+        ]
+        self.assertEqual(submit_attempts, [1, 1, 1])
+        session.close()
+
+    def test_give_up_failing_jobs(self):
+        dummy_processor = DummyProcessor()
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        invoice_model = factory.create_invoice_model()
+        tx_model = factory.create_transaction_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            customer = customer_model.create(company=company)
+            invoice = invoice_model.create(
+                customer=customer,
+                amount=100,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            tx_model.enqueue(invoice.transactions)
+            guid = invoice.transactions[0].guid
+
+        def process(minute):
+            with freeze_time('2013-08-16 00:{:02}:00'.format(minute)):
+                return transaction_worker.process_jobs(
+                    factory,
+                    'MOCK_WORKER',
+                    batch_size=10,
+                    lease_seconds=30,
+                    maximum_attempts=2,
+                )
+
+        # use a now function which can be frozen
+        old_now_func = tables.set_now_func(utc_now)
+        self.addCleanup(tables.set_now_func, old_now_func)
+        with mock.patch.object(TransactionModel, 'process_job') as process_job:
+            process_job.side_effect = RuntimeError('Boom!')
+            self.assertEqual(process(0), 1)
+            # it's still leased
+            self.assertEqual(process(0), 0)
+            job = session.query(tables.TransactionJob).one()
+            self.assertEqual(job.attempts, 1)
+            self.assertEqual(job.error_message, 'Boom!')
+            # claimed again after the lease expired
+            self.assertEqual(process(1), 1)
+            # failed too many times, the job is given up
+            self.assertEqual(process(2), 0)
+            self.assertEqual(process_job.call_count, 2)
+
+        job = session.query(tables.TransactionJob).one()
+        self.assertEqual(job.transaction_guid, guid)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.error_message, 'Boom!')
+        session.close()
+
+    def test_failed_job_does_not_affect_others_in_batch(self):
+        dummy_processor = DummyProcessor()
+
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        invoice_model = factory.create_invoice_model()
+        tx_model = factory.create_transaction_model()
+
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            customer = customer_model.create(company=company)
+            transactions = []
+            for _ in range(2):
+                invoice = invoice_model.create(
+                    customer=customer,
+                    amount=100,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+                transactions.extend(invoice.transactions)
+            tx_model.enqueue(transactions)
+
+        process_job = TransactionModel.process_job
+        processed = []
+
+        def mock_process_job(self, guid, attempt=None):
+            processed.append(guid)
+            # the first job in the batch fails
+            if len(processed) == 1:
+                raise RuntimeError('Boom!')
+            return process_job(self, guid, attempt=attempt)
+
+        with mock.patch.object(
+            TransactionModel,
+            'process_job',
+            autospec=True,
+            side_effect=mock_process_job,
+        ):
+            count = transaction_worker.process_jobs(
+                factory,
+                'MOCK_WORKER',
+                batch_size=10,
+                lease_seconds=30,
+            )
+        self.assertEqual(count, 2)
+        self.assertEqual(len(processed), 2)
+        failed_guid, succeeded_guid = processed
+
+        # the second job is processed and removed from the queue
+        succeeded = tx_model.get(succeeded_guid)
+        self.assertEqual(
+            succeeded.submit_status,
+            tx_model.submit_statuses.DONE,
+        )
+        self.assertEqual(succeeded.failure_count, 0)
+        jobs = session.query(tables.TransactionJob).all()
+        self.assertEqual(
+            [job.transaction_guid for job in jobs],
+            [failed_guid],
+        )
+        self.assertEqual(jobs[0].attempts, 1)
+        self.assertEqual(
+            session.query(tables.TransactionJob)
+            .filter_by(transaction_guid=succeeded_guid)
+            .count(),
+            0,
+        )
+        session.close()
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+import os
+import unittest
+
+import mock
+from sqlalchemy import create_engine
+
+from billy.db.pool import get_pool_options
+from billy.db.pool import setup_pool_events
+from billy.db.pool import get_pool_status
+
+
+class TestPool(unittest.TestCase):
+
+    def make_engine(self, pre_ping=False):
+        engine = create_engine('sqlite://')
+        setup_pool_events(engine, pre_ping=pre_ping)
+        return engine
+
+    def test_get_pool_options(self):
+        settings = {
+            'sqlalchemy.url': 'postgresql://postgres@127.0.0.1/billy',
+            'billy.db.pool_size': '20',
+            'billy.db.max_overflow': '5',
+            'billy.db.pool_timeout': '10',
+            'billy.db.pool_recycle': '3600',
+        }
+        self.assertEqual(get_pool_options(settings), dict(
+            pool_size=20,
+            max_overflow=5,
+            pool_timeout=10,
+            pool_recycle=3600,
+        ))
+        settings['sqlalchemy.url'] = 'sqlite://'
+        self.assertEqual(get_pool_options(settings), dict(pool_recycle=3600))
+        self.assertEqual(get_pool_options({'sqlalchemy.url': 'sqlite://'}), {})
+
+    def test_connection_from_other_process(self):
+        engine = self.make_engine()
+        conn = engine.connect()
+        dbapi_conn = conn.connection.connection
+        conn.close()
+        # reuse the same connection in the same process
+        conn = engine.connect()
+        self.assertIs(conn.connection.connection, dbapi_conn)
+        conn.close()
+        # we are in a forked child process now
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            conn = engine.connect()
+            self.assertIsNot(conn.connection.connection, dbapi_conn)
+            self.assertEqual(conn.execute('SELECT 1').scalar(), 1)
+            conn.close()
+
+    def test_pre_ping(self):
+        engine = self.make_engine(pre_ping=True)
+        conn = engine.connect()
+        dbapi_conn = conn.connection.connection
+        conn.close()
+        # the connection is closed by the server
+        dbapi_conn.close()
+        conn = engine.connect()
+        self.assertIsNot(conn.connection.connection, dbapi_conn)
+        self.assertEqual(conn.execute('SELECT 1').scalar(), 1)
+        conn.close()
+
+    def test_get_pool_status(self):
+        settings = {
+            'sqlalchemy.url': 'sqlite://',
+            'billy.db.pool_recycle': '3600',
+            'billy.db.pre_ping': 'true',
+        }
+        settings['engine'] = self.make_engine()
+        status = get_pool_status(settings)
+        self.assertEqual(status['pool_class'], 'SingletonThreadPool')
+        self.assertEqual(status['pool_recycle'], 3600)
+        self.assertEqual(status['pre_ping'], True)
@@ -1,18 +1,28 @@
 from __future__ import unicode_literals
+import time
 import datetime
 import unittest
+import threading
+import functools
 
 import mock
 import balanced
+import requests
 import transaction as db_transaction
 from freezegun import freeze_time
 
+from billy.db import tables
 from billy.models.transaction import DuplicateEventError
 from billy.models.processors.base import PaymentProcessor
 from billy.models.processors.balanced_payments import InvalidURIFormat
 from billy.models.processors.balanced_payments import InvalidFundingInstrument
 from billy.models.processors.balanced_payments import InvalidCallbackPayload
 from billy.models.processors.balanced_payments import BalancedProcessor
+from billy.models.processors.balanced_payments import apply_request_options
+from billy.models.processors.balanced_payments import is_unavailable_error
+from billy.utils.circuit_breaker import CircuitBreaker
+from billy.utils.metrics import LatencyMetrics
+from billy.errors import ProcessorUnavailableError
 from billy.tests.unit.helper import ModelTestCase
 from billy.utils.generic import utc_now
 
@@ -194,6 +204,22 @@ class TestBalancedProcessorModel(ModelTestCase):
             self.assertEqual(event.processor_id, expected_ev_id)
             self.assertEqual(event.status, expected_status)
             self.assertEqual(event.occurred_at, expected_time)
+        # the latest event is recorded in the transaction
+        self.assertEqual(self.transaction.last_event_id, 'EV_ID_3')
+        self.assertEqual(self.transaction.last_event_at, time3)
+
+    def test_callback_ordering_without_event_records(self):
+        time1 = utc_now()
+        time2 = time1 + datetime.timedelta(seconds=10)
+        ts = self.transaction_model.statuses
+        self._do_callback('EV_ID_2', 'failed', time2)
+        # events are archived, the ordering should still be kept
+        with db_transaction.manager:
+            self.session.query(tables.TransactionEvent).delete()
+        self._do_callback('EV_ID_1', 'succeeded', time1)
+        transaction = self.transaction_model.get(self.transaction.guid)
+        self.assertEqual(transaction.status, ts.FAILED)
+        self.assertEqual(transaction.last_event_id, 'EV_ID_2')
 
     def test_callback_with_other_company(self):
         with db_transaction.manager:
@@ -211,6 +237,17 @@ class TestBalancedProcessorModel(ModelTestCase):
             update_db = processor.callback(self.company, payload)
             update_db(self.model_factory)
 
+    def test_callback_with_balanced_unavailable(self):
+        server_error = balanced.exc.HTTPError('Oops')
+        server_error.status_code = 503
+        Event = mock.Mock()
+        Event.find.side_effect = server_error
+        payload = self.make_callback_payload()
+        processor = self.make_one(event_cls=Event)
+        # the event might be real, it should not be rejected as invalid
+        with self.assertRaises(balanced.exc.HTTPError):
+            processor.callback(self.company, payload)
+
     def test_register_callback(self):
         url = 'http://foobar.com/callback'
         Callback = mock.Mock()
@@ -501,6 +538,36 @@ class TestBalancedProcessorModel(ModelTestCase):
             api_method_name='credit',
         )
 
+    def test_debit_on_first_attempt(self):
+        tx_model = self.transaction_model
+        with db_transaction.manager:
+            transaction = tx_model.create(
+                invoice=self.invoice,
+                transaction_type=tx_model.types.DEBIT,
+                amount=10,
+                funding_instrument_uri='/v1/credit_card/tester',
+            )
+            transaction.submit_attempts = 1
+            self.session.flush()
+
+        resource = mock.Mock(
+            uri='MOCK_BALANCED_RESOURCE_URI',
+            status='succeeded',
+        )
+        customer = mock.Mock()
+        customer.debit.return_value = resource
+        customer.debit.__name__ = 'debit'
+        Customer = mock.Mock()
+        Customer.find.return_value = customer
+        Resource = mock.Mock()
+
+        processor = self.make_one(customer_cls=Customer, debit_cls=Resource)
+        result = processor.debit(transaction)
+        self.assertEqual(result['processor_uri'], 'MOCK_BALANCED_RESOURCE_URI')
+        # it was never submitted before, no need to look it up in Balanced
+        self.assertFalse(Resource.query.filter.called)
+        self.assertTrue(customer.debit.called)
+
     def _create_refund_transaction(self):
         tx_model = self.transaction_model
         with db_transaction.manager:
@@ -650,3 +717,179 @@ class TestBalancedProcessorModel(ModelTestCase):
         # default to pending when encounter unknown status
         assert_status('unexpected', self.transaction_model.statuses.PENDING)
         assert_status('xxx', self.transaction_model.statuses.PENDING)
+
+    def test_circuit_breaker(self):
+        now = [1000]
+        breaker = CircuitBreaker(
+            failure_threshold=2,
+            reset_timeout=30,
+            timer=lambda: now[0],
+        )
+        BalancedCustomer = mock.Mock()
+        BalancedCustomer.find.side_effect = requests.Timeout('Timeout!')
+        processor = self.make_one(
+            customer_cls=BalancedCustomer,
+            circuit_breaker=breaker,
+        )
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                processor.validate_customer('/v1/customers/xxx')
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        # fail fast without calling Balanced
+        with self.assertRaises(ProcessorUnavailableError):
+            processor.validate_customer('/v1/customers/xxx')
+        self.assertEqual(BalancedCustomer.find.call_count, 2)
+
+        # a trial call is allowed after the reset timeout
+        now[0] += 30
+        BalancedCustomer.find.side_effect = None
+        processor.validate_customer('/v1/customers/xxx')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(BalancedCustomer.find.call_count, 3)
+
+    def test_circuit_breaker_ignores_request_errors(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        BalancedCustomer = mock.Mock()
+        BalancedCustomer.find.side_effect = ValueError('Boom!')
+        processor = self.make_one(
+            customer_cls=BalancedCustomer,
+            circuit_breaker=breaker,
+        )
+        with self.assertRaises(ValueError):
+            processor.prepare_customer(self.customer, '/v1/cards/tester')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_is_unavailable_error(self):
+        server_error = balanced.exc.HTTPError('Oops')
+        server_error.status_code = 503
+        declined = balanced.exc.HTTPError('Declined')
+        declined.status_code = 402
+        self.assertTrue(is_unavailable_error(server_error))
+        self.assertTrue(is_unavailable_error(requests.Timeout()))
+        self.assertTrue(is_unavailable_error(requests.ConnectionError()))
+        self.assertFalse(is_unavailable_error(declined))
+        self.assertFalse(is_unavailable_error(ValueError()))
+
+    def test_timeout(self):
+        timeouts = []
+
+        def find(uri):
+            kwargs = {}
+            apply_request_options(None, None, uri, kwargs)
+            timeouts.append(kwargs.get('timeout'))
+
+        BalancedCustomer = mock.Mock()
+        BalancedCustomer.find.side_effect = find
+        processor = self.make_one(customer_cls=BalancedCustomer, timeout=5)
+        processor.validate_customer('/v1/customers/xxx')
+        # no timeout out of calls
+        find('/v1/customers/xxx')
+        self.assertEqual(timeouts, [5, None])
+
+    def test_api_key_of_concurrent_calls(self):
+        with db_transaction.manager:
+            other_company = self.company_model.create('other_secret_key')
+        used_api_keys = {}
+        first_call_entered = threading.Event()
+        second_call_done = threading.Event()
+
+        def find(uri):
+            if uri == '/v1/customers/first':
+                # hold the first call until the second one is done
+                first_call_entered.set()
+                second_call_done.wait(5)
+            kwargs = {}
+            apply_request_options(None, None, uri, kwargs)
+            used_api_keys[uri] = kwargs.get('auth')
+
+        BalancedCustomer = mock.Mock()
+        BalancedCustomer.find.side_effect = find
+        first_processor = self.make_one(
+            configure_api_key=False,
+            customer_cls=BalancedCustomer,
+        )
+        first_processor.configure_api_key(self.company.processor_key)
+        second_processor = self.make_one(
+            configure_api_key=False,
+            customer_cls=BalancedCustomer,
+        )
+        second_processor.configure_api_key(other_company.processor_key)
+
+        thread = threading.Thread(
+            target=first_processor.validate_customer,
+            args=('/v1/customers/first', ),
+        )
+        thread.start()
+        first_call_entered.wait(5)
+        second_processor.validate_customer('/v1/customers/second')
+        second_call_done.set()
+        thread.join()
+        # no API key out of calls
+        find('/v1/customers/other')
+        self.assertEqual(used_api_keys, {
+            '/v1/customers/first': ('my_secret_key', None),
+            '/v1/customers/second': ('other_secret_key', None),
+            '/v1/customers/other': None,
+        })
+
+    def test_validate_many_of_companies_concurrently(self):
+        with db_transaction.manager:
+            other_company = self.company_model.create('other_secret_key')
+        used_api_keys = {}
+
+        def find(uri):
+            kwargs = {}
+            apply_request_options(None, None, uri, kwargs)
+            used_api_keys[uri] = kwargs['auth'][0]
+            # give other threads a chance to run in the middle of the call
+            time.sleep(0.001)
+
+        BalancedCustomer = mock.Mock()
+        BalancedCustomer.find.side_effect = find
+        self.model_factory.processor_factory = functools.partial(
+            BalancedProcessor,
+            customer_cls=BalancedCustomer,
+        )
+        processor_uris = {}
+        for company in [self.company, other_company]:
+            processor_uris[company.processor_key] = [
+                '/v1/customers/{}/{}'.format(company.processor_key, i)
+                for i in range(20)
+            ]
+
+        def validate(company):
+            self.customer_model.validate_many(
+                company,
+                processor_uris[company.processor_key],
+                concurrency=4,
+            )
+
+        threads = [
+            threading.Thread(target=validate, args=(company, ))
+            for company in [self.company, other_company]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expected = {}
+        for api_key, uris in processor_uris.iteritems():
+            for uri in uris:
+                expected[uri] = api_key
+        self.assertEqual(used_api_keys, expected)
+
+    def test_latency_metrics(self):
+        metrics = LatencyMetrics()
+        BalancedCustomer = mock.Mock()
+        processor = self.make_one(
+            customer_cls=BalancedCustomer,
+            metrics=metrics,
+        )
+        processor.validate_customer('/v1/customers/xxx')
+        BalancedCustomer.find.side_effect = requests.Timeout('Timeout!')
+        with self.assertRaises(requests.Timeout):
+            processor.validate_customer('/v1/customers/xxx')
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot.keys(), ['validate_customer'])
+        self.assertEqual(snapshot['validate_customer']['count'], 2)
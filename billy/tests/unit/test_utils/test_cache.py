@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+import unittest
+
+from billy.utils.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+
+        def timer():
+            return self.now
+
+        self.cache = TTLCache(ttl=10, max_size=3, timer=timer)
+
+    def test_get_and_set(self):
+        self.assertEqual(self.cache.get('foo'), None)
+        self.assertEqual(self.cache.get('foo', 'default'), 'default')
+        self.cache.set('foo', 'bar')
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.cache.set('foo', 'baz')
+        self.assertEqual(self.cache.get('foo'), 'baz')
+        self.assertEqual(len(self.cache), 1)
+
+    def test_expire(self):
+        self.cache.set('foo', 'bar')
+        self.now = 9
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.now = 10
+        self.assertEqual(self.cache.get('foo'), None)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evict_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        # a is used, so b is the least recently used one now
+        self.cache.get('a')
+        self.cache.set('d', 4)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual(self.cache.get('d'), 4)
+
+    def test_delete_and_clear(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.delete('a')
+        self.cache.delete('not exist')
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.get('b'), 2)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+import unittest
+
+from billy.utils.circuit_breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+
+        def timer():
+            return self.now
+
+        self.breaker = CircuitBreaker(
+            failure_threshold=3,
+            reset_timeout=10,
+            timer=timer,
+        )
+
+    def test_open(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
+        # success resets the consecutive failures
+        self.breaker.record_success()
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.now = 9
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now = 10
+        # only one trial call is allowed
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, self.breaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        # the trial call failed, open again
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open_with_lost_trial_call(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        # the trial call never reports back
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+
+    def test_status(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.status(), dict(
+            state=self.breaker.CLOSED,
+            failure_count=1,
+            failure_threshold=3,
+            reset_timeout=10,
+        ))
@@ -4,6 +4,8 @@ import unittest
 import tempfile
 from decimal import Decimal
 
+import mock
+
 from billy.utils.generic import make_guid
 from billy.utils.generic import make_api_key
 from billy.utils.generic import round_down_cent
@@ -22,11 +24,64 @@ class TestGenericUtils(unittest.TestCase):
         assert_encode('\00', '1')
         assert_encode('hello world', 'StV1DL6CwTryKyV')
 
+    def test_b58encode_is_compatible(self):
+        from billy.utils.generic import b58encode
+        from billy.utils.generic import B58_CHARS
+
+        def slow_b58encode(s):
+            # the original implementation
+            value = 0
+            for i, c in enumerate(reversed(s)):
+                value += ord(c) * (256 ** i)
+            result = []
+            while value >= len(B58_CHARS):
+                value, mod = divmod(value, len(B58_CHARS))
+                result.append(B58_CHARS[mod])
+            result.append(B58_CHARS[value])
+            return ''.join(reversed(result))
+
+        for size in range(33):
+            for _ in range(20):
+                data = os.urandom(size)
+                self.assertEqual(b58encode(data), slow_b58encode(data))
+        for value in [57, 58, 3363, 3364, 3365]:
+            data = chr(value >> 8) + chr(value & 0xff)
+            self.assertEqual(b58encode(data), slow_b58encode(data))
+
+    def test_b58encode_int(self):
+        from billy.utils.generic import b58encode_int
+
+        self.assertEqual(b58encode_int(0), '1')
+        self.assertEqual(b58encode_int(57), 'z')
+        self.assertEqual(b58encode_int(58), '21')
+        self.assertEqual(b58encode_int(58, width=4), '1121')
+
     def test_make_guid(self):
         # just make sure it is random
         guids = [make_guid() for _ in range(100)]
         self.assertEqual(len(set(guids)), 100)
 
+    def test_make_time_ordered_guid(self):
+        from billy.utils.generic import set_guid_mode
+
+        set_guid_mode('time_ordered')
+        try:
+            guids = []
+            for i in range(100):
+                with mock.patch('time.time', return_value=1392000000 + i):
+                    guids.append(make_guid())
+        finally:
+            set_guid_mode('uuid1')
+        self.assertEqual(len(set(guids)), 100)
+        self.assertEqual(sorted(guids), guids)
+        self.assertEqual(set(len(guid) for guid in guids), set([22]))
+
+    def test_set_guid_mode_with_unknown_mode(self):
+        from billy.utils.generic import set_guid_mode
+
+        with self.assertRaises(ValueError):
+            set_guid_mode('foobar')
+
     def test_make_api_key(self):
         # just make sure it is random
         api_keys = [make_api_key() for _ in range(1000)]
@@ -83,3 +138,29 @@ class TestGenericUtils(unittest.TestCase):
     def test_get_git_rev_without_file_existing(self):
         temp_dir = tempfile.mkdtemp()
         self.assertEqual(get_git_rev(temp_dir), None)
+
+    def test_map_concurrently(self):
+        import threading
+        from billy.utils.generic import map_concurrently
+
+        thread_names = set()
+
+        def square(value):
+            thread_names.add(threading.current_thread().name)
+            return value * value
+
+        self.assertEqual(map_concurrently(square, [], 4), [])
+        self.assertEqual(map_concurrently(square, range(5), 1),
+                         [0, 1, 4, 9, 16])
+        self.assertEqual(thread_names,
+                         set([threading.current_thread().name]))
+        self.assertEqual(map_concurrently(square, range(100), 4),
+                         [value * value for value in range(100)])
+
+        def boom(value):
+            if value == 50:
+                raise KeyError(value)
+            return value
+
+        with self.assertRaises(KeyError):
+            map_concurrently(boom, range(100), 4)
@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+import unittest
+
+from billy.utils.metrics import LatencyMetrics
+
+
+class TestLatencyMetrics(unittest.TestCase):
+
+    def test_observe(self):
+        metrics = LatencyMetrics(buckets=(0.1, 1))
+        self.assertEqual(metrics.snapshot(), {})
+        metrics.observe('debit', 0.05)
+        metrics.observe('debit', 0.5)
+        metrics.observe('debit', 5)
+        metrics.observe('credit', 1)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(set(snapshot), set(['debit', 'credit']))
+        self.assertEqual(snapshot['debit']['count'], 3)
+        self.assertAlmostEqual(snapshot['debit']['sum'], 5.55)
+        self.assertEqual(snapshot['debit']['buckets'].items(), [
+            ('0.1', 1),
+            ('1', 2),
+            ('+Inf', 3),
+        ])
+        self.assertEqual(snapshot['credit']['buckets'].items(), [
+            ('0.1', 0),
+            ('1', 1),
+            ('+Inf', 1),
+        ])
+
+        metrics.clear()
+        self.assertEqual(metrics.snapshot(), {})
@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+import time
+import threading
+import collections
+
+
+class TTLCache(object):
+    """A thread-safe in-memory cache, items expire after given seconds, and
+    the least recently used items are evicted when the cache is full
+
+    """
+
+    def __init__(self, ttl, max_size, timer=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timer = timer
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get value of given key, default will be returned if it is not in
+        the cache or it is expired
+
+        """
+        with self._lock:
+            try:
+                expires_at, value = self._items.pop(key)
+            except KeyError:
+                return default
+            if expires_at <= self.timer():
+                return default
+            # put it back to the end, as it's the most recently used one
+            self._items[key] = (expires_at, value)
+            return value
+
+    def set(self, key, value):
+        """Set value of given key
+
+        """
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (self.timer() + self.ttl, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        """Remove given key from the cache
+
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Remove all items from the cache
+
+        """
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+import time
+import threading
+
+
+class CircuitBreaker(object):
+    """A thread-safe circuit breaker, after `failure_threshold` consecutive
+    failures, the circuit opens and calls are rejected for `reset_timeout`
+    seconds, then one trial call is allowed (half-open), the circuit will be
+    closed if it succeeds, otherwise it opens again
+
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout, timer=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return whether a call is allowed now
+
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # when it's half-open, the trial call is still in flight, but
+            # we allow another one if it takes too long, as the caller might
+            # never report back
+            if self.timer() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.opened_at = self.timer()
+            return True
+
+    def record_success(self):
+        """Record a successful call
+
+        """
+        with self._lock:
+            self.state = self.CLOSED
+            self.failure_count = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Record a failed call
+
+        """
+        with self._lock:
+            self.failure_count += 1
+            if (
+                self.state == self.HALF_OPEN or
+                self.failure_count >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = self.timer()
+
+    def status(self):
+        """Get current status of the circuit
+
+        """
+        with self._lock:
+            return dict(
+                state=self.state,
+                failure_count=self.failure_count,
+                failure_threshold=self.failure_threshold,
+                reset_timeout=self.reset_timeout,
+            )
@@ -1,13 +1,21 @@
 from __future__ import unicode_literals
 import os
+import sys
+import time
+import Queue
+import threading
 import uuid
 import json
+import binascii
 import datetime
 
 import pytz
 
 B58_CHARS = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 B58_BASE = len(B58_CHARS)
+# all two-digit combinations, for encoding two digits at a time
+B58_PAIRS = [a + b for a in B58_CHARS for b in B58_CHARS]
+B58_PAIR_BASE = len(B58_PAIRS)
 
 
 def b58encode(s):
@@ -19,25 +27,88 @@ def b58encode(s):
 
     """
     value = 0
-    for i, c in enumerate(reversed(s)):
-        value += ord(c) * (256 ** i)
+    if s:
+        value = int(binascii.hexlify(s), 16)
+    return b58encode_int(value)
 
+
+def b58encode_int(value, width=0):
+    """Do a base 58 encoding of an non-negative integer, the result will be
+    left padded with zero digit to given width
+
+    """
+    # encode two digits at a time, it saves half of the big integer
+    # divisions
     result = []
-    while value >= B58_BASE:
-        div, mod = divmod(value, B58_BASE)
-        c = B58_CHARS[mod]
-        result.append(c)
-        value = div
-    result.append(B58_CHARS[value])
-    return ''.join(reversed(result))
+    while value >= B58_PAIR_BASE:
+        value, mod = divmod(value, B58_PAIR_BASE)
+        result.append(B58_PAIRS[mod])
+    if value >= B58_BASE:
+        result.append(B58_PAIRS[value])
+    else:
+        result.append(B58_CHARS[value])
+    encoded = ''.join(reversed(result))
+    if len(encoded) < width:
+        encoded = B58_CHARS[0] * (width - len(encoded)) + encoded
+    return encoded
+
+
+def make_uuid1_guid():
+    """Generate a GUID from UUID1 and return in base58 encoded form
+
+    """
+    return b58encode_int(uuid.uuid1().int)
+
+
+def make_time_ordered_guid():
+    """Generate a GUID starts with current timestamp in milliseconds
+    followed by random bits and return in base58 encoded form. The encoded
+    GUIDs are in fixed width, so that newer ones are always greater than
+    older ones (generated in different milliseconds), which makes them
+    inserted at the right-hand edge of B-tree indexes
+
+    """
+    timestamp = int(time.time() * 1000) & TIMESTAMP_MASK
+    random = int(binascii.hexlify(os.urandom(RANDOM_BITS // 8)), 16)
+    value = (timestamp << RANDOM_BITS) | random
+    return b58encode_int(value, width=TIME_ORDERED_GUID_WIDTH)
+
+
+#: bits of the timestamp in time-ordered GUID
+TIMESTAMP_BITS = 48
+TIMESTAMP_MASK = (1 << TIMESTAMP_BITS) - 1
+#: bits of the random part in time-ordered GUID
+RANDOM_BITS = 80
+#: length of encoded time-ordered GUID (it's 128 bits)
+TIME_ORDERED_GUID_WIDTH = len(b58encode_int(
+    (1 << (TIMESTAMP_BITS + RANDOM_BITS)) - 1
+))
+
+#: available modes of GUID generation
+GUID_MODES = dict(
+    uuid1=make_uuid1_guid,
+    time_ordered=make_time_ordered_guid,
+)
+
+_guid_func = make_uuid1_guid
+
+
+def set_guid_mode(mode):
+    """Set the mode of GUID generation, could be `uuid1` or
+    `time_ordered`
+
+    """
+    global _guid_func
+    if mode not in GUID_MODES:
+        raise ValueError('Unknown GUID mode {}'.format(mode))
+    _guid_func = GUID_MODES[mode]
 
 
 def make_guid():
     """Generate a GUID and return in base58 encoded form
 
     """
-    uid = uuid.uuid1().bytes
-    return b58encode(uid)
+    return _guid_func()
 
 
 def make_api_key(size=32):
@@ -57,6 +128,46 @@ def make_api_key(size=32):
     return b58encode(random)
 
 
+def map_concurrently(func, items, concurrency):
+    """Call func with each of given items in a pool of `concurrency`
+    threads and return results in the same order as items, the first
+    exception raised by func will be re-raised
+
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return map(func, items)
+    results = [None] * len(items)
+    errors = []
+    indexes = Queue.Queue()
+    for index in range(len(items)):
+        indexes.put(index)
+
+    def worker():
+        while not errors:
+            try:
+                index = indexes.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                results[index] = func(items[index])
+            except BaseException:
+                errors.append(sys.exc_info())
+
+    workers = [
+        threading.Thread(target=worker)
+        for _ in range(min(concurrency, len(items)))
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        exc_type, exc_value, exc_tb = errors[0]
+        raise exc_type, exc_value, exc_tb
+    return results
+
+
 def round_down_cent(amount):
     """Round down money value in cent (drop float points), for example, 5.66666
     cents will be rounded to 5 cents
@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+import threading
+import collections
+
+
+#: the default upper bounds (in seconds) of latency histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies, counts of observations are kept in buckets
+    by their upper bounds
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Add an observation
+
+        """
+        for index, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        """Get count, sum and cumulative counts of buckets (keyed by the
+        upper bound) of the histogram
+
+        """
+        buckets = collections.OrderedDict()
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[str(upper_bound)] = cumulative
+        buckets['+Inf'] = self.count
+        return dict(count=self.count, sum=self.sum, buckets=buckets)
+
+
+class LatencyMetrics(object):
+    """A thread-safe collection of latency histograms by name
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        """Add an observation to the histogram of given name
+
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram(self.buckets)
+                self._histograms[name] = histogram
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Get snapshots of all histograms in a dict by name
+
+        """
+        with self._lock:
+            return dict(
+                (name, histogram.snapshot())
+                for name, histogram in self._histograms.iteritems()
+            )
+
+    def clear(self):
+        """Remove all histograms
+
+        """
+        with self._lock:
+            self._histograms.clear()
+
+
+#: latencies of calls to the payment processor by method name
+processor_latency = LatencyMetrics()
@@ -43,5 +43,8 @@ setup(
     [console_scripts]
     initialize_billy_db = billy.scripts.initializedb:main
     process_billy_tx = billy.scripts.process_transactions:main
+    import_billy_customers = billy.scripts.import_customers:main
+    billy_tx_worker = billy.scripts.transaction_worker:main
+    billy_callback_worker = billy.scripts.callback_worker:main
     """,
 )